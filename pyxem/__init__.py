@@ -18,10 +18,12 @@
 
 import glob
 import logging
+import multiprocessing
 import os
 import warnings
 
 import numpy as np
+import dask.array as da
 from hyperspy.drawing.marker import markers_metadata_dict_to_markers
 from hyperspy.exceptions import VisibleDeprecationWarning
 from hyperspy.io import load_with_reader
@@ -41,12 +43,15 @@ from .generators.library_generator import DiffractionLibraryGenerator
 from .signals.crystallographic_map import CrystallographicMap
 from .signals.diffraction_profile import ElectronDiffractionProfile
 from .signals.electron_diffraction import ElectronDiffraction
+from .signals.electron_diffraction import LazyElectronDiffraction
 from .signals.diffraction_simulation import DiffractionSimulation
 from .signals.diffraction_vectors import DiffractionVectors
+from .signals.sparse_electron_diffraction import SparseElectronDiffraction
 from .signals.vdf_image import VDFImage
 
 from .io_plugins import io_plugins, default_write_ext
 from .io_plugins import mib as mib_reader
+from .utils.expt_utils import apply_gain_correction
 
 _logger = logging.getLogger(__name__)
 
@@ -503,24 +508,232 @@ def save(filename, signal, overwrite=None, **kwds):
             signal.tmp_parameters.set_item('extension', extension)
 
 
-def load_mib(filename, scan_size):
+def load_mib(filename, scan_size, lazy=False, chunks=None, sparse=False,
+             gain_correction=None):
     """
     Load medipix file.
     Paramters:
         filename : string
             File path and name
-        scan_size : int
+        scan_size : int or tuple of int
             Scan size in pixels, allows the function to reshape the array into
-            the right shape.
+            the right shape. Either a single integer for square scans or
+            (scan_x, scan_y).
+        lazy : bool
+            If True the data is read lazily, frame block by frame block, and
+            a LazyElectronDiffraction is returned. Allows opening datasets
+            larger than the available memory.
+        chunks : int
+            Number of scan rows per chunk when `lazy` is True. If None, chunks
+            of roughly 32 MB are used.
+        sparse : bool
+            If True the frames are read chunk by chunk and stored as counting
+            events in a SparseElectronDiffraction, without ever holding the
+            dense data in memory.
+        gain_correction : tuple of np.array, optional
+            The (gain, offset) maps returned by
+            `pyxem.utils.expt_utils.get_gain_correction`. If given, the gain
+            normalisation is applied to every block of frames as it is read,
+            and float32 data are returned.
+
+    Notes
+    -----
+    The first scan row and the flyback column are removed. The flyback column
+    is found from the frame time stamps if the frame index of the file has
+    been built (see `pyxem.io_plugins.mib.index_mib`), otherwise from the
+    intensity of the first scan rows. Only the frames needed for this are
+    read, and the data are decoded into native byte order block by block
+    without intermediate copies of the whole file.
 
     """
-    dpt = load_with_reader(filename=filename, reader=mib_reader)
-    dpt = ElectronDiffraction(dpt.data.reshape((scan_size, scan_size, 256, 256)))
-    trace = dpt.inav[:,0:5].sum((1,2,3))
-    edge = np.where(trace==max(trace.data))[0][0]
-    if edge==scan_size - 1:
-        dp = ElectronDiffraction(dpt.inav[0:edge, 1:])
-    else:
-        dp = ElectronDiffraction(np.concatenate((dpt.inav[edge + 1:, 1:], dpt.inav[0:edge, 1:]), axis=1))
+    if sparse:
+        return SparseElectronDiffraction.from_signal(
+            load_mib(filename, scan_size, lazy=True, chunks=chunks,
+                     gain_correction=gain_correction))
+    if np.ndim(scan_size) == 0:
+        scan_size = (scan_size, scan_size)
+    scan_x, scan_y = scan_size
+    hdr_info = mib_reader.read_hdr(filename)
+    rawfname = mib_reader._mib_filename(filename)
+    if hdr_info['depth'] < scan_x * scan_y:
+        raise ValueError('The file contains {} frames which is less than the '
+                         'scan size {}.'.format(hdr_info['depth'], scan_size))
+
+    edge = _find_mib_flyback(hdr_info, rawfname, scan_x)
+
+    if lazy:
+        if chunks is None:
+            chunks = max(1, mib_reader._get_frame_chunks(hdr_info) // scan_x)
+        # Align the frame chunks with the scan rows so that the reshape below
+        # does not need any rechunking.
+        frames = mib_reader.read_mib_lazy(hdr_info, rawfname,
+                                          chunks=chunks * scan_x)
+        frames = frames[:scan_x * scan_y]
+        data = frames.reshape((scan_y, scan_x) + frames.shape[1:])
+        if edge == scan_x - 1:
+            data = data[1:, 0:edge]
+        else:
+            data = da.concatenate((data[1:, edge + 1:], data[1:, 0:edge]),
+                                  axis=1)
+        if gain_correction is not None:
+            gain, offset = gain_correction
+            data = data.map_blocks(apply_gain_correction, gain=gain,
+                                   offset=offset, dtype=np.float32)
+        return LazyElectronDiffraction(data)
+
+    # Decode blocks of scan rows straight into the rolled output.
+    data_type = mib_reader._get_frame_layout(hdr_info)[0]
+    if gain_correction is not None:
+        data_type = np.float32
+    frame_shape = (hdr_info['height'], hdr_info['width'])
+    data = np.empty((scan_y - 1, scan_x - 1) + frame_shape, dtype=data_type)
+    rows = max(1, mib_reader._get_frame_chunks(hdr_info) // scan_x)
+    for start in range(1, scan_y, rows):
+        stop = min(start + rows, scan_y)
+        block = mib_reader._read_frames(rawfname, hdr_info, start * scan_x,
+                                        stop * scan_x)
+        block = block.reshape((stop - start, scan_x) + frame_shape)
+        if gain_correction is not None:
+            block = apply_gain_correction(block, *gain_correction)
+        data[start - 1:stop - 1, :scan_x - edge - 1] = block[:, edge + 1:]
+        data[start - 1:stop - 1, scan_x - edge - 1:] = block[:, 0:edge]
+    return ElectronDiffraction(data)
+
+
+def _find_mib_flyback(hdr_info, rawfname, scan_x, rows=5):
+    """Find the column of the flyback frames in a mib scan.
+
+    The frame index is used when available. Otherwise the flyback frames are
+    identified as the brightest column of the first `rows` scan rows, which
+    are the only frames read from the file.
+    """
+    if os.path.exists(mib_reader._index_filename(rawfname)):
+        index = mib_reader.load_mib_index(rawfname, hdr_info=hdr_info)
+        column = mib_reader.find_flyback(index, scan_x)
+        if column is not None:
+            # The time stamps mark the first frame after the flyback.
+            return (column - 1) % scan_x
+    rows = min(rows, hdr_info['depth'] // scan_x)
+    frames = mib_reader._read_frames(rawfname, hdr_info, 0, rows * scan_x)
+    trace = frames.sum(axis=(1, 2), dtype=np.float64)
+    trace = trace.reshape(rows, scan_x).sum(axis=0)
+    return np.where(trace == max(trace))[0][0]
+
+
+def convert_mib(filename, output, scan_size, chunks=1,
+                compression='gzip', compression_opts=4, shuffle=True,
+                processes=None, overwrite=None):
+    """Convert a Medipix hdr/mib pair to a chunked, compressed file.
+
+    Blocks of frames are read and decoded in parallel worker processes. The
+    chunks of the output file are aligned with the scan rows, so that later
+    processing reads whole chunks.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the hdr file.
+    output : str
+        Name of the output file. Files ending in '.zarr' are written as a
+        zarr store (requires `zarr` and `numcodecs`), anything else as hspy.
+    scan_size : int or tuple of int
+        Scan size, see `load_mib`.
+    chunks : int
+        Number of scan rows per chunk.
+    compression : str or int or None
+        Compression filter of the hspy file, passed to h5py. Besides 'gzip'
+        and 'lzf', the filters registered by `hdf5plugin` can be used. Zarr
+        stores are always compressed with blosc (zstd, bitshuffle).
+    compression_opts : int
+        Compression level, for gzip and zarr.
+    shuffle : bool
+        Apply the byte shuffle filter before compression (hspy only).
+    processes : int, optional
+        Number of worker processes, by default the number of CPUs.
+    overwrite : None or bool
+        If None, if the file exists it will query the user. If True (False)
+        it (does not) overwrite the file if it exists.
+
+    Notes
+    -----
+    The worker processes compress the chunks of zarr stores. For hspy files,
+    the compression is done by the HDF5 filters while the decoded blocks are
+    written, in the main process.
+
+    See also
+    --------
+    load_mib
 
-    return dp
+    """
+    if os.path.exists(output) and overwrite is not True:
+        if overwrite is None:
+            overwrite = overwrite_method(output)
+        if not overwrite:
+            return
+
+    dp = load_mib(filename, scan_size, lazy=True, chunks=chunks)
+    data = dp.data.rechunk((chunks,) + dp.data.shape[1:])
+    blocks = [(data[i:i + chunks], i) for i in range(0, data.shape[0], chunks)]
+    chunk_shape = data.chunksize
+
+    if output.endswith('.zarr'):
+        import zarr
+        from numcodecs import Blosc
+        compressor = Blosc(cname='zstd', clevel=compression_opts,
+                           shuffle=Blosc.BITSHUFFLE)
+        store = zarr.open(output, mode='w', shape=data.shape,
+                          chunks=chunk_shape, dtype=data.dtype,
+                          compressor=compressor)
+        axes = []
+        for axis in dp.axes_manager._axes:
+            axes.append({'size': axis.size,
+                         'scale': float(axis.scale),
+                         'offset': float(axis.offset),
+                         'navigate': axis.navigate})
+            for key in ('name', 'units'):
+                if isinstance(getattr(axis, key), str):
+                    axes[-1][key] = getattr(axis, key)
+        store.attrs['axes'] = axes
+        store.attrs['signal_type'] = dp._signal_type
+        tasks = [(block, i, output) for block, i in blocks]
+        with multiprocessing.Pool(processes) as pool:
+            for _ in pool.imap_unordered(_write_zarr_block, tasks):
+                pass
+        return
+
+    # Write the metadata and axes through the hspy writer using a single
+    # pattern, then replace the dataset by the full, chunked one.
+    import h5py
+    if compression == 'gzip':
+        options = {'compression_opts': compression_opts}
+    else:
+        options = {}
+    save(output, dp.inav[:1, :1], overwrite=True)
+    with h5py.File(output, 'r+') as f:
+        experiment = [g for g in f['Experiments'].values()
+                      if isinstance(g, h5py.Group) and 'data' in g][0]
+        for key in experiment:
+            if key.startswith('axis-'):
+                axis = experiment[key]
+                axis.attrs['size'] = data.shape[int(key[5:])]
+        del experiment['data']
+        dset = experiment.create_dataset(
+            'data', shape=data.shape, dtype=data.dtype, chunks=chunk_shape,
+            compression=compression, shuffle=shuffle, **options)
+        with multiprocessing.Pool(processes) as pool:
+            for block, i in pool.imap_unordered(_read_block, blocks):
+                dset[i:i + block.shape[0]] = block
+
+
+def _write_zarr_block(task):
+    """Read a block of frames and write it into a zarr store."""
+    import zarr
+    block, i, output = task
+    store = zarr.open(output, mode='r+')
+    store[i:i + block.shape[0]] = block.compute(scheduler='synchronous')
+
+
+def _read_block(task):
+    """Read and decode a block of frames."""
+    block, i = task
+    return block.compute(scheduler='synchronous'), i
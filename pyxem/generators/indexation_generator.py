@@ -29,8 +29,6 @@ from pyxem.signals.indexation_results import IndexationResults
 from pyxem.utils import correlate
 from pyxem.utils.indexation_utils import index_magnitudes
 
-import hyperspy.api as hs
-
 def correlate_library(image, library,n_largest,mask,keys=[]):
     """Correlates all simulated diffraction templates in a DiffractionLibrary
     with a particular experimental diffraction pattern (image) stored as a
@@ -98,8 +96,11 @@ class IndexationGenerator():
             phase.  For example, keys = ['si','ga'] will have an output with 0
             for 'si' and 1 for 'ga'.
         mask : Array
-            Array with the same size as signal (in navigation) True False 
-            
+            Array with the same size as signal (in navigation), True (or 1)
+            for the patterns to be indexed. Only these patterns are
+            correlated; the others are given the library number
+            len(library) + 1 and zero correlations.
+
         **kwargs
             Keyword arguments passed to the HyperSpy map() function.
 
@@ -115,17 +116,30 @@ class IndexationGenerator():
         signal = self.signal
         library = self.library
         if mask is None:
-           #index at all real space pixels
-           sig_shape = signal.axes_manager.navigation_shape 
-           mask = hs.signals.Signal1D(np.ones((sig_shape[0],sig_shape[1],1)))
-           
-        matching_results = signal.map(correlate_library,
-                                      library=library,
-                                      n_largest=n_largest,
-                                      keys=keys,
-                                      mask=mask,
-                                      inplace=False,
-                                      **kwargs)
+            #index at all real space pixels
+            matching_results = signal.map(correlate_library,
+                                          library=library,
+                                          n_largest=n_largest,
+                                          keys=keys,
+                                          mask=1,
+                                          inplace=False,
+                                          **kwargs)
+            return IndexationResults(matching_results)
+
+        # Correlate only the selected patterns and scatter the results back.
+        mask = np.asarray(getattr(mask, 'data', mask))
+        compact, keep = signal._get_compact_signal(mask == 0)
+        matching_results = compact.map(correlate_library,
+                                       library=library,
+                                       n_largest=n_largest,
+                                       keys=keys,
+                                       mask=1,
+                                       inplace=False,
+                                       **kwargs)
+        fill_value = correlate_library(None, library, n_largest, mask=0)
+        matching_results = signal._scatter_compact_signal(
+            matching_results, keep, fill_value=0)
+        matching_results.data[~keep] = fill_value
         return IndexationResults(matching_results)
 
 
@@ -18,12 +18,14 @@
 
 import codecs
 import os.path
+import time
 from io import StringIO
 import logging
 
 import numpy as np
+import dask.array as da
+from dask.base import tokenize
 
-from hyperspy.misc.io.utils_readfile import *
 from hyperspy import Release
 from hyperspy.misc.utils import DictionaryTreeBrowser
 
@@ -166,7 +168,224 @@ def parse_hdr(fp):
     return hdr_info
 
 
-def read_mib(hdr_info, fp, mmap_mode='c'):
+# Bits per pixel of the raw (R64) format for every counter depth. In 24-bit
+# mode every frame is stored as two 12-bit frames.
+raw_bits = {1: 1, 6: 8, 12: 16, 24: 16}
+
+
+def _is_raw(hdr_info):
+    """Whether the frames are stored in the packed raw (R64) format."""
+    if 'pixel-depth' in hdr_info:
+        return hdr_info['pixel-depth'] == 'R64'
+    # Without frame header the packed modes are recognised by their depth.
+    return int(hdr_info['data-length']) in (1, 24)
+
+
+def _get_counter_depth(hdr_info):
+    return int(hdr_info.get('Counter Depth (number)',
+                            hdr_info['data-length']))
+
+
+def _get_stored_dtype(hdr_info):
+    """The dtype of the pixel values as stored in the file."""
+    if _is_raw(hdr_info):
+        bits = raw_bits[_get_counter_depth(hdr_info)]
+        return np.dtype('>u%d' % max(bits // 8, 1))
+    data_type = hdr_info['data-type']
+    if data_type == 'signed':
+        data_type = 'int'
+    elif data_type == 'unsigned':
+        data_type = 'uint'
+    elif data_type == 'float':
+        pass
+    else:
+        raise TypeError('Unknown "data-type" string.')
+    if 'pixel-depth' in hdr_info:
+        data_length = int(hdr_info['pixel-depth'][1:])
+    else:
+        data_length = int(hdr_info['data-length'])
+    data_type = np.dtype(data_type + str(data_length))
+    return data_type.newbyteorder('>')
+
+
+def _get_frame_layout(hdr_info):
+    """Work out how the frames of a mib file are laid out on disk.
+
+    Parameters
+    ----------
+    hdr_info: dict
+        A dictionary containing the keywords as parsed by parse_hdr.
+
+    Returns
+    -------
+    data_type : numpy.dtype
+        The dtype of the decoded pixel values, in native byte order.
+    header_bytes : int
+        The size of the header preceding every frame, in bytes.
+    data_bytes : int
+        The size of the data of every frame, in bytes.
+    """
+    width_height = hdr_info['width'] * hdr_info['height']
+    header_bytes = hdr_info.get('frame-header-size', 384)
+    if _is_raw(hdr_info):
+        counter_depth = _get_counter_depth(hdr_info)
+        data_bytes = width_height * raw_bits[counter_depth] // 8
+        if counter_depth == 24:
+            # Two 12-bit frames, the second one with its own header.
+            data_bytes = 2 * data_bytes + header_bytes
+            data_type = np.dtype('uint32')
+        else:
+            data_type = np.dtype('uint%d' % max(raw_bits[counter_depth], 8))
+    else:
+        stored = _get_stored_dtype(hdr_info)
+        data_bytes = width_height * stored.itemsize
+        data_type = stored.newbyteorder('=')
+    return data_type, header_bytes, data_bytes
+
+
+def _unpack_raw(raw, counter_depth, dtype):
+    """Unpack frames stored in the raw format.
+
+    The raw format is a stream of big-endian 64-bit words, with the first
+    pixel of every word in its least significant bits.
+
+    Parameters
+    ----------
+    raw : np.array
+        Array of shape (frames, bytes) with the frame data as uint8.
+    counter_depth : int
+        The counter depth in bits, one of 1, 6 or 12.
+    dtype : numpy.dtype
+        The dtype of the unpacked pixel values.
+
+    Returns
+    -------
+    pixels : np.array
+        Array of shape (frames, pixels).
+    """
+    n = len(raw)
+    if counter_depth == 1:
+        bits = np.unpackbits(raw, axis=-1)
+        return bits.reshape(n, -1, 64)[:, :, ::-1].reshape(n, -1)
+    stored = np.dtype('>u%d' % (raw_bits[counter_depth] // 8))
+    words = np.ascontiguousarray(raw).view(stored)
+    words = words.reshape(n, -1, 8 // stored.itemsize)[:, :, ::-1]
+    return words.reshape(n, -1).astype(dtype)
+
+
+def _decode_frames(raw, hdr_info):
+    """Decode frame data into native pixel values.
+
+    Parameters
+    ----------
+    raw : np.array
+        Array of shape (frames, data_bytes) with the frame data as uint8,
+        i.e. with the frame headers removed.
+    hdr_info : dict
+        A dictionary containing the keywords as parsed by parse_hdr.
+
+    Returns
+    -------
+    frames : np.array
+        Array of shape (frames, height, width) in native byte order.
+    """
+    data_type, header_bytes, data_bytes = _get_frame_layout(hdr_info)
+    shape = (len(raw), hdr_info['height'], hdr_info['width'])
+    if not _is_raw(hdr_info):
+        stored = _get_stored_dtype(hdr_info)
+        frames = np.ascontiguousarray(raw).view(stored).astype(data_type)
+        return frames.reshape(shape)
+    counter_depth = _get_counter_depth(hdr_info)
+    if counter_depth == 24:
+        size = (data_bytes - header_bytes) // 2
+        low = _unpack_raw(raw[:, :size], 12, data_type)
+        high = _unpack_raw(raw[:, size + header_bytes:], 12, data_type)
+        frames = np.left_shift(high, 12)
+        frames |= low
+    else:
+        frames = _unpack_raw(raw, counter_depth, data_type)
+    return frames.reshape(shape)
+
+
+def _read_frames(fp, hdr_info, start, stop):
+    """Read the frames in the range [start, stop) of a mib file.
+
+    Only the bytes belonging to these frames are mapped, so this can be used
+    to load chunks of files which are larger than the available memory. The
+    frames are returned decoded and in native byte order.
+    """
+    data_type, header_bytes, data_bytes = _get_frame_layout(hdr_info)
+    frame_bytes = header_bytes + data_bytes
+    offset = hdr_info['offset'] + start * frame_bytes
+    if not _is_raw(hdr_info):
+        # Skip the headers through a strided view and convert to native
+        # byte order in a single copy.
+        stored = _get_stored_dtype(hdr_info)
+        data = np.memmap(fp, offset=offset, dtype=stored, mode='r',
+                         shape=((stop - start) * frame_bytes //
+                                stored.itemsize,))
+        data = data.reshape(stop - start, -1)[:,
+                                               header_bytes // stored.itemsize:]
+        return data.astype(data_type).reshape(
+            -1, hdr_info['height'], hdr_info['width'])
+    data = np.memmap(fp, offset=offset, dtype=np.uint8, mode='r',
+                     shape=((stop - start) * frame_bytes,))
+    return _decode_frames(data.reshape(stop - start, -1)[:, header_bytes:],
+                          hdr_info)
+
+
+def _get_frame_chunks(hdr_info, chunks=None):
+    """Number of frames per dask chunk, by default ~32 MB worth of frames."""
+    if chunks is None:
+        data_type = _get_frame_layout(hdr_info)[0]
+        frame_size = (hdr_info['width'] * hdr_info['height'] *
+                      data_type.itemsize)
+        chunks = max(1, 2**25 // frame_size)
+    return int(min(chunks, hdr_info['depth']))
+
+
+def read_mib_lazy(hdr_info, fp, chunks=None):
+    """Lazily read the frames of a mib file as a dask array.
+
+    Every dask chunk corresponds to a contiguous range of frames in the file.
+    When a chunk is computed only those frames are mapped, and the per-frame
+    headers are skipped through a strided view, so the file is never copied
+    as a whole. Packed formats are unpacked and the byte order converted to
+    native chunk by chunk.
+
+    Parameters
+    ----------
+    hdr_info: dict
+        A dictionary containing the keywords as parsed by parse_hdr
+    fp: str
+        Path to the mib file.
+    chunks: int, optional
+        Number of frames per chunk. If None, chunks of ~32 MB are used.
+
+    Returns
+    -------
+    data : dask.array.Array
+        Array of shape (depth, height, width).
+    """
+    data_type = _get_frame_layout(hdr_info)[0]
+    depth = hdr_info['depth']
+    shape = (depth, hdr_info['height'], hdr_info['width'])
+    chunks = _get_frame_chunks(hdr_info, chunks)
+
+    name = 'read-mib-' + tokenize(fp, os.path.getmtime(fp), chunks,
+                                  sorted(hdr_info.items()))
+    dsk = {}
+    starts = range(0, depth, chunks)
+    for i, start in enumerate(starts):
+        stop = min(start + chunks, depth)
+        dsk[(name, i, 0, 0)] = (_read_frames, fp, hdr_info, start, stop)
+    block_sizes = tuple(min(chunks, depth - start) for start in starts)
+
+    return da.Array(dsk, name, (block_sizes, (shape[1],), (shape[2],)),
+                    dtype=data_type)
+
+
+def read_mib(hdr_info, fp, mmap_mode='c', lazy=False, chunks=None):
     """Read the raw file object 'fp' based on the information given in the
     'hdr_info' dictionary.
 
@@ -184,61 +403,55 @@ def read_mib(hdr_info, fp, mmap_mode='c'):
     ndarray.  Memory mapping is especially useful for accessing
     small fragments of large files without reading the entire file
     into memory.
+    lazy: bool, optional
+        If True, return a dask array whose chunks map onto frame ranges in
+        the file. See `read_mib_lazy`.
+    chunks: int, optional
+        Number of frames per chunk when `lazy` is True.
 
+    Stacks of images are decoded into native byte order, including the
+    packed raw formats with counter depths of 1, 6, 12 and 24 bits.
 
     """
     width = hdr_info['width']
     height = hdr_info['height']
     depth = hdr_info['depth']
     offset = hdr_info['offset']
-    data_length = hdr_info['data-length']
-    data_type = hdr_info['data-type']
-    endian = hdr_info['byte-order']
     record_by = hdr_info['record-by']
 
-    if data_type == 'signed':
-        data_type = 'int'
-    elif data_type == 'unsigned':
-        data_type = 'uint'
-    elif data_type == 'float':
-        pass
-    else:
-        raise TypeError('Unknown "data-type" string.')
-
-    endian = '>'
-
-    data_type += str(int(data_length))
-    data_type = np.dtype(data_type)
-    data_type = data_type.newbyteorder(endian)
-
-    #set header number of bits
-    hdr_multiplier = (int(data_length)/8)**-1
-    hdr_bits = int(384 * hdr_multiplier)
+    if lazy and record_by == 'image':
+        return read_mib_lazy(hdr_info, fp, chunks=chunks)
+
+    if record_by == 'image':  # stack of images
+        # Decode block by block to keep the temporary arrays small.
+        data_type = _get_frame_layout(hdr_info)[0]
+        chunks = _get_frame_chunks(hdr_info, chunks)
+        data = np.empty((depth, height, width), dtype=data_type)
+        for start in range(0, depth, chunks):
+            stop = min(start + chunks, depth)
+            data[start:stop] = _read_frames(fp, hdr_info, start, stop)
+        if lazy:
+            data = da.from_array(data, chunks=(chunks, height, width))
+        return data
 
     data = np.memmap(fp,
                      offset=offset,
-                     dtype=data_type,
+                     dtype=_get_stored_dtype(hdr_info),
                      mode=mmap_mode)
 
     if record_by == 'vector':   # spectral image
         size = (height, width, depth)
         data = data.reshape(size)
-    elif record_by == 'image':  # stack of images
-        width_height = width * height
-        #a_width, a_height = round(np.sqrt(depth)), depth/ (round(np.sqrt(depth)))
-        size = (depth, height, width)
-        #print(size)
-        #remove headers at the beginning of each frame and reshape
-        data = data.reshape(-1, width_height + hdr_bits)[:,-width_height:].reshape(size)
-        #print()
     elif record_by == 'dont-care':  # stack of images
         size = (height, width)
         data = data.reshape(size)
+    if lazy:
+        data = da.from_array(data, chunks=data.shape)
     return data
 
 
 def file_reader(filename, hdr_info=None, encoding="latin-1",
-                mmap_mode='c', *args, **kwds):
+                mmap_mode='c', lazy=False, chunks=None, *args, **kwds):
     """Parses a Lispix (http://www.nist.gov/lispix/) hdr (.hdr) file
     and reads the data from the corresponding raw (.raw) file;
     or, read a raw file if the dictionary hdr_info is provided.
@@ -335,9 +548,7 @@ def file_reader(filename, hdr_info=None, encoding="latin-1",
 
     if not hdr_info:
         if filename[-3:] in file_extensions:
-            with codecs.open(filename, encoding=encoding,
-                             errors='replace') as f:
-                hdr_info = parse_hdr(f)
+            hdr_info = read_hdr(filename, encoding)
         else:
             raise IOError('File has wrong extension: "%s"' % filename[-3:])
     for ext in ['mib', 'MIB']:
@@ -349,10 +560,8 @@ def file_reader(filename, hdr_info=None, encoding="latin-1",
     if not rawfname:
         raise IOError('mib file "%s" does not exists' % rawfname)
     else:
-        lazy = kwds.pop('lazy', False)
-        if lazy:
-            mmap_mode = 'r'
-        data = read_mib(hdr_info, rawfname, mmap_mode=mmap_mode)
+        data = read_mib(hdr_info, rawfname, mmap_mode=mmap_mode,
+                        lazy=lazy, chunks=chunks)
 
     if hdr_info['record-by'] == 'vector':
         _logger.info('Loading as Signal1D')
@@ -490,12 +699,327 @@ def file_reader(filename, hdr_info=None, encoding="latin-1",
         'data': data.squeeze(),
         'axes': axes,
         'metadata': mp.as_dictionary(),
-        'original_metadata': hdr_info
+        'original_metadata': hdr_info,
+        'attributes': {'_lazy': lazy},
     }
     return [dictionary, ]
 
 
-def file_writer(filename, signal, encoding='latin-1', *args, **kwds):
+def _mib_filename(filename):
+    """Return the name of the mib file which accompanies an hdr file."""
+    for ext in ['mib', 'MIB']:
+        rawfname = os.path.splitext(filename)[0] + '.' + ext
+        if os.path.exists(rawfname):
+            return rawfname
+    raise IOError('mib file for "%s" does not exists' % filename)
+
+
+def read_hdr(filename, encoding="latin-1"):
+    """Parse the hdr file which accompanies a mib file.
+
+    If the mib file already contains a frame, the frame header size and the
+    pixel depth (e.g. 'U16' or 'R64' for the packed raw format) are read
+    from its header and added as 'frame-header-size' and 'pixel-depth'.
+    """
+    with codecs.open(filename, encoding=encoding, errors='replace') as f:
+        hdr_info = parse_hdr(f)
+    try:
+        with open(_mib_filename(filename), 'rb') as f:
+            frame_info = parse_frame_header(f.read(384))
+    except (IOError, IndexError, ValueError):
+        return hdr_info
+    hdr_info['frame-header-size'] = frame_info['header_size']
+    hdr_info['pixel-depth'] = frame_info['pixel_depth']
+    return hdr_info
+
+
+def parse_frame_header(header):
+    """Parse the ASCII header found at the start of every mib frame.
+
+    Parameters
+    ----------
+    header : bytes
+        The raw header of a frame, starting with 'MQ1'.
+
+    Returns
+    -------
+    frame_info : dict
+        Dictionary with the sequence number, header size (in bytes), number
+        of chips, frame width and height, pixel depth string (e.g. 'U16'),
+        time stamp string and exposure time (in s) of the frame.
+    """
+    fields = header.decode('ascii', 'replace').split(',')
+    if fields[0] != 'MQ1':
+        raise IOError('Frame header does not start with "MQ1": "%s"' %
+                      header[:16])
+    frame_info = {
+        'sequence': int(fields[1]),
+        'header_size': int(fields[2]),
+        'chips': int(fields[3]),
+        'width': int(fields[4]),
+        'height': int(fields[5]),
+        'pixel_depth': fields[6].strip(),
+    }
+    if len(fields) > 10:
+        frame_info['timestamp'] = fields[9].strip()
+        frame_info['exposure'] = float(fields[10])
+    return frame_info
+
+
+def iter_mib(filename, block_size=None, hdr_info=None, timeout=10.,
+             poll_interval=0.1, encoding="latin-1"):
+    """Iterate over the frames of a mib file while it is being written.
+
+    The mib file is followed like `tail -f`: frames are read from the end of
+    the data already consumed and yielded as soon as they are complete, so
+    that processing can start during the acquisition. The file is never
+    mapped as a whole.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the hdr file (or of the mib file next to it).
+    block_size : int, optional
+        If None (default) single frames of shape (height, width) are
+        yielded. Otherwise blocks of shape (block_size, height, width) are
+        yielded; the last block may be smaller.
+    hdr_info : dict, optional
+        Header information as returned by `parse_hdr`. Read from the hdr
+        file if not given.
+    timeout : float
+        Time in seconds to wait for new data before assuming that the
+        acquisition has stopped.
+    poll_interval : float
+        Time in seconds between checks for new data.
+
+    Yields
+    ------
+    frames : np.array
+        Frame or block of frames, in native byte order.
+    """
+    if hdr_info is None:
+        hdr_info = read_hdr(os.path.splitext(filename)[0] + '.hdr', encoding)
+    rawfname = _mib_filename(filename)
+    data_type, hdr_bytes, data_bytes = _get_frame_layout(hdr_info)
+    depth = hdr_info['depth']
+    frame_bytes = hdr_bytes + data_bytes
+    n = 1 if block_size is None else block_size
+
+    frames_read = 0
+    block = []
+    buffer = b''
+    with open(rawfname, 'rb') as f:
+        waited = 0.
+        while frames_read < depth:
+            buffer += f.read(frame_bytes - len(buffer))
+            if len(buffer) < frame_bytes:
+                if waited >= timeout:
+                    _logger.warning('No new data in "%s" for %s s, stopping '
+                                    'after %d frames.', rawfname, timeout,
+                                    frames_read)
+                    break
+                time.sleep(poll_interval)
+                waited += poll_interval
+                continue
+            waited = 0.
+            frame_info = parse_frame_header(buffer[:hdr_bytes])
+            if frame_info['sequence'] != frames_read + 1:
+                _logger.warning('Expected frame %d but found frame %d.',
+                                frames_read + 1, frame_info['sequence'])
+            block.append(np.frombuffer(buffer, dtype=np.uint8,
+                                       offset=hdr_bytes))
+            buffer = b''
+            frames_read += 1
+            if len(block) == n:
+                yield _stack_frames(block, block_size, hdr_info)
+                block = []
+    if block:
+        yield _stack_frames(block, block_size, hdr_info)
+
+
+def _stack_frames(block, block_size, hdr_info):
+    """Stack and decode frames read by `iter_mib`."""
+    frames = _decode_frames(np.stack(block), hdr_info)
+    if block_size is None:
+        frames = frames[0]
+    return frames
+
+
+# Layout of the frame index sidecar written by `index_mib`.
+frame_index_dtype = np.dtype([
+    ('offset', '<i8'),      # byte offset of the frame data (after header)
+    ('sequence', '<i8'),    # frame sequence number from the header
+    ('timestamp', '<f8'),   # acquisition time in s since the first frame
+    ('exposure', '<f4'),    # exposure time in s
+    ('bit_depth', '<u1'),   # bits per pixel as stored in the file
+    ('flags', '<u1'),       # combination of the FRAME_* flags below
+])
+# The sequence number jumps before this frame, i.e. frames were dropped.
+FRAME_DROPPED = 1
+# Unusually long time since the previous frame, e.g. a scan line flyback.
+FRAME_TIME_GAP = 2
+
+
+def _index_filename(rawfname):
+    return rawfname + '.idx.npy'
+
+
+def index_mib(filename, hdr_info=None, gap_factor=3., encoding="latin-1"):
+    """Index the frame headers of a mib file and store the result as a
+    sidecar next to it.
+
+    The index is a numpy structured array (see `frame_index_dtype`) with one
+    entry per frame. It is written to '<name>.mib.idx.npy' and reused by
+    `load_mib_index`, so that the file has to be scanned only once.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the hdr file (or of the mib file next to it).
+    hdr_info : dict, optional
+        Header information as returned by `parse_hdr`.
+    gap_factor : float
+        Frames acquired more than `gap_factor` times the median frame time
+        after the previous frame are flagged with FRAME_TIME_GAP.
+
+    Returns
+    -------
+    index : np.array
+        The frame index.
+    """
+    if hdr_info is None:
+        hdr_info = read_hdr(os.path.splitext(filename)[0] + '.hdr', encoding)
+    rawfname = _mib_filename(filename)
+    data_type, header_size, data_bytes = _get_frame_layout(hdr_info)
+
+    # All headers of a file have the same size, so the headers can be read
+    # through a strided view of the file without touching the frame data.
+    frame_bytes = header_size + data_bytes
+    raw = np.memmap(rawfname, dtype=np.uint8, mode='r')
+    depth = len(raw) // frame_bytes
+    headers = raw[:depth * frame_bytes].reshape(depth, frame_bytes)
+    headers = headers[:, :header_size]
+
+    index = np.zeros(depth, dtype=frame_index_dtype)
+    index['offset'] = np.arange(depth) * frame_bytes + header_size
+    index['bit_depth'] = (raw_bits[_get_counter_depth(hdr_info)]
+                          if _is_raw(hdr_info) else
+                          _get_stored_dtype(hdr_info).itemsize * 8)
+    timestamps = []
+    for i in range(depth):
+        frame_info = parse_frame_header(headers[i].tobytes())
+        index['sequence'][i] = frame_info['sequence']
+        index['exposure'][i] = frame_info.get('exposure', np.nan)
+        timestamps.append(frame_info.get('timestamp', '').replace(' ', 'T'))
+    del raw, headers
+
+    try:
+        timestamps = np.array(timestamps, dtype='datetime64[ns]')
+        timestamps = (timestamps - timestamps[0]) / np.timedelta64(1, 's')
+    except ValueError:
+        _logger.warning('Could not parse the frame time stamps of "%s".',
+                        rawfname)
+        timestamps = np.full(depth, np.nan)
+    index['timestamp'] = timestamps
+
+    if depth > 1:
+        dropped = np.diff(index['sequence']) != 1
+        index['flags'][1:][dropped] |= FRAME_DROPPED
+        dt = np.diff(index['timestamp'])
+        if np.isfinite(dt).all():
+            gap = dt > gap_factor * np.median(dt)
+            index['flags'][1:][gap] |= FRAME_TIME_GAP
+
+    np.save(_index_filename(rawfname), index)
+    return index
+
+
+def load_mib_index(filename, hdr_info=None, rebuild=False, **kwargs):
+    """Load the frame index of a mib file, building it if necessary.
+
+    The sidecar is rebuilt if it is older than the mib file, e.g. because the
+    file was still being written when it was indexed.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the hdr file (or of the mib file next to it).
+    hdr_info : dict, optional
+        Header information as returned by `parse_hdr`.
+    rebuild : bool
+        If True, the index is always rebuilt.
+    **kwargs :
+        Passed to `index_mib`.
+
+    Returns
+    -------
+    index : np.array
+        The frame index, see `frame_index_dtype`.
+    """
+    rawfname = _mib_filename(filename)
+    index_filename = _index_filename(rawfname)
+    if (rebuild or not os.path.exists(index_filename) or
+            os.path.getmtime(index_filename) < os.path.getmtime(rawfname)):
+        return index_mib(filename, hdr_info=hdr_info, **kwargs)
+    return np.load(index_filename, mmap_mode='r')
+
+
+def read_indexed_frames(filename, index, frames, hdr_info=None,
+                        encoding="latin-1"):
+    """Read arbitrary frames of a mib file using its frame index.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the hdr file (or of the mib file next to it).
+    index : np.array
+        The frame index, as returned by `load_mib_index`.
+    frames : int, slice or array of int
+        The positions of the frames to read in the index.
+
+    Returns
+    -------
+    data : np.array
+        Array of shape (len(frames), height, width) in native byte order.
+    """
+    if hdr_info is None:
+        hdr_info = read_hdr(os.path.splitext(filename)[0] + '.hdr', encoding)
+    data_type, header_bytes, data_bytes = _get_frame_layout(hdr_info)
+    frame_shape = (hdr_info['height'], hdr_info['width'])
+    offsets = np.atleast_1d(index['offset'][frames])
+    raw = np.memmap(_mib_filename(filename), dtype=np.uint8, mode='r')
+    data = np.empty((len(offsets),) + frame_shape, dtype=data_type)
+    for i, offset in enumerate(offsets):
+        data[i] = _decode_frames(raw[None, offset:offset + data_bytes],
+                                 hdr_info)[0]
+    return data
+
+
+def find_flyback(index, scan_width):
+    """Find the scan line flyback from the frame time stamps.
+
+    Parameters
+    ----------
+    index : np.array
+        The frame index, as returned by `load_mib_index`.
+    scan_width : int
+        Number of probe positions per scan line.
+
+    Returns
+    -------
+    column : int or None
+        The most common column (modulo `scan_width`) of frames recorded
+        after a long time gap, i.e. of the first frame after the flyback.
+        None if no time gaps were found.
+    """
+    gaps = np.where(index['flags'] & FRAME_TIME_GAP)[0]
+    if not len(gaps):
+        return None
+    return int(np.argmax(np.bincount(gaps % scan_width)))
+
+
+def file_writer(filename, signal, encoding='latin-1', frame_headers=False,
+                *args, **kwds):
 
     # Set the optional keys to None
     ev_per_chan = None
@@ -517,6 +1041,8 @@ def file_writer(filename, signal, encoding='latin-1', *args, **kwds):
     # Gather the information to write the hdr
     data_type, data_length = dtype2keys[dc.dtype.name]
     byte_order = endianess2hdr[dc.dtype.byteorder.replace('|', '=')]
+    if frame_headers:
+        byte_order = endianess2hdr['>']
     offset = 0
     if signal.metadata.has_item("Signal.signal_type"):
         signal_type = signal.metadata.Signal.signal_type
@@ -628,7 +1154,7 @@ def file_writer(filename, signal, encoding='latin-1', *args, **kwds):
                 mp.Detector.EDS.energy_resolution_MnKa
 
     write_hdr(filename, keys_dictionary, encoding)
-    write_raw(filename, signal, record_by)
+    write_mib(filename, signal, record_by, frame_headers=frame_headers)
 
 
 def write_hdr(filename, keys_dictionary, encoding='ascii'):
@@ -645,35 +1171,120 @@ def write_hdr(filename, keys_dictionary, encoding='ascii'):
     f.close()
 
 
-def write_mib(filename, signal, record_by):
+# Pixel depth strings of the mib frame header for the supported dtypes.
+dtype2pixel_depth = {
+    'uint8': 'U08',
+    'uint16': 'U16',
+    'uint32': 'U32',
+    'uint64': 'U64', }
+
+
+def synthesize_frame_headers(depth, width, height, dtype,
+                             timestamp='1970-01-01 00:00:00.000000',
+                             exposure=0., header_size=384):
+    """Create mib frame headers for data written by pyxem.
+
+    Parameters
+    ----------
+    depth : int
+        Number of frames.
+    width, height : int
+        Frame size in pixels.
+    dtype : numpy.dtype
+        The dtype of the frames, one of uint8, uint16, uint32 or uint64.
+    timestamp : str
+        Time stamp written to every header.
+    exposure : float
+        Exposure time in s written to every header.
+    header_size : int
+        Size of every header in bytes.
+
+    Returns
+    -------
+    headers : np.array
+        Array of `depth` byte strings of length `header_size`.
+    """
+    dtype_name = np.dtype(dtype).name
+    if dtype_name not in dtype2pixel_depth:
+        raise IOError('mib frame headers can not describe data of %s type' %
+                      dtype_name)
+    header = ('MQ1,{:06d},%05d,01,%04d,%04d,%s,   1x1,01,%s,%.6f,0,0,0' % (
+        header_size, width, height, dtype2pixel_depth[dtype_name], timestamp,
+        exposure))
+    return np.array([header.format(i + 1).ljust(header_size)
+                     for i in range(depth)], dtype='S%d' % header_size)
+
+
+def _store(data, out):
+    """Copy `data` into `out` block by block along the first axis.
+
+    Dask arrays are stored chunk by chunk, and other arrays (e.g. memmaps) in
+    blocks of ~32 MB, so that the memory use does not scale with the size of
+    the data.
+    """
+    if isinstance(data, da.Array):
+        da.store(data, out)
+        return
+    frame_size = max(1, data[:1].nbytes)
+    step = max(1, 2**25 // frame_size)
+    for start in range(0, len(data), step):
+        out[start:start + step] = data[start:start + step]
+
+
+def write_mib(filename, signal, record_by, frame_headers=False):
     """Writes the raw file object
 
+    The data are streamed block by block into a preallocated file, so lazy
+    and memory mapped signals larger than the available memory can be
+    written.
+
     Parameters:
     -----------
     filename : string
         the filename, either with the extension or without it
     record_by : string
      'vector' or 'image'
+    frame_headers : bool
+        If True, every image is preceded by a synthesised 384 byte mib frame
+        header and the data are written big-endian, as by Merlin detectors.
+        Only supported for images of unsigned integers.
 
         """
     filename = os.path.splitext(filename)[0] + '.mib'
-    dshape = signal.data.shape
     data = signal.data
-    if len(dshape) == 3:
+    moveaxis = da.moveaxis if isinstance(data, da.Array) else np.moveaxis
+    if data.ndim == 3:
         if record_by == 'vector':
-            np.rollaxis(
-                data, signal.axes_manager.signal_axes[0].index_in_array, 3
-            ).ravel().tofile(filename)
+            data = moveaxis(
+                data, signal.axes_manager.signal_axes[0].index_in_array, 2)
         elif record_by == 'image':
-            data = np.rollaxis(
-                data, signal.axes_manager.navigation_axes[0].index_in_array, 0
-            ).ravel().tofile(filename)
-    elif len(dshape) == 2:
-        if record_by == 'vector':
-            np.rollaxis(
-                data, signal.axes_manager.signal_axes[0].index_in_array, 2
-            ).ravel().tofile(filename)
-        elif record_by in ('image', 'dont-care'):
-            data.ravel().tofile(filename)
-    elif len(dshape) == 1:
-        data.ravel().tofile(filename)
+            data = moveaxis(
+                data, signal.axes_manager.navigation_axes[0].index_in_array, 0)
+    elif data.ndim == 2 and record_by == 'vector':
+        data = moveaxis(
+            data, signal.axes_manager.signal_axes[0].index_in_array, 1)
+
+    if not frame_headers:
+        out = np.memmap(filename, dtype=data.dtype, mode='w+',
+                        shape=data.shape)
+        _store(data, out)
+        out.flush()
+        return
+
+    if record_by == 'vector' or data.ndim < 2:
+        raise ValueError('Frame headers can only be written for images.')
+    frames = data.reshape((-1,) + data.shape[-2:])
+    depth, height, width = frames.shape
+    md = signal.metadata
+    kwargs = {}
+    if md.has_item('General.date') and md.has_item('General.time'):
+        kwargs['timestamp'] = '%s %s' % (md.General.date, md.General.time)
+    headers = synthesize_frame_headers(depth, width, height, frames.dtype,
+                                       **kwargs)
+    record = np.dtype([('header', headers.dtype),
+                       ('data', frames.dtype.newbyteorder('>'),
+                        (height, width))])
+    out = np.memmap(filename, dtype=record, mode='w+', shape=(depth,))
+    out['header'] = headers
+    _store(frames, out['data'])
+    out.flush()
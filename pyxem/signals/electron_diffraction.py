@@ -19,19 +19,136 @@
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import warnings
+
 import numpy as np
+import dask.array as da
+from dask import delayed
 
 from hyperspy._signals.lazy import LazySignal
-from hyperspy.api import interactive, stack
+from hyperspy.api import interactive
 from hyperspy.components1d import Voigt, Exponential, Polynomial
+from hyperspy.exceptions import VisibleDeprecationWarning
 from hyperspy.signals import Signal1D, Signal2D, BaseSignal
+from skimage.util import img_as_float
 from pyxem.signals.diffraction_profile import ElectronDiffractionProfile
 from pyxem.signals.diffraction_vectors import DiffractionVectors
+from pyxem.signals.vdf_image import VDFImage
 from pyxem.utils.expt_utils import *
 from pyxem.utils.peakfinders2D import *
+from pyxem.utils.vdf_utils import (detector_matrix, apply_detector_matrix,
+                                   roi_to_mask)
 from pyxem.utils import peakfinder2D_gui
 
 
+def _map_block_about_origins(z, function, origins, nav_dim, keyword,
+                             block_info=None, **kwargs):
+    """Apply a function to a chunk of patterns, passing the origins of the
+    patterns of the chunk as `keyword`."""
+    location = block_info[0]['array-location'][:nav_dim]
+    kwargs[keyword] = origins[tuple(slice(*loc) for loc in location)]
+    return function(z, **kwargs)
+
+
+def _map_frames(data, nav_dim, function, output_shape=None, dtype=float,
+                origins=None, keyword=None, **kwargs):
+    """Apply a function of a stack of patterns to blocks of patterns, in
+    parallel threads, or to every chunk of lazy data.
+
+    Parameters
+    ----------
+    data : np.array or dask.array.Array
+        The patterns, with `nav_dim` navigation dimensions.
+    function : callable
+        Function of a stack of patterns, returning an array of shape
+        (len(stack),) + output_shape.
+    output_shape : tuple
+        Shape of the result for every pattern. If None, that of the patterns.
+    dtype : dtype
+        Data type of the result.
+    origins : array
+        Passed to `function` as `keyword`. If given for every pattern, with
+        the navigation shape followed by the shape of an origin, only the
+        origins of the patterns of a block are passed.
+    kwargs :
+        Passed to `function`.
+
+    Returns
+    -------
+    result : np.array or dask.array.Array
+        Array of shape data.shape[:nav_dim] + output_shape, lazy if `data`
+        is.
+    """
+    nav_shape = data.shape[:nav_dim]
+    signal_shape = data.shape[nav_dim:]
+    output_shape = signal_shape if output_shape is None else \
+        tuple(output_shape)
+    per_pattern = origins is not None and np.ndim(origins) > 1
+    if keyword is not None and not per_pattern:
+        kwargs[keyword] = origins
+    if isinstance(data, da.Array):
+        data = data.rechunk({axis: -1 for axis in range(nav_dim, data.ndim)})
+        if per_pattern:
+            kwargs.update(function=function, origins=np.asarray(origins),
+                          nav_dim=nav_dim, keyword=keyword)
+            function = _map_block_about_origins
+        drop_axis = tuple(range(nav_dim + len(output_shape), data.ndim))
+        return data.map_blocks(
+            function, dtype=dtype, drop_axis=drop_axis,
+            chunks=data.chunks[:nav_dim] + tuple((n,) for n in output_shape),
+            **kwargs)
+    frames = data.reshape((-1,) + signal_shape)
+    result = np.empty((len(frames),) + output_shape, dtype=dtype)
+    if per_pattern:
+        origins = np.reshape(origins, (len(frames), -1))
+    step = max(1, 2**25 // max(1, frames[:1].nbytes, result[:1].nbytes))
+
+    def process(start):
+        block = slice(start, start + step)
+        if per_pattern:
+            kwargs_block = dict(kwargs, **{keyword: origins[block]})
+        else:
+            kwargs_block = kwargs
+        result[block] = function(frames[block], **kwargs_block)
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(process, range(0, len(frames), step)))
+    return result.reshape(nav_shape + output_shape)
+
+
+def _find_beam_shifts(data, nav_dim, method, **kwargs):
+    """Apply a beam finding method to every pattern, returning the shifts of
+    shape data.shape[:nav_dim] + (2,)."""
+    shifts = _map_frames(data, nav_dim, method, output_shape=(2,), **kwargs)
+    return da.compute(shifts)[0]
+
+
+def _merge_pairwise(parts, merge):
+    """Reduce a list by merging neighbouring pairs, level by level."""
+    while len(parts) > 1:
+        parts = [merge(*parts[i:i + 2]) if i + 1 < len(parts) else parts[i]
+                 for i in range(0, len(parts), 2)]
+    return parts[0]
+
+
+def _reduce_moments(data, nav_dim):
+    """Moments of every pixel over all patterns, computed for blocks of
+    patterns, or chunks of lazy data, and merged in a tree."""
+    if isinstance(data, da.Array):
+        data = data.rechunk({nav_dim: -1, nav_dim + 1: -1})
+        parts = [delayed(diffraction_moments)(block)
+                 for block in data.to_delayed().ravel()]
+        return _merge_pairwise(parts, delayed(merge_moments)).compute()
+    frames = data.reshape((-1,) + data.shape[nav_dim:])
+    step = max(1, 2**25 // max(1, frames[:1].nbytes))
+    with ThreadPoolExecutor() as executor:
+        parts = list(executor.map(
+            lambda start: diffraction_moments(frames[start:start + step]),
+            range(0, len(frames), step)))
+    return _merge_pairwise(parts, merge_moments)
+
+
 class ElectronDiffraction(Signal2D):
     _signal_type = "electron_diffraction"
 
@@ -150,7 +267,8 @@ class ElectronDiffraction(Signal2D):
         y.scale = calibration
         y.units = 'nm'
 
-    def plot_interactive_virtual_image(self, roi, **kwargs):
+    def plot_interactive_virtual_image(self, roi, fast=False, binning=None,
+                                       **kwargs):
         """Plots an interactive virtual image formed with a specified and
         adjustable roi.
 
@@ -158,6 +276,14 @@ class ElectronDiffraction(Signal2D):
         ----------
         roi: :obj:`hyperspy.roi.BaseInteractiveROI`
             Any interactive ROI detailed in HyperSpy.
+        fast: bool
+            If True, the diffraction patterns are binned once in signal space
+            and, while the widget is moved, the virtual image is approximated
+            from the fraction of every bin inside the ROI. The exact image is
+            computed when the mouse button is released.
+        binning: int, optional
+            Binning factor of the signal axes used when `fast` is True. By
+            default the binned patterns are at most 64 pixels wide.
         kwargs:
             Keyword arguments to be passed to `ElectronDiffraction.plot`
 
@@ -173,20 +299,34 @@ class ElectronDiffraction(Signal2D):
         self.plot(**kwargs)
         roi.add_widget(self, axes=self.axes_manager.signal_axes)
         # Add the ROI to the appropriate signal axes.
-        dark_field = roi.interactive(self, navigation_signal='same')
-        dark_field_placeholder = \
-            BaseSignal(np.zeros(self.axes_manager.navigation_shape[::-1]))
-        # Create an output signal for the virtual dark-field calculation.
-        dark_field_sum = interactive(
-            # Create an interactive signal
-            dark_field.sum,
-            # Formed from the sum of the pixels in the dark-field signal
-            event=dark_field.axes_manager.events.any_axis_changed,
-            # That updates whenever the widget is moved
-            axis=dark_field.axes_manager.signal_axes,
-            out=dark_field_placeholder,
-            # And outputs into the prepared placeholder.
-        )
+        if fast:
+            dark_field_sum, update_binned, update_exact = \
+                self._get_fast_virtual_image(roi, binning)
+            signal_plot = self._plot.signal_plot
+            roi.events.changed.connect(update_binned, [])
+            cid = signal_plot.figure.canvas.mpl_connect(
+                'button_release_event', update_exact)
+
+            def disconnect():
+                roi.events.changed.disconnect(update_binned)
+                signal_plot.figure.canvas.mpl_disconnect(cid)
+
+            signal_plot.events.closed.connect(disconnect, [])
+        else:
+            dark_field = roi.interactive(self, navigation_signal='same')
+            dark_field_placeholder = \
+                BaseSignal(np.zeros(self.axes_manager.navigation_shape[::-1]))
+            # Create an output signal for the virtual dark-field calculation.
+            dark_field_sum = interactive(
+                # Create an interactive signal
+                dark_field.sum,
+                # Formed from the sum of the pixels in the dark-field signal
+                event=dark_field.axes_manager.events.any_axis_changed,
+                # That updates whenever the widget is moved
+                axis=dark_field.axes_manager.signal_axes,
+                out=dark_field_placeholder,
+                # And outputs into the prepared placeholder.
+            )
         dark_field_sum.axes_manager.update_axes_attributes_from(
             self.axes_manager.navigation_axes,
             ['scale', 'offset', 'units', 'name'])
@@ -194,6 +334,55 @@ class ElectronDiffraction(Signal2D):
         # Set the parameters
         dark_field_sum.plot()  # Plot the result
 
+    def _get_fast_virtual_image(self, roi, binning=None):
+        """Create a virtual image which follows `roi` using binned patterns.
+
+        Returns the virtual image signal, a function which updates it with
+        the binned approximation for the current `roi` and a function which
+        replaces the approximation by the exact virtual image, if the `roi`
+        has changed since the last exact image.
+        """
+        nav_dim = self.axes_manager.navigation_dimension
+        nav_shape = self.data.shape[:nav_dim]
+        signal_axes = self.axes_manager._get_axes_dicts()[nav_dim:]
+        height, width = self.data.shape[nav_dim:]
+        if binning is None:
+            binning = max(1, -(-max(height, width) // 64))
+        shape = (height // binning, binning, width // binning, binning)
+        # Edge pixels which do not fill a whole bin are left out of the
+        # approximation.
+        cropped = self.data[..., :shape[0] * binning, :shape[2] * binning]
+        binned = cropped.reshape(nav_shape + shape).sum(
+            axis=(nav_dim + 1, nav_dim + 3), dtype=float)
+        if self._lazy:
+            binned = binned.compute()
+        binned = binned.reshape(nav_shape + (-1,))
+
+        dark_field_sum = BaseSignal(np.zeros(nav_shape))
+        # Whether the image shows an approximation for a moved ROI.
+        dirty = True
+
+        def update_binned():
+            nonlocal dirty
+            # Fraction of every bin inside the ROI.
+            mask = roi_to_mask(roi, signal_axes)
+            mask = mask[:shape[0] * binning, :shape[2] * binning]
+            coverage = mask.reshape(shape).mean(axis=(1, 3))
+            dark_field_sum.data[:] = np.dot(binned, coverage.ravel())
+            dirty = True
+            dark_field_sum.events.data_changed.trigger(dark_field_sum)
+
+        def update_exact(*args):
+            nonlocal dirty
+            if not dirty:
+                return
+            dark_field_sum.data[:] = self.get_virtual_images([roi]).data[0]
+            dirty = False
+            dark_field_sum.events.data_changed.trigger(dark_field_sum)
+
+        update_exact()
+        return dark_field_sum, update_binned, update_exact
+
     def get_virtual_image(self, roi):
         """Obtains a virtual image associated with a specified ROI.
 
@@ -224,6 +413,50 @@ class ElectronDiffraction(Signal2D):
         vdf = dark_field_sum.as_signal2D((0,1))
         return vdf
 
+    def get_virtual_images(self, detectors):
+        """Obtains the virtual images of a bank of virtual detectors in a
+        single pass through the data.
+
+        The detectors are stacked into a matrix and all virtual images are
+        computed as one matrix product, so that the data are read only once
+        however many detectors are used.
+
+        Parameters
+        ----------
+        detectors : list
+            Virtual detectors, each either a
+            :obj:`hyperspy.roi.BaseInteractiveROI` or a boolean or float
+            array with the shape of a diffraction pattern, used as weights.
+
+        Returns
+        -------
+        vdfs : :obj:`pyxem.signals.vdf_image.VDFImage`
+            The virtual images, stacked along the navigation axis in the
+            order of `detectors`.
+
+        Examples
+        --------
+        .. code-block:: python
+
+            import hyperspy.api as hs
+            rois = [hs.roi.CircleROI(0, 0, 0.2),
+                    hs.roi.CircleROI(0, 0, 1., r_inner=0.5)]
+            vdfs = data.get_virtual_images(rois)
+
+        """
+        axes = self.axes_manager._get_axes_dicts()
+        nav_dim = self.axes_manager.navigation_dimension
+        matrix = detector_matrix(detectors, axes[nav_dim:])
+        images = _map_frames(self.data, nav_dim, apply_detector_matrix,
+                             output_shape=(matrix.shape[1],), matrix=matrix)
+        vdfs = VDFImage(np.moveaxis(da.compute(images)[0], -1, 0))
+        for vdf_axis, axis in zip(vdfs.axes_manager.signal_axes,
+                                  self.axes_manager.navigation_axes):
+            for attribute in ['scale', 'offset', 'units', 'name']:
+                setattr(vdf_axis, attribute, getattr(axis, attribute))
+        vdfs.metadata.General.title = "Virtual Dark Field"
+        return vdfs
+
     def get_direct_beam_mask(self, radius):
         """Generate a signal mask for the direct beam.
 
@@ -251,7 +484,7 @@ class ElectronDiffraction(Signal2D):
         return signal_mask
 
     def get_vacuum_mask(self, radius, threshold,
-                        closing=True, opening=False):
+                        closing=True, opening=False, early_stop=True):
         """Generate a navigation mask to exclude SED patterns acquired in vacuum.
 
         Vacuum regions are identified crudely based on searching for a peak
@@ -259,6 +492,9 @@ class ElectronDiffraction(Signal2D):
         a user defined threshold value. Morphological opening or closing of the
         mask obtained is supported.
 
+        The patterns are searched without copying the masked dataset, see
+        :func:`pyxem.utils.expt_utils.find_vacuum`.
+
         Parameters
         ----------
         radius: float
@@ -266,37 +502,109 @@ class ElectronDiffraction(Signal2D):
         threshold: float
             Minimum intensity required to consider a diffracted beam to be
             present.
-        center: tuple, optional
-            User specified position of the diffraction pattern center. If None
-            it is assumed that the pattern center is the center of the image.
         closing: bool, optional
             Flag to perform morphological closing.
         opening: bool, optional
             Flag to perform morphological opening.
+        early_stop: bool, optional
+            Stop searching a pattern once a diffracted beam is found.
 
         Returns
         -------
-        mask : Signal2D
-            The mask of the region of interest. Vacuum regions to be masked are
-            set True.
+        mask : BaseSignal
+            The mask of the region of interest, with the navigation axes of
+            this signal as signal axes, i.e. a Signal2D for a 2D scan and a
+            Signal1D for a line scan. Vacuum regions to be masked are set
+            True.
 
         See also
         --------
         get_direct_beam_mask
         """
-        db = np.invert(self.get_direct_beam_mask(radius=radius))
-        diff_only = db * self
-        mask = (diff_only.max((-1, -2)) <= threshold)
+        mask = _map_frames(self.data, self.axes_manager.navigation_dimension,
+                           find_vacuum, output_shape=(), dtype=bool,
+                           radius=radius, threshold=threshold,
+                           early_stop=early_stop)
+        mask = da.compute(mask)[0]
         if closing:
-            mask.data = ndi.morphology.binary_dilation(mask.data,
-                                                       border_value=0)
-            mask.data = ndi.morphology.binary_erosion(mask.data,
-                                                      border_value=1)
+            mask = ndi.morphology.binary_dilation(mask, border_value=0)
+            mask = ndi.morphology.binary_erosion(mask, border_value=1)
         if opening:
-            mask.data = ndi.morphology.binary_erosion(mask.data,
-                                                      border_value=1)
-            mask.data = ndi.morphology.binary_dilation(mask.data,
-                                                       border_value=0)
+            mask = ndi.morphology.binary_erosion(mask, border_value=1)
+            mask = ndi.morphology.binary_dilation(mask, border_value=0)
+        return self._get_navigation_signal(data=mask)
+
+    def get_deadpixel_mask(self, dead_fraction=1., hot_threshold=10.,
+                           noise_threshold=None, navigation_step=1):
+        """Find dead, hot and noisy pixels from the statistics of every
+        detector pixel.
+
+        The sum, sum of squares and number of zero counts of every pixel are
+        accumulated in a single pass through the data, chunk by chunk for
+        lazy signals. A subsample of the patterns can be used by setting
+        `navigation_step`.
+
+        Parameters
+        ----------
+        dead_fraction : float
+            Pixels which are zero in at least this fraction of the patterns
+            are flagged as dead.
+        hot_threshold : float or None
+            Pixels whose mean is more than `hot_threshold` times the median
+            of the means of all pixels are flagged as hot. None disables the
+            check.
+        noise_threshold : float or None
+            Pixels whose variance to mean ratio is more than
+            `noise_threshold` times the median ratio are flagged as noisy.
+            None (default) disables the check.
+        navigation_step : int
+            Only every `navigation_step`-th pattern along every navigation
+            axis is used.
+
+        Returns
+        -------
+        mask : Signal2D
+            Boolean mask of the shape of a diffraction pattern, True for the
+            flagged pixels. It can be passed to `remove_deadpixels`.
+
+        See also
+        --------
+        remove_deadpixels
+        """
+        nav_dim = self.axes_manager.navigation_dimension
+        data = self.data[(slice(None, None, navigation_step),) * nav_dim]
+        n = int(np.prod(data.shape[:nav_dim]))
+        axis = tuple(range(nav_dim))
+        if self._lazy:
+            total, squares, zeros = da.compute(
+                data.sum(axis=axis, dtype=np.float64),
+                da.square(data.astype(np.float64)).sum(axis=axis),
+                (data == 0).sum(axis=axis))
+        else:
+            frames = data.reshape((-1,) + data.shape[nav_dim:])
+            total = np.zeros(frames.shape[1:])
+            squares = np.zeros(frames.shape[1:])
+            zeros = np.zeros(frames.shape[1:], dtype=np.int64)
+            step = max(1, 2**25 // max(1, frames[:1].nbytes))
+            for start in range(0, len(frames), step):
+                block = frames[start:start + step].astype(np.float64)
+                total += block.sum(axis=0)
+                squares += np.square(block).sum(axis=0)
+                zeros += (block == 0).sum(axis=0)
+        mean = total / n
+        mask = zeros >= dead_fraction * n
+        valid = ~mask
+        if hot_threshold is not None and valid.any():
+            reference = np.median(mean[valid]) or np.mean(mean[valid])
+            mask |= mean > hot_threshold * reference
+        if noise_threshold is not None and valid.any():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                dispersion = np.nan_to_num((squares / n - mean**2) / mean)
+            reference = (np.median(dispersion[valid]) or
+                         np.mean(dispersion[valid]))
+            mask |= dispersion > noise_threshold * reference
+        mask = Signal2D(mask)
+        mask.metadata.General.title = "Dead pixels"
         return mask
 
     def apply_affine_transformation(self,
@@ -306,10 +614,17 @@ class ElectronDiffraction(Signal2D):
                                     *args, **kwargs):
         """Correct geometric distortion by applying an affine transformation.
 
+        For interpolation orders 0, 1 and 3 without further keyword
+        arguments, the transformation is computed once as a sparse
+        interpolation matrix. Otherwise, every pattern is transformed with
+        skimage.warp.
+
         Parameters
         ----------
         D : array
             3x3 np.array specifying the affine transform to be applied.
+        order : int
+            Interpolation order.
         inplace : bool
             If True (default), this signal is overwritten. Otherwise, returns a
             new signal.
@@ -320,11 +635,17 @@ class ElectronDiffraction(Signal2D):
             diffraction patterns.
 
         """
-        return self.map(affine_transformation,
-                        matrix=D,
-                        order=order,
-                        inplace=inplace,
-                        *args,**kwargs)
+        if args or kwargs or order not in (0, 1, 3):
+            return self.map(affine_transformation,
+                            matrix=D,
+                            order=order,
+                            inplace=inplace,
+                            *args,**kwargs)
+        signal_shape = self.axes_manager.signal_shape[::-1]
+        correction = get_affine_correction(D, signal_shape, order)
+        dtype = img_as_float(np.zeros(1, dtype=self.data.dtype)).dtype
+        return self._map_blocks(apply_affine_correction, dtype=dtype,
+                                inplace=inplace, correction=correction)
 
     def apply_gain_normalisation(self,
                                  dark_reference,
@@ -333,6 +654,9 @@ class ElectronDiffraction(Signal2D):
         """Apply gain normalization to experimentally acquired electron
         diffraction patterns.
 
+        The references are combined once into float32 gain and offset maps,
+        which are then applied to the data as a single multiply-add.
+
         Parameters
         ----------
         dark_reference : ElectronDiffraction
@@ -343,11 +667,14 @@ class ElectronDiffraction(Signal2D):
             If True (default), this signal is overwritten. Otherwise, returns a
             new signal.
 
+        See also
+        --------
+        :func:`pyxem.utils.expt_utils.get_gain_correction`
+
         """
-        return self.map(gain_normalise,
-                        dref=dark_reference,
-                        bref=bright_reference,
-                        inplace=inplace)
+        gain, offset = get_gain_correction(dark_reference, bright_reference)
+        return self._map_blocks(apply_gain_correction, dtype=np.float32,
+                                inplace=inplace, gain=gain, offset=offset)
 
     def remove_deadpixels(self,
                           deadpixels,
@@ -355,27 +682,103 @@ class ElectronDiffraction(Signal2D):
                           inplace=True):
         """Remove deadpixels from experimentally acquired diffraction patterns.
 
+        The neighbours of the dead pixels are tabulated once and all frames
+        are then corrected with a single vectorised gather.
+
         Parameters
         ----------
         deadpixels : ElectronDiffraction
-            List
+            List of the (row, column) indices of the dead pixels, or boolean
+            mask of the shape of a diffraction pattern.
         deadvalue : string
             Specify how deadpixels should be treated. 'average' sets the dead
-            pixel value to the average of adjacent pixels. 'nan' sets the dead
-            pixel to nan
+            pixel value to the average of adjacent valid pixels. 'nan' sets
+            the dead pixel to nan
         inplace : bool
             If True (default), this signal is overwritten. Otherwise, returns a
             new signal.
 
-        """
-        return self.map(remove_dead,
-                        deadpixels=deadpixels,
-                        deadvalue=deadvalue,
-                        inplace=inplace)
+        See also
+        --------
+        :func:`pyxem.utils.expt_utils.get_deadpixel_correction`
 
-    def get_radial_profile(self,cython=False,inplace=False,**kwargs):
+        """
+        signal_shape = self.axes_manager.signal_shape[::-1]
+        correction = get_deadpixel_correction(deadpixels, signal_shape)
+        # Also checks deadvalue before any data are processed.
+        dtype = apply_deadpixel_correction(
+            np.zeros(signal_shape, dtype=self.data.dtype), correction,
+            deadvalue).dtype
+        return self._map_blocks(apply_deadpixel_correction, dtype=dtype,
+                                inplace=inplace, correction=correction,
+                                deadvalue=deadvalue)
+
+    def _map_blocks(self, function, output_shape=None, dtype=float,
+                    inplace=False, **kwargs):
+        """Apply a function of a stack of patterns to all patterns, see
+        :func:`_map_frames`, overwriting this signal if `inplace`, otherwise
+        returning a new signal."""
+        data = _map_frames(self.data, self.axes_manager.navigation_dimension,
+                           function, output_shape, dtype, **kwargs)
+        signal = self if inplace else self._deepcopy_with_new_data(data)
+        if inplace:
+            self.data = data
+        if output_shape is not None:
+            signal.get_dimensions_from_data()
+        if inplace:
+            self.events.data_changed.trigger(obj=self)
+        else:
+            return signal
+
+    def _get_compact_signal(self, navigation_mask):
+        """Signal of the patterns at the navigation positions which are not
+        masked, along a single navigation axis, together with the boolean
+        array of these positions, see
+        :func:`pyxem.utils.expt_utils.compact_navigation`."""
+        nav_dim = self.axes_manager.navigation_dimension
+        frames, keep = compact_navigation(self.data, navigation_mask, nav_dim)
+        axes = self.axes_manager._get_axes_dicts()[nav_dim:]
+        compact = self.__class__(frames, axes=[dict(size=len(frames))] + axes,
+                                 metadata=self.metadata.as_dictionary())
+        return compact, keep
+
+    def _scatter_compact_signal(self, result, keep, fill_value=0):
+        """Place a signal computed from the compact signal of
+        :meth:`_get_compact_signal` back on the navigation axes of this
+        signal, with `fill_value` at the masked positions."""
+        if result._lazy:
+            result.compute()
+        nav_dim = self.axes_manager.navigation_dimension
+        data = scatter_navigation(result.data, keep, fill_value)
+        axes = self.axes_manager._get_axes_dicts()[:nav_dim] + \
+            result.axes_manager._get_axes_dicts()[1:]
+        return result.__class__(data, axes=axes,
+                                metadata=result.metadata.as_dictionary())
+
+    def get_radial_profile(self, cython=False, inplace=None, center=None,
+                           navigation_mask=None, **kwargs):
         """Return the radial profile of the diffraction pattern.
 
+        The pixels are binned once by their distance to the center, see
+        :func:`pyxem.utils.expt_utils.get_radial_correction`, and the profiles
+        are computed as a sparse matrix product.
+
+        Parameters
+        ----------
+        cython : bool
+            If True, use the compiled implementation, where available.
+        inplace : bool
+            Deprecated and ignored, a new signal is always returned. Further
+            keyword arguments, formerly passed to `map`, are ignored too.
+        center : tuple or array or BaseSignal
+            The (x, y) pixel coordinates of the center. If None, defaults to
+            the center of the pattern. An array, or signal, with the navigation
+            shape followed by (2,) gives the center of every pattern; the
+            profiles are then as long as the longest one.
+        navigation_mask : array or BaseSignal or None
+            Boolean mask of the navigation shape, True for patterns to skip,
+            e.g. from :meth:`get_vacuum_mask`. Their profiles are zero.
+
         Returns
         -------
         radial_profile: :obj:`hyperspy.signals.Signal1D`
@@ -392,31 +795,140 @@ class ElectronDiffraction(Signal2D):
             profiles = ed.get_radial_profile()
             profiles.plot()
         """
-
-        # TODO: the cython implementation is throwing dtype errors
-        radial_profiles = self.map(radial_average, cython=cython,
-                                   inplace=inplace,**kwargs)
-        # TODO: check this
-        ragged = len(radial_profiles.data.shape) == 1
-        if ragged:
-            max_len = max(map(len, radial_profiles.data))
-            radial_profiles = Signal1D([
-                np.pad(row.reshape(-1,), (0, max_len-len(row)), mode="constant", constant_values=0)
-                for row in radial_profiles.data])
-            return ElectronDiffractionProfile(radial_profiles)
+        if inplace is not None:
+            warnings.warn("The 'inplace' argument of get_radial_profile is "
+                          "deprecated and ignored.",
+                          VisibleDeprecationWarning)
+        if kwargs:
+            warnings.warn("The arguments {} of get_radial_profile are "
+                          "deprecated and ignored.".format(sorted(kwargs)),
+                          VisibleDeprecationWarning)
+        nav_dim = self.axes_manager.navigation_dimension
+        signal_shape = self.data.shape[nav_dim:]
+        center = getattr(center, 'data', center)
+        if center is not None:
+            center = np.asarray(center, dtype=float)
+        per_pattern = center is not None and center.ndim > 1
+        if navigation_mask is not None:
+            compact, keep = self._get_compact_signal(navigation_mask)
+            if per_pattern:
+                center = center.reshape(-1, 2)[keep.ravel()]
+            profiles = compact.get_radial_profile(center=center, cython=cython)
+            return self._scatter_compact_signal(profiles, keep)
+        if per_pattern:
+            nbins = max(get_radial_profile_length(signal_shape, c)
+                        for c in np.unique(center.reshape(-1, 2), axis=0))
         else:
-            radial_profiles.axes_manager.signal_axes[0].offset = 0
-            signal_axis = radial_profiles.axes_manager.signal_axes[0]
-            return ElectronDiffractionProfile(radial_profiles.as_signal1D(signal_axis))
+            nbins = get_radial_profile_length(signal_shape, center)
+        profiles = _map_frames(self.data, nav_dim, radial_average,
+                               output_shape=(nbins,), origins=center,
+                               keyword='center', cython=cython, nbins=nbins)
+        profiles = da.compute(profiles)[0]
+
+        axes = self.axes_manager._get_axes_dicts()[:nav_dim]
+        signal_axis = self.axes_manager.signal_axes[0].get_axis_dictionary()
+        signal_axis.update(size=nbins, offset=0)
+        return ElectronDiffractionProfile(profiles, axes=axes + [signal_axis])
+
+    def get_azimuthal_integral(self, npt_rad=None, npt_azim=None,
+                               center=None, radial_range=None,
+                               distortion=None, mask=None, pixel_split=1,
+                               solid_angle=False):
+        """Integrate the diffraction patterns over rings, or over (r, chi)
+        bins.
+
+        The lookup table of the integration is computed once for the geometry
+        and cached, see
+        :func:`pyxem.utils.expt_utils.get_azimuthal_integrator`.
+
+        Parameters
+        ----------
+        npt_rad : int
+            Number of radial bins. If None, the bins are one pixel wide.
+        npt_azim : int
+            Number of azimuthal bins over [-pi, pi). If None (default), the
+            patterns are integrated over the full circle into radial profiles.
+            Otherwise, caked patterns are returned.
+        center : tuple
+            The (x, y) pixel coordinates of the center. If None, defaults to
+            the center of the pattern.
+        radial_range : tuple
+            The (lower, upper) bounds of the radial bins, in the units of the
+            signal axes. If None, from zero to the pixel furthest from the
+            center.
+        distortion : np.array
+            3x3 affine transformation correcting the distortion of the
+            patterns, applied to the pixel coordinates relative to the center.
+        mask : np.array or Signal2D
+            Pixels to exclude from the integration, where True, e.g. from
+            :meth:`get_deadpixel_mask`.
+        pixel_split : int
+            Every pixel is split into pixel_split x pixel_split sub-pixels,
+            each assigned to its own bin.
+        solid_angle : bool
+            If True, correct the intensities for the solid angle of the pixels
+            on a flat detector, using the accelerating voltage in the metadata.
+
+        Returns
+        -------
+        integrated : ElectronDiffractionProfile or Signal2D
+            The radial profile of each diffraction pattern or, if `npt_azim`
+            is given, the caked pattern with the radial coordinate along x and
+            the azimuthal angle along y.
 
-    def reproject_as_polar(self, origin=None, jacobian=False, dr=1, dt=None):
+        """
+        nav_dim = self.axes_manager.navigation_dimension
+        signal_shape = self.data.shape[nav_dim:]
+        signal_axis = self.axes_manager.signal_axes[0]
+        wavelength = None
+        if solid_angle:
+            from pyxem.utils.sim_utils import get_electron_wavelength
+            try:
+                voltage = self.metadata.Acquisition_instrument.TEM.\
+                    accelerating_voltage
+            except AttributeError:
+                raise ValueError("The accelerating voltage must be set, see "
+                                 "set_experimental_parameters, to correct "
+                                 "for the solid angle.")
+            wavelength = get_electron_wavelength(voltage)
+        geometry = dict(center=center, calibration=signal_axis.scale,
+                        npt_rad=npt_rad, npt_azim=npt_azim,
+                        radial_range=radial_range, matrix=distortion,
+                        mask=getattr(mask, 'data', mask),
+                        pixel_split=pixel_split, wavelength=wavelength)
+        integrator, output_shape, radial_range = get_azimuthal_integrator(
+            signal_shape, **geometry)
+        integrated = _map_frames(self.data, nav_dim, azimuthal_integrate,
+                                 output_shape=output_shape, **geometry)
+        integrated = da.compute(integrated)[0]
+
+        dr = (radial_range[1] - radial_range[0]) / output_shape[-1]
+        axes = self.axes_manager._get_axes_dicts()[:nav_dim]
+        radial_axis = signal_axis.get_axis_dictionary()
+        radial_axis.update(name='k', size=output_shape[-1], scale=dr,
+                           offset=radial_range[0] + dr / 2)
+        if npt_azim is None:
+            return ElectronDiffractionProfile(integrated,
+                                              axes=axes + [radial_axis])
+        dchi = 2 * np.pi / npt_azim
+        azimuthal_axis = dict(name='chi', size=npt_azim, scale=dchi,
+                              offset=-np.pi + dchi / 2, units='rad')
+        return Signal2D(integrated, axes=axes + [azimuthal_axis, radial_axis])
+
+    def reproject_as_polar(self, origin=None, jacobian=False, dr=1, dt=None,
+                           inplace=True):
         """Reproject the diffraction data into polar coordinates.
 
+        The interpolation weights are computed once as a sparse matrix.
+
         Parameters
         ----------
-        origin : tuple
+        origin : tuple or array or BaseSignal
             The coordinate (x0, y0) of the image center, relative to bottom-left.
-            If 'None'defaults to the center of the pattern.
+            If 'None'defaults to the center of the pattern. An array, or
+            signal, with the navigation shape followed by (2,) gives the origin
+            of every pattern, e.g. derived from the beam positions found by
+            :meth:`get_direct_beam_position`.
         Jacobian : boolean
             Include ``r`` intensity scaling in the coordinate transform.
             This should be included to account for the changing pixel size that
@@ -429,41 +941,98 @@ class ElectronDiffraction(Signal2D):
             if ``dt=None``, dt will be set such that the number of theta values
             is equal to the maximum value between the height or the width of
             the image.
+        inplace : bool
+            If True (default), this signal is overwritten. Otherwise, returns a
+            new signal.
 
         Returns
         -------
         output : ElectronDiffraction
             The electron diffraction data in polar coordinates.
 
+        Examples
+        --------
+        .. code-block:: python
+
+            shifts = dp.get_direct_beam_position(3, 8)
+            h, w = dp.axes_manager.signal_shape[::-1]
+            origins = [round(w / 2), round(h / 2)] - shifts.data[..., ::-1]
+            dp.reproject_as_polar(origin=origins)
+
         """
-        return self.map(reproject_polar,
-                        origin=origin,
-                        jacobian=jacobian,
-                        dr=dr, dt=dt)
+        signal_shape = self.axes_manager.signal_shape[::-1]
+        origin = getattr(origin, 'data', origin)
+        if origin is not None:
+            origin = np.asarray(origin, dtype=float)
+        if origin is not None and origin.ndim > 1:
+            grid_origin = (signal_shape[1]//2, signal_shape[0]//2)
+        else:
+            grid_origin = origin
+        output_shape = get_polar_correction(signal_shape, grid_origin,
+                                            jacobian, dr, dt)[1]
+        return self._map_blocks(reproject_polar, output_shape=output_shape,
+                                inplace=inplace, origins=origin,
+                                keyword='origin', jacobian=jacobian, dr=dr,
+                                dt=dt)
 
     # TODO: This method needs to keep track of what's what better, with labels
     # axes also need to track calibrations.
-    def get_diffraction_variance(self):
+    def get_diffraction_variance(self, radial=False, center=None):
         """Calculates the variance of associated with each diffraction pixel.
 
+        The mean and variance are accumulated over blocks of patterns, or
+        chunks of lazy signals merged in a tree across workers, in a single
+        pass through the data, see
+        :func:`pyxem.utils.expt_utils.merge_moments`.
+
+        Parameters
+        ----------
+        radial : bool
+            If True, return radially averaged profiles of the mean and mean
+            squared patterns instead, with the variance of the annuli
+            <I^2> / <I>^2 - 1, as used in fluctuation electron microscopy.
+        center : tuple or None
+            The (x, y) pixel coordinates of the center of the radial
+            profiles. If None, defaults to the center of the pattern.
+
         Returns
         -------
         ElectronDiffraction
               A two dimensional signal containing the mean,
-              mean squared, and variance.
+              mean squared, and variance, or an ElectronDiffractionProfile
+              with their radial profiles.
         """
-        mean = self.mean(axis=self.axes_manager.navigation_axes)
-        square = np.square(self)
-        meansquare = square.mean(axis=square.axes_manager.navigation_axes)
-        variance = meansquare / np.square(mean) - 1
-        return stack((mean, meansquare, variance))
-
-    def get_direct_beam_position(self, radius_start,
-                                 radius_finish,
-                                 *args, **kwargs):
+        nav_dim = self.axes_manager.navigation_dimension
+        count, mean, m2 = _reduce_moments(self.data, nav_dim)
+        meansquare = m2 / count + np.square(mean)
+        axes = self.axes_manager._get_axes_dicts()[nav_dim:]
+        metadata = self.metadata.as_dictionary()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if radial:
+                mean, meansquare = radial_average(np.stack((mean, meansquare)),
+                                                  center=center)
+                signal_axis = axes[-1]
+                signal_axis.update(size=len(mean), offset=0)
+                variance = meansquare / np.square(mean) - 1
+                return ElectronDiffractionProfile(
+                    np.stack((mean, meansquare, variance)),
+                    axes=[dict(size=3)] + [signal_axis], metadata=metadata)
+            variance = m2 / count / np.square(mean)
+        return ElectronDiffraction(np.stack((mean, meansquare, variance)),
+                                   axes=[dict(size=3)] + axes,
+                                   metadata=metadata)
+
+    def get_direct_beam_position(self, radius_start=4, radius_finish=8,
+                                 method='cross_correlation', subsample=None,
+                                 degree=2, navigation_mask=None, **kwargs):
         """Estimate the direct beam position in each experimentally acquired
         electron diffraction pattern.
 
+        With `subsample`, the beam is only found in every `subsample`-th
+        pattern along each navigation axis and the positions of all patterns
+        are modelled by a smooth polynomial surface fitted to them, see
+        :func:`pyxem.utils.expt_utils.fit_shift_surface`. This suits shifts
+        due to the descan, which vary smoothly across the scan.
 
         Parameters
         ----------
@@ -472,54 +1041,154 @@ class ElectronDiffraction(Signal2D):
         
         radius_finish : int
             The upper bounds for the radius of the central disc to be used in the alignment
+
+        method : str
+            Method used to find the direct beam:
+
+            * 'cross_correlation' - register the pattern against circles of
+              radii from `radius_start` to `radius_finish`, see
+              :func:`pyxem.utils.expt_utils.find_beam_offset_cross_correlation`.
+            * 'center_of_mass' - centre of mass of the pattern, optionally
+              within a given `radius` of its centre, see
+              :func:`pyxem.utils.expt_utils.find_beam_offset_center_of_mass`.
+            * 'threshold' - centroid of the pixels above a `threshold`
+              fraction of the maximum, see
+              :func:`pyxem.utils.expt_utils.find_beam_offset_threshold`.
+            * 'hybrid' - centre of mass within `radius_finish` of the
+              thresholded centroid, see
+              :func:`pyxem.utils.expt_utils.find_beam_offset_hybrid`.
+
+        subsample : int or None
+            Step between the patterns in which the beam is found, along each
+            navigation axis. If None (default), it is found in all patterns.
+
+        degree : int
+            Total degree of the polynomial surface fitted with `subsample`.
+
+        navigation_mask : array or BaseSignal or None
+            Boolean mask of the navigation shape, True for patterns to skip,
+            e.g. from :meth:`get_vacuum_mask`. Their offsets are zero, or,
+            with `subsample`, those of the fitted surface.
+
+        kwargs :
+            Keyword arguments passed to the method.
             
         Returns
         -------
-        centers : ndarray
-            Array containing the centers for each SED pattern.
+        centers : Signal1D
+            Signal containing the offset (row, column) of the direct beam
+            from the center, for each SED pattern.
 
         """
-        shifts = self.map(find_beam_offset_cross_correlation,
-                              radius_start=radius_start,radius_finish=radius_finish,
-                              inplace=False,*args,**kwargs)
-        return shifts
-
-
-    def center_direct_beam(self,
-                           radius_start, radius_finish,
-                           *args, **kwargs):
+        if method == 'cross_correlation':
+            kwargs.update(radius_start=radius_start,
+                          radius_finish=radius_finish)
+        elif method == 'hybrid':
+            kwargs.setdefault('radius', radius_finish)
+        method_dict = {
+            'cross_correlation': find_beam_offset_cross_correlation,
+            'center_of_mass': find_beam_offset_center_of_mass,
+            'threshold': find_beam_offset_threshold,
+            'hybrid': find_beam_offset_hybrid,
+        }
+        if method in method_dict:
+            method = method_dict[method]
+        else:
+            raise NotImplementedError("The method `{}` is not implemented. "
+                                      "See documentation for available "
+                                      "implementations.".format(method))
 
+        nav_dim = self.axes_manager.navigation_dimension
+        if subsample is None or nav_dim == 0:
+            if navigation_mask is None:
+                shifts = _find_beam_shifts(self.data, nav_dim, method,
+                                           **kwargs)
+            else:
+                frames, keep = compact_navigation(self.data, navigation_mask,
+                                                  nav_dim)
+                shifts = scatter_navigation(
+                    _find_beam_shifts(frames, 1, method, **kwargs), keep)
+        else:
+            sample = (slice(None, None, subsample),) * nav_dim
+            data = self.data[sample]
+            if navigation_mask is None:
+                measured = _find_beam_shifts(data, nav_dim, method, **kwargs)
+                positions = np.indices(measured.shape[:-1]).reshape(
+                    nav_dim, -1).T
+                measured = measured.reshape(-1, 2)
+            else:
+                navigation_mask = np.asarray(
+                    getattr(navigation_mask, 'data', navigation_mask),
+                    dtype=bool).reshape(self.data.shape[:nav_dim])
+                frames, keep = compact_navigation(
+                    data, navigation_mask[sample], nav_dim)
+                measured = _find_beam_shifts(frames, 1, method, **kwargs)
+                positions = np.argwhere(keep)
+            shifts = fit_shift_surface(positions * subsample, measured,
+                                       self.data.shape[:nav_dim], degree)
+        axes = self.axes_manager._get_axes_dicts()[:nav_dim]
+        return Signal1D(shifts, axes=axes + [dict(size=2)])
+
+    def center_direct_beam(self, radius_start=4, radius_finish=8,
+                           method='cross_correlation', shifts=None,
+                           interpolation='bilinear', D=None, inplace=True,
+                           **kwargs):
         """Estimate the direct beam position in each experimentally acquired
         electron diffraction pattern and translate it to the center of the
         image square.
 
         Parameters
         ----------
-
         radius_start : int
             The lower bound for the radius of the central disc to be used in the alignment
-        
+
         radius_finish : int
             The upper bounds for the radius of the central disc to be used in the alignment
 
-        Returns
-        -------
-        Diffraction Pattern, centered.
+        method : str
+            Method used to find the direct beam, see
+            :meth:`get_direct_beam_position`.
 
-        """
-        nav_shape_x = self.data.shape[0]
-        nav_shape_y = self.data.shape[1]
-        origin_coordinates = np.array((self.data.shape[2]/2-0.5,self.data.shape[3]/2-0.5))
+        shifts : Signal1D or array or None
+            Shifts (row, column) of every pattern, as returned by
+            :meth:`get_direct_beam_position`. If None (default), they are
+            estimated with `method`.
+
+        interpolation : str
+            'bilinear' (default) or 'fourier', see
+            :func:`pyxem.utils.expt_utils.shift_patterns`.
+
+        D : array or None
+            3x3 affine transformation applied to the centered patterns, as
+            in :meth:`apply_affine_transformation`, in the same bilinear
+            interpolation, so that the data is resampled only once.
 
-      
-        shifts = self.get_direct_beam_position(radius_start,radius_finish,*args,**kwargs)
+        inplace : bool
+            If True (default), this signal is overwritten. Otherwise, returns a
+            new signal.
 
-        shifts = -1*shifts.data
-        shifts = shifts.reshape(nav_shape_x*nav_shape_y,2)
+        kwargs :
+            Keyword arguments passed to :meth:`get_direct_beam_position`,
+            e.g. `subsample` to center all patterns with shifts modelled from
+            a subsample of them.
 
-        return self.align2D(shifts=shifts, crop=False, fill_value=0,*args,**kwargs)
+        Returns
+        -------
+        Diffraction Pattern, centered, as float, if `inplace` is False.
 
-    def remove_background(self, method='model', *args, **kwargs):
+        """
+        nav_shape = self.axes_manager.navigation_shape[::-1]
+        if shifts is None:
+            shifts = self.get_direct_beam_position(
+                radius_start, radius_finish, method=method, **kwargs)
+        shifts = np.asarray(getattr(shifts, 'data', shifts), dtype=float)
+        shifts = shifts.reshape(nav_shape + (2,))
+        return self._map_blocks(shift_patterns, inplace=inplace,
+                                origins=shifts, keyword='shifts',
+                                interpolation=interpolation, matrix=D)
+
+    def remove_background(self, method='model', *args, navigation_mask=None,
+                          **kwargs):
         """Perform background subtraction via multiple methods.
 
         Parameters
@@ -553,6 +1222,11 @@ class ElectronDiffraction(Signal2D):
             size of the peaks (median only).
         bg : array
             Background array extracted from vacuum. (subtract_reference only)
+        navigation_mask : array or BaseSignal, optional
+            Boolean mask of the navigation shape, True for patterns to skip,
+            e.g. from :meth:`get_vacuum_mask`. Only the other patterns are
+            processed, and are used for the background model, and the
+            skipped patterns are set to zero.
 
         Returns
         -------
@@ -564,11 +1238,15 @@ class ElectronDiffraction(Signal2D):
         :meth:`get_background_model`
 
         """
+        if navigation_mask is not None:
+            compact, keep = self._get_compact_signal(navigation_mask)
+            bg_subtracted = compact.remove_background(method, *args, **kwargs)
+            return self._scatter_compact_signal(bg_subtracted, keep)
+
         if method == 'h-dome':
-            scale = self.data.max()
-            self.data = self.data / scale
-            bg_subtracted = self.map(regional_filter,
-                                     inplace=False, *args, **kwargs)
+            scaled = self._deepcopy_with_new_data(self.data / self.data.max())
+            bg_subtracted = scaled.map(regional_filter,
+                                       inplace=False, *args, **kwargs)
             bg_subtracted.map(filters.rank.mean, selem=square(3))
             bg_subtracted.data = bg_subtracted.data / bg_subtracted.data.max()
 
@@ -594,7 +1272,8 @@ class ElectronDiffraction(Signal2D):
                                      inplace=False, *args, **kwargs)
 
         elif method == 'reference_pattern':
-            bg_subtracted = self.map(subtract_reference, *args, **kwargs)
+            bg_subtracted = self.map(subtract_reference,
+                                     inplace=False, *args, **kwargs)
 
         else:
             raise NotImplementedError(
@@ -704,7 +1383,8 @@ class ElectronDiffraction(Signal2D):
         self.learning_results.loadings = np.nan_to_num(
             self.learning_results.loadings)
 
-    def find_peaks(self, method='skimage', *args, **kwargs):
+    def find_peaks(self, method='skimage', *args, navigation_mask=None,
+                   **kwargs):
         """Find the position of diffraction peaks.
 
         Function to locate the positive peaks in an image using various, user
@@ -735,6 +1415,9 @@ class ElectronDiffraction(Signal2D):
 
         *args
             associated with above methods
+        navigation_mask : array or BaseSignal, optional
+            Boolean mask of the navigation shape, True for patterns to skip,
+            e.g. from :meth:`get_vacuum_mask`. No peaks are found in them.
         **kwargs
             associated with above methods.
 
@@ -746,6 +1429,12 @@ class ElectronDiffraction(Signal2D):
             object contiaining the diffraction vectors found at each navigation
             position, in calibrated units.
         """
+        if navigation_mask is not None:
+            compact, keep = self._get_compact_signal(navigation_mask)
+            peaks = compact.find_peaks(method, *args, **kwargs)
+            return self._scatter_compact_signal(peaks, keep,
+                                                fill_value=np.zeros((0, 2)))
+
         method_dict = {
             'skimage': peak_local_max,
             'zaefferer': find_peaks_zaefferer,
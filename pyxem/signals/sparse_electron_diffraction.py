@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+"""Sparse storage of electron diffraction data recorded in counting mode.
+
+"""
+
+import json
+
+import numpy as np
+import dask.array as da
+from dask.base import tokenize
+from scipy import sparse
+from hyperspy.signals import BaseSignal, Signal1D
+
+from pyxem.signals.diffraction_profile import ElectronDiffractionProfile
+from pyxem.signals.electron_diffraction import (ElectronDiffraction,
+                                                LazyElectronDiffraction)
+from pyxem.utils.expt_utils import (get_radial_correction,
+                                    get_radial_profile_length)
+from pyxem.utils.vdf_utils import roi_to_mask
+
+
+def _sparsify(frames):
+    """Convert a stack of frames of shape (n, height, width) into event
+    lists.
+
+    Returns
+    -------
+    nnz : np.array
+        Number of non-zero pixels of every frame.
+    indices : np.array
+        Flat pixel index of every non-zero pixel, frame by frame.
+    counts : np.array
+        Value of every non-zero pixel.
+    """
+    flat = frames.reshape(len(frames), -1)
+    rows, indices = np.nonzero(flat)
+    return (np.bincount(rows, minlength=len(frames)),
+            indices.astype(np.uint32), flat[rows, indices])
+
+
+def _densify(indptr, indices, counts, shape):
+    """Fill the frames of the event lists `indptr[0]:indptr[-1]` into a dense
+    array of the given shape."""
+    n = len(indptr) - 1
+    frames = np.zeros((n, int(np.prod(shape[-2:]))), dtype=counts.dtype)
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    frames[rows, indices[indptr[0]:indptr[-1]]] = \
+        counts[indptr[0]:indptr[-1]]
+    return frames.reshape(shape)
+
+
+def _clean_axes(axes):
+    """Keep only the JSON serialisable attributes of axes dictionaries."""
+    cleaned = []
+    for axis in axes:
+        axis = {key: axis[key] for key in
+                ('size', 'scale', 'offset', 'name', 'units', 'navigate')
+                if key in axis and (key not in ('name', 'units') or
+                                    isinstance(axis[key], str))}
+        cleaned.append(axis)
+    return cleaned
+
+
+class SparseElectronDiffraction(object):
+    """Electron diffraction data stored as lists of counting events.
+
+    Every diffraction pattern is stored as the flat indices and values of its
+    non-zero pixels, in compressed sparse row (CSR) layout: the events of the
+    pattern at flat navigation position `i` are
+    `indices[indptr[i]:indptr[i + 1]]` and `counts[indptr[i]:indptr[i + 1]]`.
+    For sparse, low dose data this takes a fraction of the memory of the
+    dense array, and virtual images, radial profiles, sums and centres of
+    mass are computed directly from the events.
+
+    Parameters
+    ----------
+    indptr : np.array
+        Array of length (number of patterns + 1) with the start of the events
+        of every pattern.
+    indices : np.array
+        Flat pixel index of every event.
+    counts : np.array
+        Number of counts of every event.
+    navigation_shape : tuple
+        The navigation shape, in array order.
+    signal_shape : tuple
+        The shape (height, width) of a diffraction pattern.
+    axes : list of dict, optional
+        Dictionaries of the navigation and signal axes in array order, as
+        returned by `AxesManager._get_axes_dicts`.
+    """
+
+    def __init__(self, indptr, indices, counts, navigation_shape,
+                 signal_shape, axes=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices)
+        self.counts = np.asarray(counts)
+        self.navigation_shape = tuple(navigation_shape)
+        self.signal_shape = tuple(signal_shape)
+        if len(self.indptr) != int(np.prod(self.navigation_shape)) + 1:
+            raise ValueError('indptr must have one entry more than the number '
+                             'of navigation positions.')
+        if axes is None:
+            axes = [{'size': size, 'navigate': True}
+                    for size in self.navigation_shape]
+            axes += [{'size': size, 'navigate': False}
+                     for size in self.signal_shape]
+        self.axes = _clean_axes(axes)
+
+    def __repr__(self):
+        return '<SparseElectronDiffraction, navigation %s, signal %s, ' \
+               '%d events>' % (self.navigation_shape[::-1],
+                               self.signal_shape[::-1], len(self.indices))
+
+    @property
+    def density(self):
+        """The fraction of non-zero pixels."""
+        size = np.prod(self.navigation_shape) * np.prod(self.signal_shape)
+        return len(self.indices) / size
+
+    @classmethod
+    def from_signal(cls, signal):
+        """Create the sparse representation of a diffraction signal.
+
+        Lazy and memory mapped signals are converted block by block along the
+        first navigation axis, so that only one block is dense in memory at
+        a time.
+
+        Parameters
+        ----------
+        signal : :obj:`ElectronDiffraction` or :obj:`LazyElectronDiffraction`
+            The signal to convert.
+
+        Returns
+        -------
+        sparse : :obj:`SparseElectronDiffraction`
+        """
+        data = signal.data
+        signal_shape = data.shape[-2:]
+        navigation_shape = data.shape[:-2]
+        if not navigation_shape:
+            data = data[None]
+        if isinstance(data, da.Array):
+            step = data.chunks[0][0]
+        else:
+            row_size = np.prod(data.shape[1:]) * data.dtype.itemsize
+            step = max(1, 2**25 // row_size)
+        nnz, indices, counts = [], [], []
+        for start in range(0, len(data), step):
+            block = np.asarray(data[start:start + step])
+            block_nnz, block_indices, block_counts = _sparsify(
+                block.reshape((-1,) + signal_shape))
+            nnz.append(block_nnz)
+            indices.append(block_indices)
+            counts.append(block_counts)
+        indptr = np.concatenate(([0], np.cumsum(np.concatenate(nnz))))
+        return cls(indptr, np.concatenate(indices), np.concatenate(counts),
+                   navigation_shape, signal_shape,
+                   axes=signal.axes_manager._get_axes_dicts())
+
+    def save(self, filename):
+        """Save the events as a compressed numpy .npz file.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file.
+        """
+        np.savez_compressed(filename, indptr=self.indptr,
+                            indices=self.indices, counts=self.counts,
+                            navigation_shape=self.navigation_shape,
+                            signal_shape=self.signal_shape,
+                            axes=json.dumps(self.axes))
+
+    @classmethod
+    def load(cls, filename):
+        """Load events saved by `SparseElectronDiffraction.save`.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file.
+
+        Returns
+        -------
+        sparse : :obj:`SparseElectronDiffraction`
+        """
+        with np.load(filename) as f:
+            return cls(f['indptr'], f['indices'], f['counts'],
+                       f['navigation_shape'], f['signal_shape'],
+                       axes=json.loads(str(f['axes'])))
+
+    def to_dense(self, lazy=True, chunks=None):
+        """Convert to a dense diffraction signal.
+
+        Parameters
+        ----------
+        lazy : bool
+            If True (default), a LazyElectronDiffraction is returned whose
+            chunks are filled from the events only when they are computed.
+        chunks : int, optional
+            Number of entries of the first navigation axis per chunk. By
+            default chunks of ~32 MB are used.
+
+        Returns
+        -------
+        dense : :obj:`ElectronDiffraction` or :obj:`LazyElectronDiffraction`
+        """
+        shape = self.navigation_shape + self.signal_shape
+        if not lazy:
+            data = _densify(self.indptr, self.indices, self.counts,
+                            (-1,) + self.signal_shape).reshape(shape)
+            return ElectronDiffraction(data, axes=self.axes)
+
+        shape = (self.navigation_shape or (1,)) + self.signal_shape
+        n = shape[0]
+        row_frames = int(np.prod(shape[1:-2]))
+        if chunks is None:
+            row_size = (row_frames * np.prod(self.signal_shape) *
+                        self.counts.dtype.itemsize)
+            chunks = max(1, 2**25 // row_size)
+        name = 'sparse-to-dense-' + tokenize(self.indptr, self.indices,
+                                             self.counts, shape, chunks)
+        dsk = {}
+        starts = range(0, n, chunks)
+        for i, start in enumerate(starts):
+            stop = min(start + chunks, n)
+            indptr = self.indptr[start * row_frames:stop * row_frames + 1]
+            block_shape = (stop - start,) + shape[1:]
+            key = (name, i) + (0,) * (len(shape) - 1)
+            dsk[key] = (_densify, indptr, self.indices, self.counts,
+                        block_shape)
+        block_chunks = (tuple(min(chunks, n - start) for start in starts),)
+        block_chunks += tuple((size,) for size in shape[1:])
+        data = da.Array(dsk, name, block_chunks, dtype=self.counts.dtype)
+        if not self.navigation_shape:
+            data = data[0]
+        return LazyElectronDiffraction(data, axes=self.axes)
+
+    def _frame_of_events(self):
+        """The flat navigation index of every event."""
+        return np.repeat(np.arange(len(self.indptr) - 1),
+                         np.diff(self.indptr))
+
+    def _navigation_axes(self, navigate=True):
+        return [dict(axis, navigate=navigate)
+                for axis in self.axes[:len(self.navigation_shape)]]
+
+    def sum(self):
+        """Sum of all diffraction patterns.
+
+        Returns
+        -------
+        pattern : :obj:`ElectronDiffraction`
+            The summed diffraction pattern.
+        """
+        pattern = np.bincount(self.indices, weights=self.counts,
+                              minlength=int(np.prod(self.signal_shape)))
+        return ElectronDiffraction(pattern.reshape(self.signal_shape),
+                                   axes=self.axes[-2:])
+
+    def get_virtual_image(self, roi):
+        """Obtains a virtual image associated with a specified ROI.
+
+        Parameters
+        ----------
+        roi: :obj:`hyperspy.roi.BaseInteractiveROI`
+            Any interactive ROI detailed in HyperSpy.
+
+        Returns
+        -------
+        dark_field_sum: :obj:`hyperspy.signals.Signal2D`
+            The virtual image signal associated with the specified roi.
+
+        See also
+        --------
+        :meth:`ElectronDiffraction.get_virtual_image`
+        """
+        mask = roi_to_mask(roi, self.axes[-2:]).ravel()
+        inside = mask[self.indices]
+        image = np.bincount(self._frame_of_events()[inside],
+                            weights=self.counts[inside],
+                            minlength=len(self.indptr) - 1)
+        dark_field_sum = BaseSignal(image.reshape(self.navigation_shape),
+                                    axes=self._navigation_axes())
+        dark_field_sum.metadata.General.title = "Virtual Dark Field"
+        return dark_field_sum.as_signal2D((0, 1))
+
+    def get_radial_profile(self, center=None):
+        """Return the radial profile of the diffraction patterns.
+
+        The event lists are multiplied with the cached matrix of
+        :func:`pyxem.utils.expt_utils.get_radial_correction`, as used by
+        :meth:`ElectronDiffraction.get_radial_profile`.
+
+        Parameters
+        ----------
+        center : tuple or array or BaseSignal
+            The (x, y) pixel coordinates of the center. If None, defaults to
+            the center of the pattern. An array, or signal, with the navigation
+            shape followed by (2,) gives the center of every pattern; the
+            profiles are then as long as the longest one.
+
+        Returns
+        -------
+        radial_profile: :obj:`ElectronDiffractionProfile`
+            The radial average profile of each diffraction pattern.
+        """
+        n = len(self.indptr) - 1
+        events = sparse.csr_matrix(
+            (self.counts, self.indices, self.indptr),
+            shape=(n, int(np.prod(self.signal_shape))))
+        center = getattr(center, 'data', center)
+        if center is None or np.ndim(center) == 1:
+            correction = get_radial_correction(self.signal_shape, center)
+            averaged = events.dot(correction.T).toarray()
+        else:
+            centers, inverse = np.unique(np.reshape(center, (-1, 2)), axis=0,
+                                         return_inverse=True)
+            inverse = inverse.ravel()
+            nbins = max(get_radial_profile_length(self.signal_shape, c)
+                        for c in centers)
+            averaged = np.empty((n, nbins))
+            for i, c in enumerate(centers):
+                selected = np.flatnonzero(inverse == i)
+                correction = get_radial_correction(self.signal_shape, c, nbins)
+                averaged[selected] = events[selected].dot(
+                    correction.T).toarray()
+        nbins = averaged.shape[1]
+        signal_axis = dict(self.axes[-1], size=nbins, offset=0,
+                           navigate=False)
+        return ElectronDiffractionProfile(
+            averaged.reshape(self.navigation_shape + (nbins,)),
+            axes=self._navigation_axes() + [signal_axis])
+
+    def center_of_mass(self):
+        """Centre of mass of every diffraction pattern.
+
+        Returns
+        -------
+        center_of_mass : :obj:`hyperspy.signals.Signal1D`
+            The (x, y) pixel coordinates of the centre of mass of every
+            pattern. Patterns without counts give NaN.
+        """
+        frames = self._frame_of_events()
+        n = len(self.indptr) - 1
+        x = self.indices % self.signal_shape[1]
+        y = self.indices // self.signal_shape[1]
+        total = np.bincount(frames, weights=self.counts, minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            com = np.stack([
+                np.bincount(frames, weights=self.counts * x, minlength=n),
+                np.bincount(frames, weights=self.counts * y, minlength=n),
+            ], axis=-1) / total[:, None]
+        com = Signal1D(com.reshape(self.navigation_shape + (2,)),
+                       axes=self._navigation_axes() + [{'size': 2,
+                                                        'navigate': False}])
+        com.metadata.General.title = "Center of mass"
+        return com
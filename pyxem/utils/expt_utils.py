@@ -16,8 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import lru_cache
+from itertools import product
+
 import numpy as np
 import scipy.ndimage as ndi
+from scipy import sparse
 from scipy.ndimage.interpolation import shift
 from scipy.optimize import curve_fit, minimize
 from skimage import transform as tf
@@ -25,7 +29,7 @@ from skimage import morphology, filters
 from skimage.morphology import square, opening
 from skimage.filters import (threshold_sauvola, threshold_otsu)
 from skimage.draw import ellipse_perimeter
-from skimage.feature import register_translation
+from skimage.util import img_as_float
 
 try:
     from .radialprofile import radialprofile as radialprofile_cy
@@ -34,6 +38,11 @@ except ImportError:
 else:
     _USE_CY_RADIAL_PROFILE = True
 
+# Types accepted by the compiled radial profile, others are cast to float.
+_CY_RADIAL_PROFILE_DTYPES = tuple(map(np.dtype, (
+    np.uint8, np.uint16, np.uint32, np.int32, np.int64, np.float32,
+    np.float64)))
+
 """
 This module contains utility functions for processing electron diffraction
 patterns.
@@ -104,47 +113,231 @@ def _polar2cart(r, theta):
     x = r * np.sin(theta)
     return x, y
 
-def radial_average(z,cython=False):
+def _radial_bins(shape, center):
+    """Radial bin of every pixel of a pattern about the center (x, y)."""
+    y, x = np.indices(shape)
+    r = np.sqrt((x - center[0])**2 + (y - center[1])**2)
+    #the subtraction of 0.5 gets the 0 in the correct place
+    return np.rint(r - 0.5).astype(int)
+
+def get_radial_profile_length(shape, center=None):
+    """Number of bins of the radial profile of a diffraction pattern.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the diffraction pattern.
+    center : tuple
+        The (x, y) pixel coordinates of the center. If None, defaults to the
+        center of the pattern.
+
+    Returns
+    -------
+    length : int
+        Number of bins, up to the corner of the pattern furthest from the
+        center.
+    """
+    if center is None:
+        center = (shape[1] / 2 - 0.5, shape[0] / 2 - 0.5)
+    # The furthest pixel is one of the corners.
+    y = np.array([0, 0, shape[0] - 1, shape[0] - 1])
+    x = np.array([0, shape[1] - 1, 0, shape[1] - 1])
+    r = np.sqrt((x - center[0])**2 + (y - center[1])**2)
+    return int(np.rint(r - 0.5).max()) + 1
+
+@lru_cache(maxsize=8)
+def _radial_correction(shape, center, nbins):
+    bins = _radial_bins(shape, center).ravel()
+    pixels = np.flatnonzero(bins < nbins)
+    bins = bins[pixels]
+    counts = np.bincount(bins, minlength=nbins)
+    return sparse.csr_matrix((1. / counts[bins], (bins, pixels)),
+                             shape=(nbins, np.prod(shape)))
+
+def get_radial_correction(shape, center=None, nbins=None):
+    """Sparse matrix averaging diffraction patterns of a given shape over
+    rings about a center.
+
+    Every pixel is binned by its distance to the center, rounded to the
+    nearest integer, as in :func:`radial_average`. The matrix is computed
+    once for every shape, center and number of bins and cached.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the diffraction patterns.
+    center : tuple
+        The (x, y) pixel coordinates of the center. If None, defaults to the
+        center of the pattern.
+    nbins : int
+        Number of bins of the profile. If None, defaults to
+        :func:`get_radial_profile_length`.
+
+    Returns
+    -------
+    correction : scipy.sparse.csr_matrix
+        Matrix of shape (nbins, shape[0] * shape[1]) giving the radial profile
+        of a flattened pattern.
+    """
+    shape = tuple(shape)
+    if center is None:
+        center = (shape[1] / 2 - 0.5, shape[0] / 2 - 0.5)
+    if nbins is None:
+        nbins = get_radial_profile_length(shape, center)
+    return _radial_correction(shape, tuple(np.asarray(center, dtype=float)),
+                              int(nbins))
+
+def _apply_radial_correction(z, correction, cython):
+    """Radial profiles of a stack of patterns with a precomputed matrix."""
+    if not (_USE_CY_RADIAL_PROFILE and cython):
+        return apply_interpolation_matrix(z, correction, correction.shape[:1])
+    frames = np.reshape(z, (-1, z.shape[-2] * z.shape[-1]))
+    if frames.dtype not in _CY_RADIAL_PROFILE_DTYPES:
+        frames = frames.astype(float)
+    averaged = radialprofile_cy(np.ascontiguousarray(frames),
+                                correction.indptr.astype(np.int32),
+                                correction.indices.astype(np.int32),
+                                correction.data)
+    return averaged.reshape(z.shape[:-2] + correction.shape[:1])
+
+def radial_average(z, cython=False, center=None, nbins=None):
     """Calculate the radial profile by azimuthal averaging about a specified
     center.
 
+    The pixels are binned once for the shape of the pattern and the center,
+    see :func:`get_radial_correction`, so that stacks of patterns are
+    averaged in a single matrix product.
+
     Parameters
     ----------
-
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
     cython=False
         Set to False if cython needs to be avoided. If cythonized option is not
         not avaliable the behaviour is equivilant to cython == False
+    center : tuple or np.array
+        The (x, y) pixel coordinates of the center. If None, defaults to the
+        center of the pattern. For a stack of patterns, an array of shape
+        z.shape[:-2] + (2,) gives the center of every pattern.
+    nbins : int
+        Number of bins of the profiles. If None, defaults to the length of the
+        longest profile.
+
     Returns
     -------
     radial_profile : array
-        Radial profile of the diffraction pattern.
+        Radial profile of the diffraction pattern, or stack of profiles.
     """
-    
-    center = ((z.shape[0]/2)-0.5,(z.shape[1]/2)-0.5) #geometric shape work, not 0 indexing
-    
-    if _USE_CY_RADIAL_PROFILE and cython:
-        averaged = radialprofile_cy(z, center)
+    shape = z.shape[-2:]
+    if center is None or np.ndim(center) == 1:
+        correction = get_radial_correction(shape, center, nbins)
+        return _apply_radial_correction(z, correction, cython)
+
+    centers, inverse = np.unique(np.reshape(center, (-1, 2)), axis=0,
+                                 return_inverse=True)
+    inverse = inverse.ravel()
+    if nbins is None:
+        nbins = max(get_radial_profile_length(shape, c) for c in centers)
+    frames = np.reshape(z, (-1,) + shape)
+    averaged = np.empty((len(frames), nbins))
+    for i, c in enumerate(centers):
+        correction = get_radial_correction(shape, c, nbins)
+        selected = inverse == i
+        averaged[selected] = _apply_radial_correction(frames[selected],
+                                                      correction, cython)
+    return averaged.reshape(z.shape[:-2] + (nbins,))
+
+def _polar_grid(shape, origin, dr, dt):
+    """Radii and angles of the polar grid used by :func:`reproject_polar`."""
+    x, y = _index_coords(np.empty(shape), origin=origin)
+    r, theta = _cart2polar(x, y)  # convert (x,y) -> (r,θ), note θ=0 is vertical
+
+    nr = int(np.ceil((r.max()-r.min())/dr))
+
+    if dt is None:
+        nt = max(shape)
     else:
-        y, x = np.indices(z.shape)
-        r = np.sqrt((x - center[1])**2 + (y - center[0])**2)
-        r = np.rint(r-0.5).astype(np.int) 
-        #the subtraction of 0.5 gets the 0 in the correct place
+        # dt in radians
+        nt = int(np.ceil((theta.max()-theta.min())/dt))
+
+    # Make a regular (in polar space) grid based on the min and max r & theta
+    r_i = np.linspace(r.min(), r.max(), nr, endpoint=False)
+    theta_i = np.linspace(theta.min(), theta.max(), nt, endpoint=False)
+    return r_i, theta_i
+
+@lru_cache(maxsize=8)
+def _polar_correction(shape, origin, jacobian, dr, dt, grid_origin):
+    r_i, theta_i = _polar_grid(shape, grid_origin, dr, dt)
+    theta_grid, r_grid = np.meshgrid(theta_i, r_i)
+
+    # Project the r and theta grid back into pixel coordinates
+    X, Y = _polar2cart(r_grid, theta_grid)
+    correction = get_spline_matrix(Y + origin[1], X + origin[0], shape)
+    if jacobian:
+        correction = sparse.diags(r_grid.ravel()).dot(correction).tocsr()
+    return correction, r_grid.shape
+
+def get_polar_correction(shape, origin=None, jacobian=False, dr=1, dt=None,
+                         grid_origin=None):
+    """Interpolation matrix reprojecting diffraction patterns of a given
+    shape into polar coordinates, see :func:`reproject_polar`.
 
-        tbin = np.bincount(r.ravel(), z.ravel())
-        nr = np.bincount(r.ravel())
-        averaged = np.nan_to_num(tbin / nr)
+    The matrix is computed once for every set of parameters and cached. It
+    applies to the spline coefficients of the patterns, see
+    :func:`spline_prefilter`.
 
-    return averaged
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the diffraction patterns.
+    origin : tuple
+        The coordinate (x0, y0) of the image center. If None, defaults to the
+        center of the pattern.
+    jacobian : boolean
+        Include ``r`` intensity scaling in the coordinate transform.
+    dr : float
+        Radial coordinate spacing for the grid interpolation.
+    dt : float
+        Angular coordinate spacing (in radians).
+    grid_origin : tuple
+        The coordinate (x0, y0) from which the extent of the polar grid is
+        determined. If None, defaults to `origin`. Patterns reprojected about
+        different origins with the same `grid_origin` share the same grid.
+
+    Returns
+    -------
+    correction : scipy.sparse.csr_matrix
+        Interpolation matrix, see :func:`get_interpolation_matrix`.
+    output_shape : tuple
+        Shape (r, theta) of the polar images.
+    """
+    shape = tuple(shape)
+    if origin is None:
+        origin = (shape[1]//2, shape[0]//2)
+    if grid_origin is None:
+        grid_origin = origin
+    return _polar_correction(shape, tuple(np.asarray(origin, dtype=float)),
+                             jacobian, dr, dt,
+                             tuple(np.asarray(grid_origin, dtype=float)))
 
 def reproject_polar(z, origin=None, jacobian=False, dr=1, dt=None):
     """
     Reprojects a 2D diffraction pattern into a polar coordinate system.
 
+    The interpolation weights are precomputed for the shape of the pattern
+    and the parameters of the projection, see :func:`get_polar_correction`,
+    so that stacks of patterns are reprojected in a single matrix product.
+
     Parameters
     ----------
-    origin : tuple
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    origin : tuple or np.array
         The coordinate (x0, y0) of the image center, relative to bottom-left. If
-        'None'defaults to
+        'None'defaults to the center of the pattern. For a stack of patterns,
+        an array of shape z.shape[:-2] + (2,) gives the origin of every
+        pattern, in which case the polar grid is that about the center of the
+        pattern.
     Jacobian : boolean
         Include ``r`` intensity scaling in the coordinate transform.
         This should be included to account for the changing pixel size that
@@ -160,53 +353,171 @@ def reproject_polar(z, origin=None, jacobian=False, dr=1, dt=None):
 
     Returns
     -------
-    output : 2D np.array
-        The polar image (r, theta)
+    output : np.array
+        The polar image (r, theta), or stack of polar images, as float.
 
     Notes
     -----
     Adapted from: PyAbel, www.github.com/PyAbel/PyAbel
 
     """
-    # bottom-left coordinate system requires numpy image to be np.flipud
-    data = np.flipud(z)
-
-    ny, nx = data.shape[:2]
-    if origin is None:
-        origin = (nx//2, ny//2)
-
-    # Determine that the min and max r and theta coords will be...
-    x, y = _index_coords(z, origin=origin)  # (x,y) coordinates of each pixel
-    r, theta = _cart2polar(x, y)  # convert (x,y) -> (r,θ), note θ=0 is vertical
-
-    nr = np.int(np.ceil((r.max()-r.min())/dr))
-
-    if dt is None:
-        nt = max(nx, ny)
+    shape = z.shape[-2:]
+    coefficients = spline_prefilter(z)
+    if origin is None or np.ndim(origin) == 1:
+        correction, output_shape = get_polar_correction(shape, origin,
+                                                        jacobian, dr, dt)
+        return apply_interpolation_matrix(coefficients, correction,
+                                          output_shape)
+
+    # One matrix for every distinct origin, all on the same grid.
+    grid_origin = (shape[1]//2, shape[0]//2)
+    coefficients = coefficients.reshape((-1,) + shape)
+    origins, inverse = np.unique(np.reshape(origin, (-1, 2)), axis=0,
+                                 return_inverse=True)
+    inverse = inverse.ravel()
+    output = None
+    for i, o in enumerate(origins):
+        correction, output_shape = get_polar_correction(
+            shape, o, jacobian, dr, dt, grid_origin=grid_origin)
+        if output is None:
+            output = np.empty((len(coefficients),) + output_shape)
+        frames = inverse == i
+        output[frames] = apply_interpolation_matrix(coefficients[frames],
+                                                    correction, output_shape)
+    return output.reshape(z.shape[:-2] + output_shape)
+
+@lru_cache(maxsize=4)
+def _azimuthal_integrator(shape, center, calibration, npt_rad, npt_azim,
+                          radial_range, matrix, mask, pixel_split, wavelength):
+    h, w = shape
+    # Split every pixel into pixel_split x pixel_split sub-pixels.
+    offsets = (np.arange(pixel_split) + 0.5) / pixel_split - 0.5
+    y = (np.arange(h)[:, None] + offsets).ravel()
+    x = (np.arange(w)[:, None] + offsets).ravel()
+    y, x = np.meshgrid(y - center[1], x - center[0], indexing='ij')
+    pixels = (np.arange(h).repeat(pixel_split)[:, None] * w +
+              np.arange(w).repeat(pixel_split)).ravel()
+    # Undo the distortion about the center.
+    matrix = np.reshape(matrix, (3, 3))
+    x, y = (matrix[0, 0] * x + matrix[0, 1] * y + matrix[0, 2],
+            matrix[1, 0] * x + matrix[1, 1] * y + matrix[1, 2])
+    r = np.sqrt(x**2 + y**2).ravel() * calibration
+    chi = np.arctan2(y, x).ravel()
+
+    if radial_range is None:
+        radial_range = (0., r.max())
+    if npt_rad is None:
+        npt_rad = int(np.ceil((radial_range[1] - radial_range[0]) /
+                              calibration))
+    r_bin = np.floor((r - radial_range[0]) /
+                     (radial_range[1] - radial_range[0]) * npt_rad).astype(int)
+    # The upper bound belongs to the last bin.
+    r_bin[r == radial_range[1]] = npt_rad - 1
+    valid = (r_bin >= 0) & (r_bin < npt_rad)
+    if npt_azim is None:
+        bins, output_shape = r_bin, (npt_rad,)
     else:
-        # dt in radians
-        nt = np.int(np.ceil((theta.max()-theta.min())/dt))
+        chi_bin = np.floor((chi + np.pi) / (2 * np.pi) * npt_azim).astype(int)
+        bins = np.minimum(chi_bin, npt_azim - 1) * npt_rad + r_bin
+        output_shape = (npt_azim, npt_rad)
+    if mask is not None:
+        valid &= ~np.frombuffer(mask, dtype=bool)[pixels]
+    bins, pixels = bins[valid], pixels[valid]
+
+    area = np.bincount(bins, minlength=np.prod(output_shape))
+    weights = 1. / area[bins]
+    if wavelength is not None:
+        # Flat detector: the solid angle of a pixel scales as cos^3(2 theta).
+        two_theta = 2 * np.arcsin(wavelength * r[valid] / 2)
+        weights /= np.cos(two_theta)**3
+    integrator = sparse.csr_matrix((weights, (bins, pixels)),
+                                   shape=(np.prod(output_shape), h * w))
+    return integrator, output_shape, tuple(radial_range)
+
+def get_azimuthal_integrator(shape, center=None, calibration=1.,
+                             npt_rad=None, npt_azim=None, radial_range=None,
+                             matrix=None, mask=None, pixel_split=1,
+                             wavelength=None):
+    """Lookup table integrating diffraction patterns of a given geometry over
+    rings, or over (r, chi) bins.
+
+    The lookup table is a sparse matrix computed once for every geometry and
+    cached, so that integrating a pattern is a single sparse matrix product.
 
-    # Make a regular (in polar space) grid based on the min and max r & theta
-    r_i = np.linspace(r.min(), r.max(), nr, endpoint=False)
-    theta_i = np.linspace(theta.min(), theta.max(), nt, endpoint=False)
-    theta_grid, r_grid = np.meshgrid(theta_i, r_i)
-
-    # Project the r and theta grid back into pixel coordinates
-    X, Y = _polar2cart(r_grid, theta_grid)
-
-    X += origin[0]  # We need to shift the origin
-    Y += origin[1]  # back to the bottom-left corner...
-    xi, yi = X.flatten(), Y.flatten()
-    coords = np.vstack((yi, xi))  # (map_coordinates requires a 2xn array)
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the diffraction patterns.
+    center : tuple
+        The (x, y) pixel coordinates of the center. If None, defaults to the
+        center of the pattern.
+    calibration : float
+        Size of a pixel in reciprocal Angstroms.
+    npt_rad : int
+        Number of radial bins. If None, the bins are one pixel wide.
+    npt_azim : int
+        Number of azimuthal bins over [-pi, pi). If None, the patterns are
+        integrated over the full circle.
+    radial_range : tuple
+        The (lower, upper) bounds of the radial bins, in calibrated units. If
+        None, from zero to the pixel furthest from the center.
+    matrix : np.array
+        3x3 affine transformation correcting the distortion of the patterns,
+        applied to the pixel coordinates relative to the center.
+    mask : np.array of bool
+        Pixels to exclude from the integration, where True.
+    pixel_split : int
+        Every pixel is split into pixel_split x pixel_split sub-pixels, each
+        assigned to its own bin, so that pixels straddling bins are shared
+        between them.
+    wavelength : float
+        Electron wavelength in Angstroms. If given, the intensities are
+        corrected for the solid angle of the pixels on a flat detector.
 
-    zi = ndi.map_coordinates(z, coords)
-    output = zi.reshape((nr, nt))
+    Returns
+    -------
+    integrator : scipy.sparse.csr_matrix
+        Matrix giving the average intensity in every bin of a flattened
+        pattern. Empty bins are zero.
+    output_shape : tuple
+        Shape of the integrated pattern, (npt_rad,) or (npt_azim, npt_rad).
+    radial_range : tuple
+        The (lower, upper) bounds of the radial bins, in calibrated units.
+    """
+    shape = tuple(shape)
+    if center is None:
+        center = (shape[1] / 2 - 0.5, shape[0] / 2 - 0.5)
+    if matrix is None:
+        matrix = np.identity(3)
+    if mask is not None:
+        mask = np.ascontiguousarray(mask, dtype=bool).tobytes()
+    if radial_range is not None:
+        radial_range = tuple(map(float, radial_range))
+    return _azimuthal_integrator(
+        shape, tuple(np.asarray(center, dtype=float)), float(calibration),
+        npt_rad, npt_azim, radial_range,
+        tuple(np.ravel(matrix).astype(float)), mask, int(pixel_split),
+        wavelength)
+
+def azimuthal_integrate(z, **kwargs):
+    """Integrate one or a stack of diffraction patterns over rings, or over
+    (r, chi) bins.
 
-    if jacobian:
-        output = output*r_i[:, np.newaxis]
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    kwargs :
+        Geometry of the patterns, passed to :func:`get_azimuthal_integrator`.
 
-    return output
+    Returns
+    -------
+    integrated : np.array
+        Radial profile, or caked (chi, r) pattern, of every pattern.
+    """
+    integrator, output_shape, radial_range = get_azimuthal_integrator(
+        z.shape[-2:], **kwargs)
+    return apply_interpolation_matrix(z, integrator, output_shape)
 
 def gain_normalise(z, dref, bref):
     """Apply gain normalization to experimentally acquired electron
@@ -225,38 +536,161 @@ def gain_normalise(z, dref, bref):
     """
     return ((z- dref) / (bref - dref)) * np.mean((bref - dref))
 
-def remove_dead(z, deadpixels, deadvalue="average", d=1):
-    """Remove dead pixels from experimental electron diffraction patterns.
+def get_gain_correction(dref, bref):
+    """Precompute the gain and offset maps of a gain normalisation.
+
+    The gain normalisation `((z - dref) / (bref - dref)) * mean(bref - dref)`
+    is rewritten as the multiply-add `z * gain + offset`, so that the
+    references are combined only once for a whole dataset.
+
+    Parameters
+    ----------
+    dref : ElectronDiffraction or np.array
+        Dark reference image.
+    bref : ElectronDiffraction or np.array
+        Flat-field bright reference image.
+
+    Returns
+    -------
+    gain, offset : np.array
+        float32 gain and offset maps.
+    """
+    dref = np.asarray(getattr(dref, 'data', dref), dtype=np.float64)
+    bref = np.asarray(getattr(bref, 'data', bref), dtype=np.float64)
+    difference = bref - dref
+    gain = np.mean(difference) / difference
+    return gain.astype(np.float32), (-dref * gain).astype(np.float32)
+
+def apply_gain_correction(z, gain, offset):
+    """Apply precomputed gain and offset maps to a diffraction pattern.
+
+    Parameters
+    ----------
+    gain, offset : np.array
+        Gain and offset maps, as returned by `get_gain_correction`.
+
+    Returns
+    -------
+        Gain normalized diffraction pattern as float32
+    """
+    corrected = np.multiply(z, gain, dtype=np.float32)
+    corrected += offset
+    return corrected
+
+def get_deadpixel_correction(deadpixels, shape, d=1):
+    """Build the neighbour table used to interpolate dead pixels.
+
+    Every dead pixel is replaced by the average of the valid pixels in the
+    (2d+1)x(2d+1) window around it. Dead pixels never contribute to the
+    average; for pixels inside clusters of dead pixels, the window is grown
+    until it contains valid pixels. The table is built once per detector and
+    stored as a sparse matrix, so that all dead pixels of a stack of frames
+    are corrected in one vectorised gather.
 
     Parameters
     ----------
     deadpixels : array
-        Array containing the array indices of dead pixels in the diffraction
-        pattern.
+        Array containing the array indices (row, column) of dead pixels in the
+        diffraction pattern, or boolean mask of the shape of a pattern which
+        is True for dead pixels.
+    shape : tuple
+        The shape (height, width) of a diffraction pattern.
+    d : int
+        Initial half width of the neighbourhood window.
+
+    Returns
+    -------
+    dead : np.array
+        Flat indices of the dead pixels.
+    weights : scipy.sparse.csr_matrix
+        Matrix of shape (number of dead pixels, height * width) giving every
+        dead pixel as a weighted sum of valid pixels.
+    """
+    if np.shape(deadpixels) == tuple(shape):
+        mask = np.asarray(deadpixels, dtype=bool)
+    else:
+        mask = np.zeros(shape, dtype=bool)
+        deadpixels = np.asarray(deadpixels, dtype=int).reshape(-1, 2)
+        mask[deadpixels[:, 0], deadpixels[:, 1]] = True
+    rows, cols, values = [], [], []
+    for n, (i, j) in enumerate(zip(*np.nonzero(mask))):
+        for r in range(d, max(shape) + 1):
+            window = np.s_[max(i - r, 0):i + r + 1, max(j - r, 0):j + r + 1]
+            y, x = np.nonzero(~mask[window])
+            if len(y):
+                break
+        rows.append(np.full(len(y), n))
+        cols.append((y + window[0].start) * shape[1] + x + window[1].start)
+        values.append(np.full(len(y), 1. / max(len(y), 1)))
+    dead = np.flatnonzero(mask)
+    if len(dead):
+        rows, cols, values = (np.concatenate(rows), np.concatenate(cols),
+                              np.concatenate(values))
+    weights = sparse.csr_matrix((values, (rows, cols)),
+                                shape=(len(dead), mask.size))
+    return dead, weights
+
+def apply_deadpixel_correction(z, correction, deadvalue="average"):
+    """Correct dead pixels using a precomputed neighbour table.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns of shape (..., height,
+        width).
+    correction : tuple
+        The dead pixels and weights, as returned by
+        `get_deadpixel_correction`.
     deadvalue : string
         Specify how deadpixels should be treated, options are;
-            'average': takes the average of adjacent pixels
+            'average': takes the average of adjacent valid pixels
             'nan':  sets the dead pixel to nan
 
     Returns
     -------
     img : array
-        Array containing the diffraction pattern with dead pixels removed.
+        Copy of `z` with the dead pixels corrected.
     """
+    dead, weights = correction
     if deadvalue == 'average':
-        for (i,j) in deadpixels:
-            neighbours = z[i-d:i+d+1, j-d:j+d+1].flatten()
-            z[i,j] = np.mean(neighbours)
-
+        img = np.array(z)
     elif deadvalue == 'nan':
-        for (i,j) in deadpixels:
-            z[i,j] = np.nan
+        img = np.array(z, dtype=np.result_type(z, np.float32))
     else:
         raise NotImplementedError("The method specified is not implemented. "
                                   "See documentation for available "
                                   "implementations.")
+    frames = img.reshape(-1, weights.shape[1])
+    if deadvalue == 'average':
+        frames[:, dead] = (weights @ frames.T).T
+    else:
+        frames[:, dead] = np.nan
+    return frames.reshape(img.shape)
 
-    return z
+def remove_dead(z, deadpixels, deadvalue="average", d=1):
+    """Remove dead pixels from experimental electron diffraction patterns.
+
+    Parameters
+    ----------
+    deadpixels : array
+        Array containing the array indices of dead pixels in the diffraction
+        pattern, or boolean mask of the dead pixels.
+    deadvalue : string
+        Specify how deadpixels should be treated, options are;
+            'average': takes the average of adjacent valid pixels
+            'nan':  sets the dead pixel to nan
+
+    Returns
+    -------
+    img : array
+        Array containing the diffraction pattern with dead pixels removed.
+
+    See also
+    --------
+    get_deadpixel_correction
+    """
+    correction = get_deadpixel_correction(deadpixels, z.shape[-2:], d=d)
+    return apply_deadpixel_correction(z, correction, deadvalue=deadvalue)
 
 def affine_transformation(z,matrix,order,**kwargs):
     """Apply an affine transformation to a 2-dimensional array.
@@ -277,7 +711,6 @@ def affine_transformation(z,matrix,order,**kwargs):
     trans : array
         Affine transformed diffraction pattern.
     """
-    
     # These three lines account for the transformation center not being (0,0)
     shift_y, shift_x = np.array(z.shape[:2]) / 2.
     tf_shift = tf.SimilarityTransform(translation=[-shift_x, -shift_y])
@@ -293,6 +726,341 @@ def affine_transformation(z,matrix,order,**kwargs):
 
     return trans
 
+def _interpolation_kernel(c, order):
+    """Indices and weights of the pixels contributing to an interpolation
+    at coordinates `c` along one axis, as used by skimage.warp."""
+    if order == 0:
+        return np.floor(c + 0.5)[:, None].astype(int), np.ones((c.size, 1))
+    base = np.floor(c)
+    f = c - base
+    if order == 1:
+        return base[:, None].astype(int) + np.arange(2), \
+            np.stack([1 - f, f], axis=-1)
+    # Cubic convolution (Keys, a = -0.5).
+    t = np.abs(f[:, None] - np.arange(-1, 3))
+    w = np.where(t <= 1, (1.5 * t - 2.5) * t**2 + 1,
+                 np.where(t < 2, ((-0.5 * t + 2.5) * t - 4) * t + 2, 0.))
+    return base[:, None].astype(int) - 1 + np.arange(4), w
+
+def get_interpolation_matrix(rows, cols, shape, order=1):
+    """Sparse matrix interpolating an image at arbitrary coordinates.
+
+    Pixels outside the image are taken as zero and coordinates more than one
+    pixel outside the image are set to zero, as for skimage.warp with
+    mode='constant'.
+
+    Parameters
+    ----------
+    rows, cols : np.array
+        Row and column coordinates of the output pixels in the image.
+    shape : tuple
+        Shape of the image.
+    order : int
+        Interpolation order: 0 (nearest), 1 (bilinear) or 3 (bicubic).
+
+    Returns
+    -------
+    weights : scipy.sparse.csr_matrix
+        Matrix of shape (rows.size, shape[0] * shape[1]) such that
+        weights.dot(image.ravel()) is the interpolated image.
+    """
+    if order not in (0, 1, 3):
+        raise ValueError("Interpolation order must be 0, 1 or 3.")
+    h, w = shape
+    rows, cols = np.ravel(rows), np.ravel(cols)
+    ri, rw = _interpolation_kernel(rows, order)
+    ci, cw = _interpolation_kernel(cols, order)
+    rw = np.where((ri >= 0) & (ri < h), rw, 0.)
+    cw = np.where((ci >= 0) & (ci < w), cw, 0.)
+    index = np.clip(ri, 0, h - 1)[:, :, None] * w + \
+        np.clip(ci, 0, w - 1)[:, None, :]
+    weights = rw[:, :, None] * cw[:, None, :]
+    weights[(rows < -1) | (rows >= h) | (cols < -1) | (cols >= w)] = 0.
+    n = index[0].size
+    weights = sparse.csr_matrix(
+        (weights.ravel(), (np.repeat(np.arange(rows.size), n), index.ravel())),
+        shape=(rows.size, h * w))
+    weights.eliminate_zeros()
+    return weights
+
+def get_spline_matrix(rows, cols, shape):
+    """Sparse matrix interpolating an image at arbitrary coordinates with
+    cubic splines.
+
+    The matrix applies to the spline coefficients of the image, see
+    :func:`spline_prefilter`, and gives the same result as
+    ndi.map_coordinates with order=3 and mode='constant'.
+
+    Parameters
+    ----------
+    rows, cols : np.array
+        Row and column coordinates of the output pixels in the image.
+    shape : tuple
+        Shape of the image.
+
+    Returns
+    -------
+    weights : scipy.sparse.csr_matrix
+        Matrix of shape (rows.size, shape[0] * shape[1]).
+    """
+    rows, cols = np.ravel(rows), np.ravel(cols)
+    index, weights = [], []
+    for c, n in zip((rows, cols), shape):
+        base = np.floor(c)
+        f = (c - base)[:, None]
+        kernel = np.hstack([(1 - f)**3, (3 * f - 6) * f**2 + 4,
+                            ((-3 * f + 3) * f + 3) * f + 1, f**3]) / 6
+        # Coefficients beyond the edges are mirrored.
+        i = np.abs(base[:, None].astype(int) - 1 + np.arange(4))
+        if n > 1:
+            i %= 2 * (n - 1)
+            i = np.where(i > n - 1, 2 * (n - 1) - i, i)
+        else:
+            i[:] = 0
+        index.append(i)
+        weights.append(kernel)
+    index = index[0][:, :, None] * shape[1] + index[1][:, None, :]
+    weights = weights[0][:, :, None] * weights[1][:, None, :]
+    weights[(rows < 0) | (rows > shape[0] - 1) |
+            (cols < 0) | (cols > shape[1] - 1)] = 0.
+    weights = sparse.csr_matrix(
+        (weights.ravel(), (np.repeat(np.arange(rows.size), 16),
+                           index.ravel())),
+        shape=(rows.size, shape[0] * shape[1]))
+    weights.eliminate_zeros()
+    return weights
+
+def spline_prefilter(z):
+    """Cubic spline coefficients of one or a stack of images.
+
+    Parameters
+    ----------
+    z : np.array
+        Image, or stack of images in the last two dimensions.
+
+    Returns
+    -------
+    coefficients : np.array
+        Spline coefficients, as float, see :func:`get_spline_matrix`.
+    """
+    coefficients = ndi.spline_filter1d(z, 3, axis=-1, output=np.float64)
+    return ndi.spline_filter1d(coefficients, 3, axis=-2, output=np.float64)
+
+def apply_interpolation_matrix(z, weights, output_shape):
+    """Interpolate one or a stack of images with a precomputed matrix.
+
+    Parameters
+    ----------
+    z : np.array
+        Image, or stack of images in the last two dimensions.
+    weights : scipy.sparse.csr_matrix
+        Interpolation matrix, see :func:`get_interpolation_matrix`.
+    output_shape : tuple
+        Shape of each interpolated image.
+
+    Returns
+    -------
+    interpolated : np.array
+        Interpolated images, as float.
+    """
+    frames = np.reshape(z, (-1, z.shape[-2] * z.shape[-1])).T
+    interpolated = weights.dot(frames).T
+    return interpolated.reshape(z.shape[:-2] + tuple(output_shape))
+
+def _affine_coordinates(matrix, shape):
+    """Coordinates (rows, cols) sampled by every output pixel of the affine
+    transformation about the centre of the pattern."""
+    matrix = np.reshape(matrix, (3, 3))
+    shift_y, shift_x = np.array(shape) / 2.
+    center = np.array([[1., 0., shift_x], [0., 1., shift_y], [0., 0., 1.]])
+    inverse = np.linalg.inv(center.dot(matrix).dot(np.linalg.inv(center)))
+    y, x = np.indices(shape, dtype=float)
+    xyw = np.tensordot(inverse, [x, y, np.ones(shape)], axes=1)
+    return xyw[1] / xyw[2], xyw[0] / xyw[2]
+
+@lru_cache(maxsize=8)
+def _affine_correction(matrix, shape, order):
+    rows, cols = _affine_coordinates(matrix, shape)
+    return get_interpolation_matrix(rows, cols, shape, order)
+
+def get_affine_correction(matrix, shape, order=3):
+    """Interpolation matrix applying the same transformation as
+    :func:`affine_transformation` to images of a given shape.
+
+    The matrix is computed once for every transformation, shape and order
+    and cached, so that it can be applied to any number of patterns.
+
+    Parameters
+    ----------
+    matrix : np.array
+        3x3 numpy array specifying the affine transformation to be applied.
+    shape : tuple
+        Shape of the diffraction patterns.
+    order : int
+        Interpolation order, 0, 1 or 3.
+
+    Returns
+    -------
+    correction : scipy.sparse.csr_matrix
+        Interpolation matrix, see :func:`get_interpolation_matrix`.
+    """
+    return _affine_correction(tuple(np.ravel(matrix).astype(float)),
+                              tuple(shape), order)
+
+def apply_affine_correction(z, correction):
+    """Apply a precomputed affine transformation to one or a stack of
+    diffraction patterns.
+
+    The patterns are converted to float and clipped to the range of each
+    input pattern, except for the zeros filled in outside of it, following
+    skimage.warp with mode='constant' in scikit-image 0.15.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    correction : scipy.sparse.csr_matrix
+        Interpolation matrix from :func:`get_affine_correction`.
+
+    Returns
+    -------
+    trans : np.array
+        Affine transformed diffraction patterns.
+    """
+    z = img_as_float(z)
+    trans = apply_interpolation_matrix(z, correction, z.shape[-2:])
+    axes = (-2, -1)
+    low = np.min(z, axis=axes, keepdims=True)
+    high = np.max(z, axis=axes, keepdims=True)
+    filled = (trans == 0) & ((low > 0) | (high < 0))
+    np.clip(trans, low, high, out=trans)
+    trans[filled] = 0
+    return trans
+
+def _interpolate_bilinear(frames, rows, cols):
+    """Bilinear interpolation of every frame of a stack at its own
+    coordinates, with zeros outside of the frames as in
+    scipy.ndimage.map_coordinates with order=1."""
+    h, w = frames.shape[-2:]
+    r0 = np.floor(rows)
+    c0 = np.floor(cols)
+    fr = rows - r0
+    fc = cols - c0
+    r0 = r0.astype(int)
+    c0 = c0.astype(int)
+    index = np.arange(len(frames))[:, None, None]
+    out = np.zeros(np.broadcast(index, rows, cols).shape)
+    for dr, wr in ((0, 1 - fr), (1, fr)):
+        r = np.clip(r0 + dr, 0, h - 1)
+        for dc, wc in ((0, 1 - fc), (1, fc)):
+            c = np.clip(c0 + dc, 0, w - 1)
+            out += wr * wc * frames[index, r, c]
+    inside = (rows >= 0) & (rows <= h - 1) & (cols >= 0) & (cols <= w - 1)
+    out *= inside
+    return out
+
+def shift_patterns(z, shifts, interpolation='bilinear', matrix=None):
+    """Translate one or a stack of diffraction patterns by subpixel shifts.
+
+    All patterns are shifted at once, rather than one at a time.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    shifts : np.array
+        Shift (row, column) of every pattern, of shape z.shape[:-2] + (2,),
+        or a single shift of shape (2,) applied to all patterns.
+    interpolation : str
+        'bilinear' (default) gives the same result as
+        scipy.ndimage.shift with order=1 and zeros filled in. 'fourier'
+        multiplies the Fourier transform of the patterns with a phase ramp,
+        which is exact for band limited patterns but wraps intensity around
+        the edges.
+    matrix : np.array or None
+        3x3 affine transformation, as in :func:`affine_transformation`,
+        applied about the centre of the shifted patterns. Both are combined
+        into a single bilinear interpolation, so that the patterns are
+        resampled only once. Unlike :func:`affine_transformation`, integer
+        patterns are not rescaled.
+
+    Returns
+    -------
+    shifted : np.array
+        Shifted diffraction patterns, as float.
+    """
+    z = np.asarray(z)
+    shape = z.shape[-2:]
+    frames = z.reshape((-1,) + shape)
+    shifts = np.broadcast_to(shifts, z.shape[:-2] + (2,)).reshape(-1, 2)
+    shift_y = shifts[:, :1, None]
+    shift_x = shifts[:, 1:, None]
+    if interpolation == 'fourier':
+        if matrix is not None:
+            raise ValueError("An affine transformation can only be combined "
+                             "with bilinear interpolation.")
+        ky = np.fft.fftfreq(shape[0])[:, None]
+        kx = np.fft.rfftfreq(shape[1])
+        ramp = np.exp(-2j * np.pi * (ky * shift_y + kx * shift_x))
+        shifted = np.fft.irfft2(np.fft.rfft2(frames) * ramp, s=shape)
+    elif interpolation == 'bilinear':
+        if matrix is None:
+            rows, cols = np.indices(shape, dtype=float)
+        else:
+            rows, cols = _affine_coordinates(matrix, shape)
+        shifted = _interpolate_bilinear(frames, rows - shift_y,
+                                        cols - shift_x)
+    else:
+        raise ValueError("interpolation must be 'bilinear' or 'fourier', "
+                         "not '{}'.".format(interpolation))
+    return shifted.reshape(z.shape)
+
+def diffraction_moments(z):
+    """Count, mean and sum of squared deviations from the mean of every
+    pixel over a stack of diffraction patterns.
+
+    Moments of separate stacks are combined with :func:`merge_moments`, so
+    that the statistics of a dataset are computed in a single pass through
+    it.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+
+    Returns
+    -------
+    moments : tuple
+        The number of patterns, the mean pattern and the sum of squared
+        deviations from it, as float.
+    """
+    frames = np.asarray(z, dtype=float).reshape((-1,) + z.shape[-2:])
+    mean = frames.mean(axis=0)
+    return len(frames), mean, np.square(frames - mean).sum(axis=0)
+
+def merge_moments(a, b):
+    """Combine the moments of two stacks of diffraction patterns, as returned
+    by :func:`diffraction_moments`, with the numerically stable update of
+    Chan et al.
+
+    Parameters
+    ----------
+    a, b : tuple
+        Count, mean and sum of squared deviations of each stack.
+
+    Returns
+    -------
+    moments : tuple
+        Count, mean and sum of squared deviations of both stacks together.
+    """
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / count)
+    m2 = m2_a + m2_b + np.square(delta) * (count_a * count_b / count)
+    return count, mean, m2
+
 def regional_filter(z, h):
     """Perform a h-dome regional filtering of the an image for background
     subtraction.
@@ -405,6 +1173,53 @@ def circular_mask(shape, radius, center=None):
     return mask
 
 
+def find_vacuum(z, radius, threshold, early_stop=True):
+    """Find diffraction patterns without any intensity above a threshold
+    outside of the direct beam.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    radius : float
+        Radius of the circular mask excluding the direct beam at the centre
+        of the patterns.
+    threshold : float
+        Minimum intensity required to consider a diffracted beam to be
+        present.
+    early_stop : bool
+        If True (default), the pixels are checked in groups, from the
+        direct beam outwards, and patterns are dropped as soon as a
+        diffracted beam is found, rather than finding the maximum of every
+        pattern.
+
+    Returns
+    -------
+    vacuum : np.array
+        Boolean array of shape z.shape[:-2], True for patterns in vacuum.
+    """
+    shape = z.shape[-2:]
+    frames = z.reshape((-1, shape[0] * shape[1]))
+    center = ((shape[0] - 1) / 2, (shape[1] - 1) / 2)
+    beam = circular_mask(shape, radius, center=center).ravel()
+    y, x = np.indices(shape)
+    distance = np.hypot(y - center[0], x - center[1]).ravel()
+    pixels = np.flatnonzero(~beam)
+    if not early_stop:
+        exceeded = (frames[:, pixels] > threshold).any(axis=1)
+        return ~exceeded.reshape(z.shape[:-2])
+    pixels = pixels[np.argsort(distance[pixels], kind='stable')]
+    exceeded = np.zeros(len(frames), dtype=bool)
+    pending = np.arange(len(frames))
+    for group in np.array_split(pixels, min(16, max(1, len(pixels)))):
+        exceeded[pending] = (frames[pending[:, None], group] >
+                             threshold).any(axis=1)
+        pending = pending[~exceeded[pending]]
+        if not len(pending):
+            break
+    return ~exceeded.reshape(z.shape[:-2])
+
+
 def reference_circle(coords, dimX, dimY,radius):
     """Draw the perimeter of an circle at a given position
     in the diffraction pattern (e.g. to provide a reference for
@@ -437,6 +1252,71 @@ def reference_circle(coords, dimX, dimY,radius):
         
     return img
 
+@lru_cache(maxsize=4)
+def _beam_references(shape, radius_start, radius_finish):
+    """Window and windowed reference circle FFTs for every radius."""
+    window = np.sqrt(np.outer(np.hanning(shape[0]), np.hanning(shape[1])))
+    origin = np.array([[round(shape[0]/2), round(shape[1]/2)]])
+    references = np.fft.fft2([window * reference_circle(origin, shape[0],
+                                                        shape[1], radius)
+                              for radius in range(radius_start,
+                                                  radius_finish)])
+    power = np.sum(np.abs(references)**2, axis=(-2, -1))
+    return window, references, power
+
+def _upsampled_dft(data, region_size, upsample_factor, offsets):
+    """Upsampled DFT of a stack of arrays in a region about a per-array
+    offset, by matrix multiplication as in skimage.feature."""
+    kernels = [np.exp(-2j * np.pi *
+                      (np.arange(region_size) - offsets[:, i:i + 1])[..., None]
+                      * np.fft.fftfreq(n, upsample_factor))
+               for i, n in enumerate(data.shape[-2:])]
+    return kernels[0] @ data @ kernels[1].transpose(0, 2, 1)
+
+def _refine_registration(products, shifts, upsample_factor):
+    """Refine the shifts registering a stack of cross-power spectra, as
+    register_translation does, and return them with the correlation peaks."""
+    region_size = int(np.ceil(upsample_factor * 1.5))
+    dftshift = np.fix(region_size / 2.0)
+    shifts = np.round(shifts * upsample_factor) / upsample_factor
+    cross_correlation = _upsampled_dft(
+        products.conj(), region_size, upsample_factor,
+        dftshift - shifts * upsample_factor).conj()
+    cross_correlation = cross_correlation.reshape(len(products), -1)
+    peaks = np.argmax(np.abs(cross_correlation), axis=-1)
+    maxima = np.stack(np.unravel_index(peaks, (region_size, region_size)),
+                      axis=-1)
+    return shifts + (maxima - dftshift) / upsample_factor, \
+        cross_correlation[np.arange(len(products)), peaks]
+
+def _find_beam_offsets(frames, radius_start, radius_finish):
+    shape = frames.shape[-2:]
+    window, references, reference_power = _beam_references(
+        shape, radius_start, radius_finish)
+    frames = np.fft.fft2(window * frames)
+    frame_power = np.sum(np.abs(frames)**2, axis=(-2, -1))
+    # Cross-power spectra of every reference with every frame.
+    products = references[:, None] * frames.conj()
+    cross_correlation = np.abs(np.fft.ifft2(products))
+    peaks = np.argmax(cross_correlation.reshape(products.shape[:2] + (-1,)),
+                      axis=-1)
+    shifts = np.stack(np.unravel_index(peaks, shape), axis=-1).astype(float)
+    shape = np.array(shape)
+    shifts = np.where(shifts > np.fix(shape / 2), shifts - shape, shifts)
+
+    # Keep the radius registering best at an upsampling of 10...
+    errors = np.empty(products.shape[:2])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(len(products)):
+            peak = _refine_registration(products[i], shifts[i], 10)[1]
+            errors[i] = 1 - np.abs(peak)**2 / (reference_power[i] *
+                                               frame_power)
+    best = np.argmin(errors, axis=0)
+    # ...and register to it at an upsampling of 100.
+    index = np.arange(len(best))
+    return _refine_registration(products[best, index],
+                                shifts[best, index], 100)[0]
+
 def find_beam_offset_cross_correlation(z, radius_start=4, radius_finish=8):
     """Method to centre the direct beam centre by a cross-correlation algorithm.
     The shift is calculated relative to an circle perimeter. The circle can be
@@ -444,8 +1324,14 @@ def find_beam_offset_cross_correlation(z, radius_start=4, radius_finish=8):
     performance in regions where the direct beam size changes,
     e.g. during sample thickness variation.
 
+    The windowed reference circles and their Fourier transforms are computed
+    once for every shape and range of radii, and stacks of patterns are
+    registered with FFTs along the stack.
+
     Parameters
     ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
     radius_start : int
         The lower bound for the radius of the central disc to be used in the alignment
         
@@ -455,29 +1341,218 @@ def find_beam_offset_cross_correlation(z, radius_start=4, radius_finish=8):
     Returns
     -------
     shift: np.array
-        np.array containing offset (from center) of the direct beam positon.
+        np.array containing offset (from center) of the direct beam positon,
+        with shape z.shape[:-2] + (2,) for a stack of patterns.
     """
-    radiusList = np.arange(radius_start,radius_finish)
-    errRecord = np.zeros_like(radiusList,dtype='single')
-    origin = np.array([[round(np.size(z,axis=-2)/2),round(np.size(z,axis=-1)/2)]])
-    
-    for ind in np.arange(0,np.size(radiusList)):
-        radius = radiusList[ind]
-        ref = reference_circle(origin,np.size(z,axis=-2),np.size(z,axis=-1),radius)
-        h0= np.hanning(np.size(ref,0))
-        h1= np.hanning(np.size(ref,1))
-        hann2d = np.sqrt(np.outer(h0,h1))
-        ref= hann2d*ref
-        im = hann2d*z
-        shift, error, diffphase = register_translation(ref,im, 10)
-        errRecord[ind] = error
-        index_min = np.argmin(errRecord)
-        
-        ref = reference_circle(origin,np.size(z,axis=-2),np.size(z,axis=-1),radiusList[index_min])
-        ref= hann2d*ref
-        shift, error, diffphase = register_translation(ref,im, 100)
-        
-    return shift
+    shape = z.shape[-2:]
+    frames = np.reshape(z, (-1,) + shape)
+    shifts = np.empty((len(frames), 2))
+    # Bound the memory taken by the cross-power spectra of every radius.
+    step = max(1, 2**27 // (16 * max(1, radius_finish - radius_start) *
+                            shape[0] * shape[1]))
+    for start in range(0, len(frames), step):
+        shifts[start:start + step] = _find_beam_offsets(
+            frames[start:start + step], radius_start, radius_finish)
+    return shifts.reshape(z.shape[:-2] + (2,))
+
+def _center_of_mass(frames):
+    """Centre of mass (row, column) of a stack of frames, or nan for empty
+    frames."""
+    total = frames.sum(axis=(-2, -1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        row = frames.sum(axis=-1).dot(np.arange(frames.shape[-2])) / total
+        col = frames.sum(axis=-2).dot(np.arange(frames.shape[-1])) / total
+    return np.stack([row, col], axis=-1)
+
+def _threshold_disc(frames, threshold):
+    """Positive pixels above a fraction of the maximum of every frame."""
+    maximum = frames.max(axis=(-2, -1), keepdims=True)
+    return ((frames >= threshold * maximum) & (frames > 0)).astype(float)
+
+def _beam_offsets(z, centers):
+    """Offsets of beam centres from the origin of the reference circles of
+    :func:`find_beam_offset_cross_correlation`, zero where undefined."""
+    shape = z.shape[-2:]
+    offsets = np.array([round(shape[0]/2), round(shape[1]/2)]) - centers
+    return np.nan_to_num(offsets).reshape(z.shape[:-2] + (2,))
+
+def find_beam_offset_center_of_mass(z, radius=None):
+    """Find the offset of the direct beam from the centre of mass of the
+    diffraction pattern.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    radius : float
+        If given, only the disc of this radius about the centre of the
+        pattern is taken into account.
+
+    Returns
+    -------
+    shift: np.array
+        Offset (from center) of the direct beam position, in the same
+        convention as :func:`find_beam_offset_cross_correlation`.
+    """
+    frames = np.reshape(z, (-1,) + z.shape[-2:])
+    if radius is not None:
+        shape = z.shape[-2:]
+        frames = frames * circular_mask(
+            shape, radius, (round(shape[0]/2), round(shape[1]/2)))
+    return _beam_offsets(z, _center_of_mass(frames))
+
+def find_beam_offset_threshold(z, threshold=0.5):
+    """Find the offset of the direct beam from the centroid of the pixels
+    brighter than a fraction of the maximum of the diffraction pattern.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    threshold : float
+        Fraction of the maximum of every pattern above which pixels belong to
+        the direct beam.
+
+    Returns
+    -------
+    shift: np.array
+        Offset (from center) of the direct beam position, in the same
+        convention as :func:`find_beam_offset_cross_correlation`.
+    """
+    frames = np.reshape(z, (-1,) + z.shape[-2:])
+    return _beam_offsets(z, _center_of_mass(_threshold_disc(frames,
+                                                            threshold)))
+
+def find_beam_offset_hybrid(z, threshold=0.5, radius=8):
+    """Find the offset of the direct beam from the centre of mass of the
+    disc about a first estimate of its position.
+
+    The first estimate is the centroid of the thresholded pattern, see
+    :func:`find_beam_offset_threshold`, which is then refined by the centre
+    of mass of the intensities within `radius` of it.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    threshold : float
+        Fraction of the maximum of every pattern above which pixels belong to
+        the direct beam, for the first estimate.
+    radius : float
+        Radius of the disc about the first estimate used for the centre of
+        mass.
+
+    Returns
+    -------
+    shift: np.array
+        Offset (from center) of the direct beam position, in the same
+        convention as :func:`find_beam_offset_cross_correlation`.
+    """
+    frames = np.reshape(z, (-1,) + z.shape[-2:])
+    coarse = _center_of_mass(_threshold_disc(frames, threshold))
+    y, x = np.ogrid[:z.shape[-2], :z.shape[-1]]
+    mask = (y - coarse[:, :1, None])**2 + (x - coarse[:, 1:, None])**2 < \
+        radius**2
+    return _beam_offsets(z, _center_of_mass(frames * mask))
+
+def _polynomial_terms(coordinates, degree):
+    """Monomials of total degree up to `degree` of coordinates (n, d)."""
+    exponents = [e for e in product(range(degree + 1),
+                                    repeat=coordinates.shape[1])
+                 if sum(e) <= degree]
+    return np.stack([np.prod(coordinates ** np.array(e), axis=1)
+                     for e in exponents], axis=1)
+
+def fit_shift_surface(positions, shifts, shape, degree=2):
+    """Fit a polynomial surface over the navigation grid to beam shifts
+    measured at some of the probe positions.
+
+    Parameters
+    ----------
+    positions : np.array
+        Navigation indices of the measured probe positions, of shape (n, d).
+    shifts : np.array
+        Shifts measured at the positions, of shape (n, 2).
+    shape : tuple
+        Navigation shape (in array order) of the d-dimensional grid over
+        which the surface is evaluated.
+    degree : int
+        Total degree of the polynomial in the navigation indices, e.g. 1
+        for a linear descan. Defaults to 2.
+
+    Returns
+    -------
+    surface : np.array
+        Modelled shifts at every probe position, of shape shape + (2,).
+    """
+    scale = np.maximum(np.array(shape, dtype=float) - 1, 1)
+    terms = _polynomial_terms(np.asarray(positions) / scale, degree)
+    coefficients = np.linalg.lstsq(terms, shifts, rcond=None)[0]
+    grid = np.indices(shape).reshape(len(shape), -1).T
+    surface = _polynomial_terms(grid / scale, degree).dot(coefficients)
+    return surface.reshape(tuple(shape) + (2,))
+
+def compact_navigation(data, navigation_mask, nav_dim):
+    """Select the diffraction patterns at the navigation positions which are
+    not masked, along a single navigation axis.
+
+    Parameters
+    ----------
+    data : np.array or dask.array.Array
+        Diffraction patterns, with nav_dim navigation dimensions first.
+    navigation_mask : np.array or BaseSignal
+        Boolean mask with the navigation shape (in array order), True for
+        positions to skip, e.g. vacuum from
+        :meth:`ElectronDiffraction.get_vacuum_mask`.
+    nav_dim : int
+        Number of navigation dimensions.
+
+    Returns
+    -------
+    frames : np.array or dask.array.Array
+        The selected patterns, of shape (n,) + data.shape[nav_dim:].
+    keep : np.array
+        Boolean array of the navigation shape, True for the selected
+        positions, to be passed to :func:`scatter_navigation`.
+    """
+    navigation_mask = getattr(navigation_mask, 'data', navigation_mask)
+    keep = ~np.asarray(navigation_mask, dtype=bool).reshape(
+        data.shape[:nav_dim])
+    frames = data.reshape((-1,) + data.shape[nav_dim:])
+    return frames[np.flatnonzero(keep)], keep
+
+def scatter_navigation(values, keep, fill_value=0):
+    """Place results computed for the patterns selected by
+    :func:`compact_navigation` back on the navigation grid.
+
+    Parameters
+    ----------
+    values : np.array
+        Results for the selected patterns, along the first axis.
+    keep : np.array
+        Boolean array of the navigation shape, True for the selected
+        positions.
+    fill_value : scalar or object
+        Value of the results at the masked positions. For object arrays, e.g.
+        of peak positions, it is set as a whole at every masked position.
+
+    Returns
+    -------
+    scattered : np.array
+        Results of shape keep.shape + values.shape[1:].
+    """
+    values = np.asarray(values)
+    if values.dtype == object:
+        scattered = np.empty(keep.shape, dtype=object)
+        for index in zip(*np.nonzero(~keep)):
+            scattered[index] = fill_value
+        for index, value in zip(zip(*np.nonzero(keep)), values):
+            scattered[index] = value
+        return scattered
+    scattered = np.full(keep.shape + values.shape[1:], fill_value,
+                        dtype=np.result_type(values, fill_value))
+    scattered[keep] = values
+    return scattered
 
 def peaks_as_gvectors(z, center, calibration):
     g = (z - center) * calibration
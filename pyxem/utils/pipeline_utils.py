@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2018 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+"""Pipeline applying several preprocessing steps in a single pass.
+
+"""
+
+import numpy as np
+
+from pyxem.utils.expt_utils import (get_gain_correction,
+                                    apply_gain_correction,
+                                    get_deadpixel_correction,
+                                    apply_deadpixel_correction,
+                                    affine_transformation,
+                                    get_affine_correction,
+                                    apply_affine_correction,
+                                    find_beam_offset_cross_correlation,
+                                    shift_patterns,
+                                    subtract_background_dog,
+                                    subtract_background_median,
+                                    subtract_reference)
+
+
+def center_beam(z, radius_start, radius_finish):
+    """Translate the direct beam of one or a stack of diffraction patterns
+    to the centre.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    radius_start : int
+        The lower bound for the radius of the central disc to be used in the
+        alignment
+    radius_finish : int
+        The upper bounds for the radius of the central disc to be used in the
+        alignment
+
+    Returns
+    -------
+    centered : np.array
+        The centered diffraction patterns, with zeros filled in.
+    """
+    offsets = find_beam_offset_cross_correlation(z, radius_start,
+                                                 radius_finish)
+    return shift_patterns(z, offsets)
+
+
+def _remove_dead_cached(z, deadpixels, deadvalue, cache):
+    """Correct dead pixels, building the neighbour table only once."""
+    shape = z.shape[-2:]
+    if shape not in cache:
+        cache[shape] = get_deadpixel_correction(deadpixels, shape)
+    return apply_deadpixel_correction(z, cache[shape], deadvalue)
+
+
+def _affine_cached(z, matrix, order):
+    """Apply an affine transformation with its cached interpolation
+    matrix."""
+    return apply_affine_correction(
+        z, get_affine_correction(matrix, z.shape[-2:], order))
+
+
+def _reference_data(reference):
+    """Return the data of a reference image given as signal or array."""
+    return np.asarray(getattr(reference, 'data', reference))
+
+
+class PreprocessingPipeline():
+    """Compose preprocessing steps into a single pass through the data.
+
+    Every step is added with the method of the same name as in
+    :obj:`ElectronDiffraction` and the steps are run in the order in which
+    they were added. :meth:`apply` then reads every block of diffraction
+    patterns, or chunk of lazy signals, once, applies all steps to the whole
+    block and writes the result once, instead of one full pass (and, without
+    `inplace`, one full copy) per step.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        pipeline = PreprocessingPipeline()
+        pipeline.apply_gain_normalisation(dark, bright)
+        pipeline.remove_deadpixels(deadpixels)
+        pipeline.apply_affine_transformation(D)
+        pipeline.center_direct_beam(3, 8)
+        pipeline.remove_background('median', footprint=19)
+        processed = pipeline.apply(dp)
+
+    """
+    def __init__(self):
+        self.steps = []
+
+    def __repr__(self):
+        names = [function.__name__ for function, stack, kwargs in self.steps]
+        return '<PreprocessingPipeline, steps: %s>' % ', '.join(names)
+
+    def add_step(self, function, stack=False, **kwargs):
+        """Add a function of a diffraction pattern as a step.
+
+        Parameters
+        ----------
+        function : callable
+            Function taking a diffraction pattern as first argument and
+            returning the processed pattern.
+        stack : bool
+            If True, `function` takes and returns a stack of patterns in the
+            last two dimensions and is applied to whole blocks at once.
+            Otherwise (default), it is applied to every pattern in turn.
+        kwargs :
+            Keyword arguments passed to `function`.
+
+        Returns
+        -------
+        pipeline : PreprocessingPipeline
+            This pipeline, so that calls can be chained.
+        """
+        self.steps.append((function, stack, kwargs))
+        return self
+
+    def apply_gain_normalisation(self, dark_reference, bright_reference):
+        """Add a gain normalisation step, see
+        :meth:`ElectronDiffraction.apply_gain_normalisation`."""
+        gain, offset = get_gain_correction(dark_reference, bright_reference)
+        return self.add_step(apply_gain_correction, stack=True, gain=gain,
+                             offset=offset)
+
+    def remove_deadpixels(self, deadpixels, deadvalue='average'):
+        """Add a dead pixel removal step, see
+        :meth:`ElectronDiffraction.remove_deadpixels`."""
+        return self.add_step(_remove_dead_cached, stack=True,
+                             deadpixels=deadpixels, deadvalue=deadvalue,
+                             cache={})
+
+    def apply_affine_transformation(self, D, order=3, **kwargs):
+        """Add an affine transformation step, see
+        :meth:`ElectronDiffraction.apply_affine_transformation`."""
+        if not kwargs and order in (0, 1, 3):
+            return self.add_step(_affine_cached, stack=True, matrix=D,
+                                 order=order)
+        return self.add_step(affine_transformation, matrix=D, order=order,
+                             **kwargs)
+
+    def center_direct_beam(self, radius_start, radius_finish):
+        """Add a step translating the direct beam to the centre, see
+        :meth:`ElectronDiffraction.center_direct_beam`."""
+        return self.add_step(center_beam, stack=True,
+                             radius_start=radius_start,
+                             radius_finish=radius_finish)
+
+    def remove_background(self, method, **kwargs):
+        """Add a background subtraction step, see
+        :meth:`ElectronDiffraction.remove_background`.
+
+        Only the methods working on every pattern independently,
+        'gaussian_difference', 'median' and 'reference_pattern', are
+        supported.
+        """
+        if method == 'gaussian_difference':
+            return self.add_step(subtract_background_dog, **kwargs)
+        elif method == 'median':
+            return self.add_step(subtract_background_median, **kwargs)
+        elif method == 'reference_pattern':
+            return self.add_step(subtract_reference,
+                                 bg=_reference_data(kwargs['bg']))
+        raise NotImplementedError(
+            "The method specified, '{}', can not be used in a pipeline. See "
+            "documentation for available implementations.".format(method))
+
+    def process(self, z):
+        """Apply all steps to one or a stack of diffraction patterns.
+
+        Parameters
+        ----------
+        z : np.array
+            Diffraction pattern, or stack of patterns in the last two
+            dimensions.
+
+        Returns
+        -------
+        processed : np.array
+            The processed diffraction patterns, as float.
+        """
+        # Work on a single float copy, which the steps may modify in place.
+        z = np.array(z, dtype=float)
+        frames = z.reshape((-1,) + z.shape[-2:])
+        for function, stack, kwargs in self.steps:
+            if stack:
+                frames = function(frames, **kwargs)
+            else:
+                frames = np.stack([function(frame, **kwargs)
+                                   for frame in frames])
+        return np.asarray(frames, dtype=float).reshape(z.shape)
+
+    def apply(self, signal, inplace=False):
+        """Apply all steps to every diffraction pattern of a signal in a
+        single pass.
+
+        Parameters
+        ----------
+        signal : ElectronDiffraction
+            The diffraction patterns to process.
+        inplace : bool
+            If True, the signal is overwritten. Otherwise (default), returns
+            a new signal.
+
+        Returns
+        -------
+        processed : ElectronDiffraction
+            The processed signal, if `inplace` is False.
+        """
+        return signal._map_blocks(self.process, inplace=inplace)
@@ -25,5 +25,87 @@ from skimage.morphology import watershed
 from skimage.feature import peak_local_max
 from skimage.feature import match_template
 
+from hyperspy.signals import Signal2D
+
 def normalize_vdf(im):
     return im / im.max()
+
+
+def roi_to_mask(roi, signal_axes):
+    """Find the pixels of a diffraction pattern inside an ROI.
+
+    Parameters
+    ----------
+    roi : :obj:`hyperspy.roi.BaseInteractiveROI`
+        Any interactive ROI detailed in HyperSpy.
+    signal_axes : list of dict
+        The two signal axes of the diffraction patterns, as dictionaries in
+        array order (see `AxesManager._get_axes_dicts`).
+
+    Returns
+    -------
+    mask : np.array
+        Boolean array of the shape of a diffraction pattern, True inside the
+        ROI.
+    """
+    shape = tuple(axis['size'] for axis in signal_axes)
+    axes = [dict(axis, navigate=False) for axis in signal_axes]
+    pixels = Signal2D(np.arange(np.prod(shape), dtype=float).reshape(shape),
+                      axes=axes)
+    inside = roi(pixels, axes=pixels.axes_manager.signal_axes).data
+    # Depending on the ROI, pixels outside it are either masked or NaN.
+    outside = np.ma.getmaskarray(inside) | np.isnan(np.ma.getdata(inside))
+    inside = np.ma.getdata(inside)[~outside].astype(int)
+    mask = np.zeros(np.prod(shape), dtype=bool)
+    mask[inside] = True
+    return mask.reshape(shape)
+
+
+def detector_matrix(detectors, signal_axes):
+    """Stack virtual detectors into a matrix.
+
+    Parameters
+    ----------
+    detectors : list
+        Virtual detectors, each either a :obj:`hyperspy.roi.BaseInteractiveROI`
+        or a boolean or float array with the shape of a diffraction pattern.
+    signal_axes : list of dict
+        The two signal axes of the diffraction patterns, as dictionaries in
+        array order.
+
+    Returns
+    -------
+    matrix : np.array
+        Array of shape (height * width, len(detectors)) whose columns are the
+        flattened detector weights.
+    """
+    shape = tuple(axis['size'] for axis in signal_axes)
+    matrix = np.empty((np.prod(shape), len(detectors)))
+    for i, detector in enumerate(detectors):
+        if not isinstance(detector, np.ndarray):
+            detector = roi_to_mask(detector, signal_axes)
+        if detector.shape != shape:
+            raise ValueError('Detector %d has shape %s, but the diffraction '
+                             'patterns have shape %s.' % (i, detector.shape,
+                                                          shape))
+        matrix[:, i] = detector.ravel()
+    return matrix
+
+
+def apply_detector_matrix(z, matrix):
+    """Virtual images of a stack of diffraction patterns.
+
+    Parameters
+    ----------
+    z : np.array
+        Diffraction pattern, or stack of patterns in the last two dimensions.
+    matrix : np.array
+        Detector matrix, as returned by `detector_matrix`.
+
+    Returns
+    -------
+    intensities : np.array
+        Array of shape z.shape[:-2] + (matrix.shape[1],), the intensity of
+        every pattern in every detector.
+    """
+    return np.dot(z.reshape(z.shape[:-2] + (-1,)).astype(matrix.dtype), matrix)
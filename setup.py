@@ -27,11 +27,13 @@ import numpy as np
 
 if sys.platform == "win32":
     extensions = [
-        Extension('pyxem.utils.radialprofile', ['src/radialprofile.pyx'], include_dirs=[np.get_include()])
+        Extension('pyxem.utils.radialprofile', ['src/radialprofile.pyx'], include_dirs=[np.get_include()],
+                  extra_compile_args=['/openmp'])
     ]
 else:
     extensions = [
-        Extension('pyxem.utils.radialprofile', ['src/radialprofile.pyx'], include_dirs=[np.get_include()])
+        Extension('pyxem.utils.radialprofile', ['src/radialprofile.pyx'], include_dirs=[np.get_include()],
+                  extra_compile_args=['-fopenmp'], extra_link_args=['-fopenmp'])
     ]
 ext_modules = cythonize(extensions)
 
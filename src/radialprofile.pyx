@@ -2,55 +2,43 @@ import numpy as np
 cimport numpy as np
 cimport cython
 from cython.parallel import prange
-from libc.math cimport sqrt, ceil
 
-# cython implementation from:
-# http://stackoverflow.com/q/21242011
-
-DTYPE_IMG = np.int
-ctypedef np.int_t DTYPE_IMG_t
-DTYPE = np.int
-ctypedef np.int_t DTYPE_t
-
-
-@cython.boundscheck(False)
-@cython.wraparound(False)
-@cython.nonecheck(False)
-cdef void cython_radial_profile(DTYPE_IMG_t [:, :] img_view, DTYPE_t [:] r_profile_view, int xs, int ys, int x0, int y0) nogil:
-
-    cdef int x, y, r, tmp
-
-    for x in prange(xs):
-        for y in range(ys):
-            r =<int>(sqrt((x - x0)**2 + (y - y0)**2))
-            tmp = img_view[x, y]
-            r_profile_view[r] +=  tmp 
+# Image types accepted without conversion.
+ctypedef fused DTYPE_IMG_t:
+    np.uint8_t
+    np.uint16_t
+    np.uint32_t
+    np.int32_t
+    np.int64_t
+    np.float32_t
+    np.float64_t
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-def radialprofile(np.ndarray img, np.ndarray center):
-
-
-    cdef int xs, ys, r_max
-    xs, ys = img.shape[0], img.shape[1]
-    cdef int centerX, centerY
-    centerX, centerY = center[0], center[1]
-
-    cdef int topLeft, topRight, botLeft, botRight
-
-    topLeft = <int> ceil(sqrt(centerX**2 + centerY**2))
-    topRight = <int> ceil(sqrt((xs - centerX)**2 + (centerY)**2))
-    botLeft = <int> ceil(sqrt(centerX**2 + (ys-centerY)**2))
-    botRight = <int> ceil(sqrt((xs-centerX)**2 + (ys-centerY)**2))
-
-    r_max = max(topLeft, topRight, botLeft, botRight)
-
-    cdef np.ndarray[DTYPE_t, ndim=1] r_profile = np.zeros([r_max], dtype=DTYPE)
-    cdef DTYPE_t [:] r_profile_view = r_profile
-    cdef DTYPE_IMG_t [:, :] img_view = img
+def radialprofile(const DTYPE_IMG_t [:, ::1] frames, const np.int32_t [::1] indptr,
+                  const np.int32_t [::1] indices, const double [::1] weights):
+    """Radial profiles of a stack of flattened diffraction patterns.
+
+    The bins are given as a sparse matrix in CSR format, see
+    pyxem.utils.expt_utils.get_radial_correction. Every pattern is
+    processed by a single thread, so that profiles are never accumulated
+    concurrently.
+    """
+    cdef Py_ssize_t n = frames.shape[0]
+    cdef Py_ssize_t nbins = indptr.shape[0] - 1
+    cdef Py_ssize_t i, b, k
+    cdef double total
+
+    profiles = np.zeros((n, nbins))
+    cdef double [:, ::1] profiles_view = profiles
 
     with nogil:
-        cython_radial_profile(img_view, r_profile_view, xs, ys, centerX, centerY)
-    return r_profile
\ No newline at end of file
+        for i in prange(n, schedule='static'):
+            for b in range(nbins):
+                total = 0
+                for k in range(indptr[b], indptr[b + 1]):
+                    total = total + weights[k] * frames[i, indices[k]]
+                profiles_view[i, b] = total
+    return profiles
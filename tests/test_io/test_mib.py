@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import numpy as np
+import pytest
+import dask.array as da
+import hyperspy.api as hs
+
+import pyxem as pxm
+from pyxem.io_plugins import mib
+from pyxem.utils.expt_utils import gain_normalise, get_gain_correction
+
+HDR = ("HDR,\t\n"
+       "Time and Date Stamp (day, mnth, yr, hr, min, s):\t14/05/2018 16:21:03\n"
+       "Assembly Size (NX1, 2X2):\t1x1\n"
+       "Counter Depth (number):\t12\n"
+       "Frames in Acquisition (Number):\t{frames}\n"
+       "End\t\n")
+
+
+def write_mib(folder, data):
+    """Write a (frames, 256, 256) array as an hdr/mib pair."""
+    hdr_filename = os.path.join(str(folder), 'test.hdr')
+    with open(hdr_filename, 'w') as f:
+        f.write(HDR.format(frames=len(data)))
+    with open(os.path.join(str(folder), 'test.mib'), 'wb') as f:
+        for i, frame in enumerate(data):
+            # 1 ms frames with a 10 ms flyback every 4 frames.
+            t = 0.001 * i + 0.01 * (i // 4)
+            header = ('MQ1,{:06d},00384,01,0256,0256,U16,   1x1,01,'
+                      '2018-05-14 16:21:{:09.6f},0.001000,0,0,0'
+                      ).format(i + 1, t)
+            f.write(header.ljust(384, ' ').encode('ascii'))
+            f.write(frame.astype('>u2').tobytes())
+    return hdr_filename
+
+
+def pack_raw(frames, counter_depth):
+    """Pack frames in the raw (R64) format of the given counter depth."""
+    n = len(frames)
+    if counter_depth == 1:
+        bits = frames.reshape(n, -1, 64)[:, :, ::-1].astype(np.uint8)
+        return np.packbits(bits.reshape(n, -1), axis=-1)
+    dtype = '>u1' if counter_depth == 6 else '>u2'
+    words = frames.reshape(n, -1, 8 // np.dtype(dtype).itemsize)[:, :, ::-1]
+    return np.ascontiguousarray(words).astype(dtype).view(np.uint8)
+
+
+def write_raw_mib(folder, data, counter_depth):
+    """Write a (frames, 256, 256) array as a raw format hdr/mib pair."""
+    hdr_filename = os.path.join(str(folder), 'test.hdr')
+    with open(hdr_filename, 'w') as f:
+        f.write(HDR.format(frames=len(data)).replace(
+            '\t12\n', '\t{}\n'.format(counter_depth)))
+    header = ('MQ1,{:06d},00384,01,0256,0256,R64,   1x1,01,'
+              '2018-05-14 16:21:03.000000,0.001000,0,0,0')
+    with open(os.path.join(str(folder), 'test.mib'), 'wb') as f:
+        for i, frame in enumerate(data):
+            if counter_depth == 24:
+                parts = [frame & 0xfff, frame >> 12]
+            else:
+                parts = [frame]
+            for part in parts:
+                f.write(header.format(i + 1).ljust(384).encode('ascii'))
+                f.write(pack_raw(part[None], min(counter_depth, 12)).tobytes())
+    return hdr_filename
+
+
+@pytest.fixture
+def frames():
+    data = np.random.RandomState(0).randint(0, 100, (16, 256, 256))
+    # Bright flyback frame at the end of every scan row.
+    data[3::4] += 100
+    return data.astype(np.uint16)
+
+
+@pytest.fixture
+def hdr_filename(tmpdir, frames):
+    return write_mib(tmpdir, frames)
+
+
+def test_read_mib(hdr_filename, frames):
+    s = pxm.load(hdr_filename)
+    np.testing.assert_array_equal(s.data, frames)
+
+
+@pytest.mark.parametrize('chunks', [None, 3, 16])
+def test_read_mib_lazy(hdr_filename, frames, chunks):
+    hdr_info = mib.read_hdr(hdr_filename)
+    data = mib.read_mib(hdr_info, hdr_filename[:-3] + 'mib',
+                        lazy=True, chunks=chunks)
+    assert isinstance(data, da.Array)
+    np.testing.assert_array_equal(data.compute(), frames)
+
+
+@pytest.mark.parametrize('counter_depth, dtype', [(1, np.uint8),
+                                                   (6, np.uint8),
+                                                   (12, np.uint16),
+                                                   (24, np.uint32)])
+@pytest.mark.parametrize('lazy', [False, True])
+def test_read_mib_raw(tmpdir, counter_depth, dtype, lazy):
+    data = np.random.RandomState(0).randint(0, 2**counter_depth,
+                                            (4, 256, 256)).astype(dtype)
+    hdr_filename = write_raw_mib(tmpdir, data, counter_depth)
+    s = pxm.load(hdr_filename, lazy=lazy)
+    assert s.data.dtype == dtype
+    np.testing.assert_array_equal(np.asarray(s.data), data)
+    blocks = list(mib.iter_mib(hdr_filename, block_size=3))
+    np.testing.assert_array_equal(np.concatenate(blocks), data)
+
+
+def test_read_mib_native_byte_order(hdr_filename):
+    s = pxm.load(hdr_filename, lazy=True)
+    assert s.data.dtype.isnative
+    assert s.data.compute().dtype.isnative
+
+
+def test_load_mib_lazy(hdr_filename):
+    dp = pxm.load_mib(hdr_filename, 4)
+    lazy_dp = pxm.load_mib(hdr_filename, np.int64(4), lazy=True, chunks=1)
+    assert isinstance(lazy_dp, pxm.LazyElectronDiffraction)
+    np.testing.assert_array_equal(lazy_dp.data.compute(), dp.data)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_load_mib_flyback(tmpdir, frames, lazy):
+    frames[3::4] -= 100
+    frames[1::4] += 100
+    hdr_filename = write_mib(tmpdir, frames)
+    dp = pxm.load_mib(hdr_filename, 4, lazy=lazy)
+    scan = frames.reshape(4, 4, 256, 256)
+    expected = np.concatenate((scan[1:, 2:], scan[1:, :1]), axis=1)
+    assert dp.axes_manager.navigation_shape == (3, 3)
+    np.testing.assert_array_equal(np.asarray(dp.data), expected)
+
+
+def test_load_mib_non_square(hdr_filename, frames):
+    dp = pxm.load_mib(hdr_filename, (4, 3))
+    assert dp.axes_manager.navigation_shape == (3, 2)
+    np.testing.assert_array_equal(dp.data,
+                                  frames[:12].reshape(3, 4, 256, 256)[1:, :3])
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_load_mib_gain_correction(hdr_filename, lazy):
+    random = np.random.RandomState(1)
+    dark, bright = random.rand(256, 256), random.rand(256, 256) + 2
+    correction = get_gain_correction(dark, bright)
+    dp = pxm.load_mib(hdr_filename, 4)
+    corrected = pxm.load_mib(hdr_filename, 4, lazy=lazy,
+                             gain_correction=correction)
+    assert corrected.data.dtype == np.float32
+    np.testing.assert_allclose(np.asarray(corrected.data),
+                               gain_normalise(dp.data, dark, bright),
+                               rtol=1e-5, atol=1e-4)
+
+
+def test_load_mib_flyback_from_index(hdr_filename):
+    dp = pxm.load_mib(hdr_filename, 4)
+    mib.index_mib(hdr_filename)
+    np.testing.assert_array_equal(pxm.load_mib(hdr_filename, 4).data,
+                                  dp.data)
+
+
+@pytest.mark.parametrize('block_size', [None, 1, 5])
+def test_iter_mib(hdr_filename, frames, block_size):
+    blocks = list(mib.iter_mib(hdr_filename, block_size=block_size))
+    if block_size is None:
+        assert len(blocks) == len(frames)
+    np.testing.assert_array_equal(
+        np.concatenate(blocks).reshape(frames.shape), frames)
+
+
+def test_iter_mib_growing_file(hdr_filename, frames):
+    mib_filename = hdr_filename[:-3] + 'mib'
+    with open(mib_filename, 'rb') as f:
+        contents = f.read()
+    frame_bytes = len(contents) // len(frames)
+    with open(mib_filename, 'wb') as f:
+        f.write(contents[:int(5.5 * frame_bytes)])
+
+    frame_iterator = mib.iter_mib(hdr_filename, block_size=5,
+                                  timeout=0.2, poll_interval=0.05)
+    np.testing.assert_array_equal(next(frame_iterator), frames[:5])
+    with open(mib_filename, 'ab') as f:
+        f.write(contents[int(5.5 * frame_bytes):])
+    np.testing.assert_array_equal(next(frame_iterator), frames[5:10])
+    assert sum(len(block) for block in frame_iterator) == 6
+
+
+def test_parse_frame_header():
+    header = b'MQ1,000012,00384,01,0256,0256,U16,   1x1,01,' \
+             b'2018-05-14 16:21:03.000011,0.001000,0,0,0'
+    frame_info = mib.parse_frame_header(header)
+    assert frame_info['sequence'] == 12
+    assert frame_info['pixel_depth'] == 'U16'
+    assert frame_info['exposure'] == 0.001
+
+
+def test_index_mib(hdr_filename, frames):
+    index = mib.load_mib_index(hdr_filename)
+    assert len(index) == len(frames)
+    np.testing.assert_array_equal(index['sequence'], np.arange(1, 17))
+    assert not np.any(index['flags'] & mib.FRAME_DROPPED)
+    np.testing.assert_array_equal(
+        np.where(index['flags'] & mib.FRAME_TIME_GAP)[0], [4, 8, 12])
+    assert mib.find_flyback(index, 4) == 0
+    # The sidecar is reused on the next load.
+    assert os.path.exists(hdr_filename[:-3] + 'mib.idx.npy')
+    assert isinstance(mib.load_mib_index(hdr_filename), np.memmap)
+
+
+def test_read_indexed_frames(hdr_filename, frames):
+    index = mib.load_mib_index(hdr_filename)
+    np.testing.assert_array_equal(
+        mib.read_indexed_frames(hdr_filename, index, [7, 2]),
+        frames[[7, 2]])
+
+
+def test_convert_mib_hspy(tmpdir, hdr_filename):
+    dp = pxm.load_mib(hdr_filename, 4)
+    output = os.path.join(str(tmpdir), 'converted.hspy')
+    pxm.convert_mib(hdr_filename, output, 4, chunks=2, processes=2)
+    converted = pxm.load(output)
+    assert converted.axes_manager.navigation_shape == (3, 3)
+    np.testing.assert_array_equal(converted.data, dp.data)
+
+
+def test_convert_mib_zarr(tmpdir, hdr_filename):
+    zarr = pytest.importorskip('zarr')
+    dp = pxm.load_mib(hdr_filename, 4)
+    output = os.path.join(str(tmpdir), 'converted.zarr')
+    pxm.convert_mib(hdr_filename, output, 4, chunks=2, processes=2)
+    np.testing.assert_array_equal(zarr.open(output)[:], dp.data)
+
+
+@pytest.mark.parametrize('extension', ['hspy', 'zarr'])
+def test_convert_mib_no_overwrite(tmpdir, hdr_filename, extension):
+    if extension == 'zarr':
+        pytest.importorskip('zarr')
+    output = os.path.join(str(tmpdir), 'converted.' + extension)
+    pxm.convert_mib(hdr_filename, output, 4, chunks=2, processes=2)
+    mtime = os.path.getmtime(output)
+    pxm.convert_mib(hdr_filename, output, 4, chunks=2, processes=2,
+                    overwrite=False)
+    assert os.path.getmtime(output) == mtime
+
+
+def test_convert_mib_lzf(tmpdir, hdr_filename):
+    h5py = pytest.importorskip('h5py')
+    dp = pxm.load_mib(hdr_filename, 4)
+    output = os.path.join(str(tmpdir), 'converted.hspy')
+    pxm.convert_mib(hdr_filename, output, 4, chunks=2, processes=2,
+                    compression='lzf')
+    with h5py.File(output, 'r') as f:
+        dset = [g for g in f['Experiments'].values()][0]['data']
+        assert dset.compression == 'lzf'
+        assert dset.chunks == (2,) + dp.data.shape[1:]
+    np.testing.assert_array_equal(pxm.load(output).data, dp.data)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_write_mib(tmpdir, frames, lazy):
+    s = hs.signals.Signal2D(frames)
+    if lazy:
+        s = s.as_lazy()
+        s.data = s.data.rechunk((3, 256, 256))
+    filename = os.path.join(str(tmpdir), 'written.mib')
+    mib.write_mib(filename, s, 'image')
+    np.testing.assert_array_equal(
+        np.fromfile(filename, dtype=frames.dtype).reshape(frames.shape),
+        frames)
+
+
+def test_write_mib_frame_headers(tmpdir, frames):
+    s = hs.signals.Signal2D(frames).as_lazy()
+    mib.write_mib(os.path.join(str(tmpdir), 'test.mib'), s, 'image',
+                  frame_headers=True)
+    with open(os.path.join(str(tmpdir), 'test.hdr'), 'w') as f:
+        f.write(HDR.format(frames=len(frames)))
+    hdr_filename = os.path.join(str(tmpdir), 'test.hdr')
+    assert mib.read_hdr(hdr_filename)['pixel-depth'] == 'U16'
+    np.testing.assert_array_equal(pxm.load(hdr_filename).data, frames)
+    index = mib.load_mib_index(hdr_filename)
+    np.testing.assert_array_equal(index['sequence'], np.arange(1, 17))
@@ -90,3 +90,11 @@ def test_visuals():
 
     # Hand checking again
     assert True
+
+def test_masked_match_results():
+    masked_results = indexer.correlate(mask=np.array([[1, 0], [1, 1]]))
+    assert np.all(masked_results.inav[1, 0].data[:, 0] == len(library) + 1)
+    assert np.all(masked_results.inav[1, 0].data[:, 4] == 0)
+    for x, y in [(0, 0), (0, 1), (1, 1)]:
+        np.testing.assert_array_equal(masked_results.inav[x, y].data,
+                                      match_results.inav[x, y].data)
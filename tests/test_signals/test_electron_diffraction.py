@@ -19,7 +19,17 @@
 import numpy as np
 import pytest
 from hyperspy.signals import Signal1D, Signal2D
-from pyxem.signals.electron_diffraction import ElectronDiffraction
+import dask.array as da
+import hyperspy.api as hs
+from hyperspy.exceptions import VisibleDeprecationWarning
+from pyxem.signals.electron_diffraction import (ElectronDiffraction,
+                                                LazyElectronDiffraction)
+from pyxem.signals.vdf_image import VDFImage
+from pyxem.signals.diffraction_profile import ElectronDiffractionProfile
+from pyxem.utils.expt_utils import (affine_transformation, circular_mask,
+                                    reproject_polar, radial_average,
+                                    azimuthal_integrate)
+from pyxem.utils.vdf_utils import roi_to_mask
 
 
 @pytest.fixture(params=[
@@ -60,6 +70,18 @@ def diffraction_pattern(request):
     return ElectronDiffraction(request.param)
 
 
+@pytest.fixture(params=[False, True], ids=['eager', 'lazy'])
+def make_signal(request):
+    """Create an ElectronDiffraction, or a LazyElectronDiffraction chunked
+    along every axis, from an array."""
+    def make(data):
+        if request.param:
+            chunks = tuple(max(1, n // 2) for n in data.shape)
+            return LazyElectronDiffraction(da.from_array(data, chunks=chunks))
+        return ElectronDiffraction(data)
+    return make
+
+
 @pytest.mark.skip(reason='Defaults not implemented in pyXem')
 def test_default_params(diffraction_pattern):
     a = diffraction_pattern.metadata.Acquisition_instrument.TEM.rocking_angle
@@ -93,6 +115,39 @@ def test_apply_gain_normalisation(diffraction_pattern: ElectronDiffraction,
     assert diffraction_pattern.min() == dark_reference
 
 
+@pytest.mark.parametrize('deadvalue', ['average', 'nan'])
+def test_remove_deadpixels(diffraction_pattern: ElectronDiffraction,
+                           deadvalue):
+    deadpixels = [(3, 3), (3, 4), (0, 7)]
+    lazy = LazyElectronDiffraction(
+        da.from_array(diffraction_pattern.data, chunks=(2, 8, 8)))
+    corrected = diffraction_pattern.remove_deadpixels(
+        deadpixels, deadvalue=deadvalue, inplace=False)
+    assert np.isnan(corrected.data[:, 3, 3]).all() == (deadvalue == 'nan')
+    assert corrected.data[2, 0, 7] != 2
+    assert diffraction_pattern.data[2, 0, 7] == 2
+    lazy.remove_deadpixels(deadpixels, deadvalue=deadvalue)
+    np.testing.assert_allclose(lazy.data.compute(), corrected.data)
+
+
+def test_get_deadpixel_mask(make_signal):
+    random = np.random.RandomState(0)
+    data = random.poisson(10, (6, 6, 16, 16)).astype(np.uint16)
+    data[..., 2, 3] = 0
+    data[..., 7, 7] = 500
+    data[..., 9, 1] = random.choice([0, 200], (6, 6))
+    dp = make_signal(data)
+    mask = dp.get_deadpixel_mask(hot_threshold=20, noise_threshold=5,
+                                 navigation_step=2)
+    assert mask.data.shape == (16, 16)
+    np.testing.assert_array_equal(np.argwhere(mask.data),
+                                  [[2, 3], [7, 7], [9, 1]])
+    assert np.argwhere(dp.get_deadpixel_mask().data).tolist() == [[2, 3],
+                                                                   [7, 7]]
+    dp.remove_deadpixels(mask)
+    assert np.asarray(dp.data)[..., 7, 7].max() < 50
+
+
 def test_reproject_as_polar(diffraction_pattern: ElectronDiffraction):
     shape_cartesian = diffraction_pattern.axes_manager.signal_shape
     diffraction_pattern.reproject_as_polar()
@@ -102,12 +157,99 @@ def test_reproject_as_polar(diffraction_pattern: ElectronDiffraction):
     assert shape_polar[1] > np.sqrt(2) * shape_cartesian[0] / 2
 
 
+def test_reproject_as_polar_origins(make_signal):
+    data = np.random.RandomState(0).rand(2, 3, 12, 12)
+    origins = np.zeros((2, 3, 2)) + 6
+    origins[1, 2] = [5.5, 6.25]
+    dp = make_signal(data)
+    polar = dp.reproject_as_polar(origin=origins, dr=0.5, inplace=False)
+    assert polar._lazy == dp._lazy
+    expected = reproject_polar(data.reshape(-1, 12, 12),
+                               origin=origins.reshape(-1, 2), dr=0.5)
+    assert polar.axes_manager.signal_shape == expected.shape[:0:-1]
+    np.testing.assert_allclose(np.asarray(polar.data),
+                               expected.reshape((2, 3) + expected.shape[1:]))
+    np.testing.assert_allclose(np.asarray(polar.data)[0, 0],
+                               reproject_polar(data[0, 0], dr=0.5))
+
+
 def test_get_diffraction_variance(diffraction_pattern: ElectronDiffraction):
     dv = diffraction_pattern.get_diffraction_variance()
     assert dv.axes_manager.navigation_shape == (3,)
     assert dv.axes_manager.signal_shape == diffraction_pattern.axes_manager.signal_shape
 
 
+def test_get_diffraction_variance_values(make_signal):
+    data = np.random.RandomState(0).rand(5, 4, 8, 8) + 1
+    dp = make_signal(data)
+    dv = dp.get_diffraction_variance()
+    mean = data.mean(axis=(0, 1))
+    meansquare = np.square(data).mean(axis=(0, 1))
+    np.testing.assert_allclose(
+        dv.data, [mean, meansquare, meansquare / np.square(mean) - 1])
+    profiles = dp.get_diffraction_variance(radial=True)
+    assert isinstance(profiles, ElectronDiffractionProfile)
+    mean, meansquare = radial_average(np.stack((mean, meansquare)))
+    np.testing.assert_allclose(
+        profiles.data, [mean, meansquare, meansquare / np.square(mean) - 1])
+
+
+class TestVirtualImages:
+
+    @pytest.fixture
+    def diffraction_pattern(self):
+        data = np.random.RandomState(0).rand(3, 4, 8, 8)
+        return ElectronDiffraction(data)
+
+    def test_get_virtual_images(self, diffraction_pattern, make_signal):
+        mask = np.zeros((8, 8), dtype=bool)
+        mask[2:5, 3:6] = True
+        weights = np.random.RandomState(1).rand(8, 8)
+        roi = hs.roi.RectangularROI(1, 2, 4, 6)
+        expected = [diffraction_pattern.data[..., mask].sum(axis=-1),
+                    (diffraction_pattern.data * weights).sum(axis=(-2, -1)),
+                    diffraction_pattern.get_virtual_image(roi).data]
+        vdfs = make_signal(diffraction_pattern.data).get_virtual_images([mask, weights, roi])
+        assert isinstance(vdfs, VDFImage)
+        assert vdfs.axes_manager.navigation_shape == (3,)
+        assert vdfs.axes_manager.signal_shape == (4, 3)
+        np.testing.assert_allclose(vdfs.data, expected)
+
+    @pytest.mark.parametrize('roi', [
+        hs.roi.CircleROI(4, 4, 2),
+        hs.roi.CircleROI(3.5, 4, 3, 1),
+    ])
+    def test_get_virtual_images_round(self, diffraction_pattern, roi):
+        vdfs = diffraction_pattern.get_virtual_images([roi])
+        np.testing.assert_allclose(
+            vdfs.data[0], diffraction_pattern.get_virtual_image(roi).data)
+
+    def test_fast_virtual_image(self, diffraction_pattern):
+        roi = hs.roi.RectangularROI(1, 2, 5, 6)
+        image, update_binned, update_exact = \
+            diffraction_pattern._get_fast_virtual_image(roi, binning=2)
+        expected = diffraction_pattern.get_virtual_images([roi]).data[0]
+        np.testing.assert_allclose(image.data, expected)
+        roi.right = 7
+        update_binned()
+        # Moving the ROI updates a binned approximation...
+        mask = roi_to_mask(
+            roi, diffraction_pattern.axes_manager._get_axes_dicts()[2:])
+        coverage = mask.reshape(4, 2, 4, 2).mean(axis=(1, 3))
+        binned = diffraction_pattern.data.reshape(3, 4, 4, 2, 4, 2).sum(
+            axis=(3, 5))
+        np.testing.assert_allclose(
+            image.data, (binned * coverage).sum(axis=(-2, -1)))
+        update_exact()
+        # ...which is replaced by the exact image on request...
+        expected = diffraction_pattern.get_virtual_images([roi]).data[0]
+        np.testing.assert_allclose(image.data, expected)
+        # ...and only recomputed once the ROI has moved again.
+        image.data[:] = 0
+        update_exact()
+        np.testing.assert_array_equal(image.data, 0)
+
+
 class TestDirectBeamMethods:
 
     @pytest.mark.parametrize('mask_expected', [
@@ -136,6 +278,19 @@ class TestDirectBeamMethods:
             radius=3, threshold=1, closing=closing, opening=opening)
         assert np.allclose(mask_calculated, mask_expected)
 
+    @pytest.mark.parametrize('early_stop', [False, True])
+    def test_get_vacuum_mask_stream(self, make_signal, early_stop):
+        data = np.random.RandomState(0).rand(5, 6, 10, 10)
+        data[..., 3:7, 3:7] = 10
+        expected = (data * ~circular_mask((10, 10), 3, (4.5, 4.5))).max(
+            axis=(-2, -1)) <= 0.98
+        dp = make_signal(data)
+        mask = dp.get_vacuum_mask(3, 0.98, closing=False,
+                                  early_stop=early_stop)
+        assert mask.axes_manager.signal_shape == (6, 5)
+        assert expected.any() and not expected.all()
+        np.testing.assert_array_equal(mask.data, expected)
+
 
 class TestRadialProfile:
 
@@ -176,6 +331,130 @@ class TestRadialProfile:
         rp = diffraction_pattern.get_radial_profile()
         assert np.allclose(rp.data, expected, atol=1e-3)
 
+    def test_radial_profile_centers(self, make_signal):
+        data = np.random.RandomState(0).rand(2, 3, 8, 8).astype(np.float32)
+        centers = np.zeros((2, 3, 2)) + 3.5
+        centers[0, 1] = [4, 3.25]
+        dp = make_signal(data)
+        rp = dp.get_radial_profile(center=centers)
+        assert isinstance(rp, ElectronDiffractionProfile)
+        np.testing.assert_allclose(rp.data,
+                                   radial_average(data, center=centers),
+                                   rtol=1e-6)
+        np.testing.assert_allclose(rp.data[1, 1, :5],
+                                   radial_average(data[1, 1]), rtol=1e-6)
+
+    def test_radial_profile_deprecated_arguments(self, diffraction_pattern):
+        expected = diffraction_pattern.get_radial_profile().data
+        with pytest.warns(VisibleDeprecationWarning):
+            rp = diffraction_pattern.get_radial_profile(False, inplace=False)
+        np.testing.assert_allclose(rp.data, expected)
+        with pytest.warns(VisibleDeprecationWarning):
+            rp = diffraction_pattern.get_radial_profile(parallel=True)
+        np.testing.assert_allclose(rp.data, expected)
+
+
+class TestAzimuthalIntegral:
+
+    @pytest.mark.parametrize('npt_azim', [None, 6])
+    def test_get_azimuthal_integral(self, make_signal, npt_azim):
+        data = np.random.RandomState(0).rand(2, 3, 10, 10)
+        mask = np.zeros((10, 10), dtype=bool)
+        mask[2, 3] = True
+        dp = make_signal(data)
+        dp.axes_manager.signal_axes[0].scale = 0.1
+        dp.axes_manager.signal_axes[1].scale = 0.1
+        integrated = dp.get_azimuthal_integral(
+            npt_rad=5, npt_azim=npt_azim, mask=Signal2D(mask), pixel_split=2)
+        expected = azimuthal_integrate(data, npt_rad=5, npt_azim=npt_azim,
+                                       mask=mask, pixel_split=2,
+                                       calibration=0.1)
+        np.testing.assert_allclose(integrated.data, expected)
+        radial_axis = integrated.axes_manager.signal_axes[0]
+        assert radial_axis.size == 5
+        # The furthest sub-pixel is at 4.75 pixels from the center along x and y
+        assert radial_axis.scale == pytest.approx(0.1 * np.hypot(4.75, 4.75) / 5)
+        if npt_azim is None:
+            assert isinstance(integrated, ElectronDiffractionProfile)
+        else:
+            assert integrated.axes_manager.signal_shape == (5, 6)
+
+    def test_solid_angle_requires_voltage(self):
+        with pytest.raises(ValueError):
+            ElectronDiffraction(np.ones((4, 4))).get_azimuthal_integral(
+                solid_angle=True)
+
+
+@pytest.mark.parametrize('method', ['cross_correlation', 'center_of_mass',
+                                    'threshold', 'hybrid'])
+def test_get_direct_beam_position(make_signal, method):
+    y, x = np.indices((24, 24))
+    data = np.zeros((2, 3, 24, 24))
+    for i, j in np.ndindex(2, 3):
+        data[i, j] = np.hypot(x - 12 - j, y - 12 + i) < 4
+    dp = make_signal(data)
+    shifts = dp.get_direct_beam_position(3, 6, method=method)
+    assert shifts.axes_manager.navigation_shape == (3, 2)
+    expected = np.stack(np.broadcast_arrays(np.arange(2)[:, None],
+                                            -np.arange(3)), axis=-1)
+    np.testing.assert_allclose(shifts.data, expected, atol=0.1)
+
+
+def test_get_direct_beam_position_subsample(make_signal):
+    y, x = np.indices((24, 24))
+    data = np.zeros((7, 9, 24, 24))
+    # A linear descan with noise in the beam position of single patterns.
+    noise = np.random.RandomState(0).uniform(-0.5, 0.5, (7, 9, 2))
+    for i, j in np.ndindex(7, 9):
+        cy, cx = 12 - 0.5 * i + noise[i, j, 0], 12 + 0.25 * j + noise[i, j, 1]
+        data[i, j] = np.hypot(x - cx, y - cy) < 4
+    dp = make_signal(data)
+    shifts = dp.get_direct_beam_position(method='center_of_mass', radius=8,
+                                         subsample=2, degree=1)
+    assert shifts.data.shape == (7, 9, 2)
+    expected = np.stack(np.broadcast_arrays(0.5 * np.arange(7)[:, None],
+                                            -0.25 * np.arange(9)), axis=-1)
+    np.testing.assert_allclose(shifts.data, expected, atol=0.25)
+    centered = dp.center_direct_beam(method='center_of_mass', radius=8,
+                                     subsample=2, degree=1, inplace=False)
+    assert centered.data.shape == data.shape
+
+
+def test_get_direct_beam_position_method_not_implemented():
+    with pytest.raises(NotImplementedError):
+        ElectronDiffraction(np.ones((2, 8, 8))).get_direct_beam_position(
+            method='magic')
+
+
+@pytest.mark.parametrize('nav_shape', [(4,), (2, 3), (2, 1, 2)])
+@pytest.mark.parametrize('interpolation', ['bilinear', 'fourier'])
+def test_center_direct_beam(make_signal, nav_shape, interpolation):
+    y, x = np.indices((24, 24))
+    data = np.zeros(nav_shape + (24, 24))
+    for index in np.ndindex(nav_shape):
+        data[index] = np.hypot(x - 11 - index[-1], y - 13 + index[0]) < 4
+    dp = make_signal(data)
+    centered = dp.center_direct_beam(3, 6, interpolation=interpolation,
+                                     inplace=False)
+    assert centered.data.shape == data.shape
+    shifts = centered.get_direct_beam_position(3, 6)
+    np.testing.assert_allclose(shifts.data, 0, atol=0.1)
+    assert dp.center_direct_beam(3, 6, interpolation=interpolation) is None
+    np.testing.assert_allclose(dp.data, centered.data)
+
+
+def test_center_direct_beam_affine():
+    y, x = np.indices((24, 24))
+    data = np.zeros((2, 2, 24, 24))
+    data[..., 11:15, 9:15] = 1
+    dp = ElectronDiffraction(data)
+    shifts = np.tile([2., 0.], (2, 2, 1))
+    D = np.array([[0., -1., 0.], [1., 0., 0.], [0., 0., 1.]])
+    fused = dp.center_direct_beam(shifts=shifts, D=D, inplace=False)
+    dp.center_direct_beam(shifts=shifts)
+    dp.apply_affine_transformation(D, order=1)
+    np.testing.assert_allclose(fused.data, dp.data, atol=1e-12)
+
 
 class TestApplyAffineTransformation:
 
@@ -224,6 +503,18 @@ class TestApplyAffineTransformation:
         diffraction_pattern.apply_affine_transformation(D=transformation)
         assert np.allclose(diffraction_pattern.data, expected)
 
+    def test_apply_affine_transformation_batched(self, make_signal):
+        data = np.random.RandomState(0).rand(2, 3, 10, 10)
+        D = np.array([[1.05, 0.02, 0.5],
+                      [0.01, 0.97, -0.2],
+                      [0., 0., 1.]])
+        dp = make_signal(data)
+        transformed = dp.apply_affine_transformation(D, inplace=False)
+        assert transformed._lazy == dp._lazy
+        expected = [[affine_transformation(z, D, 3, mode='constant')
+                     for z in row] for row in data]
+        np.testing.assert_allclose(np.asarray(transformed.data), expected)
+
 
 class TestBackgroundMethods:
 
@@ -248,6 +539,82 @@ class TestBackgroundMethods:
         assert bgr.data.shape == diffraction_pattern.data.shape
         assert bgr.max() <= diffraction_pattern.max()
 
+class TestNavigationMask:
+
+    @pytest.fixture
+    def data(self):
+        data = np.random.RandomState(0).rand(3, 4, 16, 16)
+        data[..., 6:10, 6:10] += 5
+        data[:, :, 3, 12] = 10
+        return data
+
+    @pytest.fixture
+    def navigation_mask(self):
+        mask = np.zeros((3, 4), dtype=bool)
+        mask[0, 1] = mask[2, 3] = mask[1, 0] = True
+        return mask
+
+    def test_get_radial_profile(self, data, navigation_mask, make_signal):
+        dp = make_signal(data)
+        profiles = dp.get_radial_profile(navigation_mask=navigation_mask)
+        expected = dp.get_radial_profile()
+        assert profiles.axes_manager.navigation_shape == (4, 3)
+        np.testing.assert_allclose(profiles.data[~navigation_mask],
+                                   expected.data[~navigation_mask])
+        np.testing.assert_array_equal(profiles.data[navigation_mask], 0)
+
+    def test_get_direct_beam_position(self, data, navigation_mask, make_signal):
+        dp = make_signal(data)
+        shifts = dp.get_direct_beam_position(3, 5,
+                                             navigation_mask=navigation_mask)
+        expected = dp.get_direct_beam_position(3, 5)
+        np.testing.assert_allclose(shifts.data[~navigation_mask],
+                                   expected.data[~navigation_mask])
+        np.testing.assert_array_equal(shifts.data[navigation_mask], 0)
+        shifts = dp.get_direct_beam_position(method='center_of_mass',
+                                             subsample=2, degree=0,
+                                             navigation_mask=navigation_mask)
+        assert shifts.data.shape == (3, 4, 2)
+
+    def test_remove_background(self, data, navigation_mask):
+        dp = ElectronDiffraction(data)
+        bgr = dp.remove_background('median', footprint=4,
+                                   navigation_mask=navigation_mask)
+        expected = dp.remove_background('median', footprint=4)
+        assert bgr.axes_manager.navigation_shape == (4, 3)
+        np.testing.assert_allclose(bgr.data[~navigation_mask],
+                                   expected.data[~navigation_mask])
+        np.testing.assert_array_equal(bgr.data[navigation_mask], 0)
+
+    def test_remove_background_reference_pattern(self, data, navigation_mask):
+        dp = ElectronDiffraction(data)
+        bg = np.full((16, 16), 0.5)
+        bgr = dp.remove_background('reference_pattern', bg=bg,
+                                   navigation_mask=navigation_mask)
+        expected = dp.remove_background('reference_pattern', bg=bg)
+        # Both paths return a new signal and leave the data unchanged.
+        np.testing.assert_array_equal(dp.data, data)
+        assert bgr.axes_manager.navigation_shape == (4, 3)
+        np.testing.assert_allclose(bgr.data[~navigation_mask],
+                                   expected.data[~navigation_mask])
+        np.testing.assert_array_equal(bgr.data[navigation_mask], 0)
+
+    def test_find_peaks(self, data, navigation_mask):
+        dp = ElectronDiffraction(data)
+        peaks = dp.find_peaks('skimage', navigation_mask=navigation_mask)
+        assert peaks.axes_manager.navigation_shape == (4, 3)
+        assert peaks.data[0, 1].shape == (0, 2)
+        assert len(peaks.data[0, 0]) > 0
+
+    def test_vacuum_mask(self, data):
+        dp = ElectronDiffraction(data)
+        dp.data[0, 1, 3, 12] = 0
+        mask = dp.get_vacuum_mask(5, 2, closing=False)
+        assert mask.data.sum() == 1
+        profiles = dp.get_radial_profile(navigation_mask=mask)
+        np.testing.assert_array_equal(profiles.data[0, 1], 0)
+
+
 @pytest.mark.skip(reason="Diffraction Simulation not yet fixed")
 class TestPeakFinding:
     #This isn't testing the finding, that is done in test_peakfinders2D
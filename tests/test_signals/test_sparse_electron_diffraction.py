@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import numpy as np
+import pytest
+import hyperspy.api as hs
+from pyxem.signals.electron_diffraction import ElectronDiffraction
+from pyxem.signals.sparse_electron_diffraction import \
+    SparseElectronDiffraction
+
+
+@pytest.fixture
+def diffraction_pattern():
+    data = np.random.RandomState(0).poisson(0.05, (3, 4, 8, 8))
+    data[..., 4, 4] += 20
+    return ElectronDiffraction(data.astype(np.uint16))
+
+
+@pytest.fixture
+def sparse(diffraction_pattern):
+    return SparseElectronDiffraction.from_signal(diffraction_pattern)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_from_signal(diffraction_pattern, lazy):
+    if lazy:
+        diffraction_pattern = diffraction_pattern.as_lazy()
+        diffraction_pattern.data = diffraction_pattern.data.rechunk(
+            (2, 4, 8, 8))
+    sparse = SparseElectronDiffraction.from_signal(diffraction_pattern)
+    assert sparse.navigation_shape == (3, 4)
+    assert len(sparse.indices) == np.count_nonzero(
+        np.asarray(diffraction_pattern.data))
+    assert sparse.density < 0.1
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_to_dense(diffraction_pattern, sparse, lazy):
+    dense = sparse.to_dense(lazy=lazy, chunks=2)
+    assert dense._lazy == lazy
+    np.testing.assert_array_equal(np.asarray(dense.data),
+                                  diffraction_pattern.data)
+
+
+def test_save_load(tmpdir, sparse, diffraction_pattern):
+    filename = os.path.join(str(tmpdir), 'sparse.npz')
+    sparse.save(filename)
+    loaded = SparseElectronDiffraction.load(filename)
+    np.testing.assert_array_equal(loaded.to_dense(lazy=False).data,
+                                  diffraction_pattern.data)
+
+
+def test_sum(sparse, diffraction_pattern):
+    np.testing.assert_array_equal(sparse.sum().data,
+                                  diffraction_pattern.data.sum(axis=(0, 1)))
+
+
+def test_get_virtual_image(sparse, diffraction_pattern):
+    roi = hs.roi.RectangularROI(2, 3, 6, 5)
+    np.testing.assert_allclose(
+        sparse.get_virtual_image(roi).data,
+        diffraction_pattern.get_virtual_image(roi).data)
+    roi = hs.roi.CircleROI(4, 4, 2)
+    np.testing.assert_allclose(
+        sparse.get_virtual_image(roi).data,
+        diffraction_pattern.get_virtual_image(roi).data)
+
+
+def test_get_radial_profile(sparse, diffraction_pattern):
+    np.testing.assert_allclose(
+        sparse.get_radial_profile().data,
+        diffraction_pattern.get_radial_profile().data)
+    centers = np.zeros(diffraction_pattern.data.shape[:-2] + (2,)) + 3.5
+    centers[0, 1] = [4, 3.25]
+    np.testing.assert_allclose(
+        sparse.get_radial_profile(center=centers).data,
+        diffraction_pattern.get_radial_profile(center=centers).data)
+
+
+def test_center_of_mass(sparse, diffraction_pattern):
+    data = diffraction_pattern.data.astype(float)
+    y, x = np.indices(data.shape[-2:])
+    total = data.sum(axis=(-2, -1))
+    expected = np.stack([(data * x).sum(axis=(-2, -1)) / total,
+                         (data * y).sum(axis=(-2, -1)) / total], axis=-1)
+    np.testing.assert_allclose(sparse.center_of_mass().data, expected)
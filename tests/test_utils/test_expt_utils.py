@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+import scipy.ndimage as ndi
+
+from pyxem.utils.expt_utils import (remove_dead, get_deadpixel_correction,
+                                    apply_deadpixel_correction,
+                                    affine_transformation,
+                                    get_affine_correction,
+                                    apply_affine_correction,
+                                    get_spline_matrix, spline_prefilter,
+                                    get_polar_correction,
+                                    apply_interpolation_matrix,
+                                    reproject_polar, radial_average,
+                                    get_radial_profile_length,
+                                    get_azimuthal_integrator,
+                                    azimuthal_integrate,
+                                    find_beam_offset_cross_correlation,
+                                    find_beam_offset_center_of_mass,
+                                    find_beam_offset_threshold,
+                                    find_beam_offset_hybrid,
+                                    shift_patterns, fit_shift_surface,
+                                    diffraction_moments, merge_moments)
+
+
+class TestDeadPixels:
+
+    @pytest.fixture
+    def z(self):
+        return np.arange(36, dtype=float).reshape(6, 6)
+
+    def test_remove_dead(self, z):
+        corrected = remove_dead(z, [(2, 3)])
+        assert corrected[2, 3] == pytest.approx(
+            np.mean(np.delete(z[1:4, 2:5].ravel(), 4)))
+        # The input is not modified.
+        assert z[2, 3] == 15
+
+    def test_remove_dead_cluster(self, z):
+        deadpixels = [(i, j) for i in range(1, 4) for j in range(1, 4)]
+        corrected = remove_dead(z, deadpixels)
+        # The centre of the cluster is interpolated from the ring of valid
+        # pixels around it.
+        assert corrected[2, 2] == pytest.approx(
+            np.mean(np.delete(z[:5, :5].ravel(),
+                              [6, 7, 8, 11, 12, 13, 16, 17, 18])))
+        assert corrected[1, 1] == pytest.approx(
+            np.mean(z[[0, 0, 0, 1, 2], [0, 1, 2, 0, 0]]))
+
+    def test_remove_dead_nan(self, z):
+        mask = np.zeros(z.shape, dtype=bool)
+        mask[0, 0] = True
+        corrected = remove_dead(z.astype(np.uint16), mask, deadvalue='nan')
+        assert np.isnan(corrected[0, 0])
+        assert np.isnan(corrected).sum() == 1
+
+    def test_apply_deadpixel_correction_stack(self, z):
+        correction = get_deadpixel_correction([(0, 5), (4, 4)], z.shape)
+        stack = np.stack([z, 2 * z])
+        corrected = apply_deadpixel_correction(stack, correction)
+        np.testing.assert_allclose(corrected[1], 2 * corrected[0])
+        np.testing.assert_allclose(corrected[0],
+                                   remove_dead(z, [(0, 5), (4, 4)]))
+
+
+class TestAffineCorrection:
+
+    @pytest.fixture
+    def matrix(self):
+        return np.array([[1.1, 0.05, 0.3],
+                         [-0.02, 0.95, -0.4],
+                         [0., 0., 1.]])
+
+    @pytest.mark.parametrize('order, dtype', [(0, float), (1, float),
+                                              (3, float), (1, np.uint16),
+                                              (3, np.uint16)])
+    def test_matches_warp(self, matrix, order, dtype):
+        z = (np.random.RandomState(0).rand(12, 14) * 100).astype(dtype)
+        expected = affine_transformation(z, matrix, order)
+        correction = get_affine_correction(matrix, z.shape, order)
+        np.testing.assert_allclose(apply_affine_correction(z, correction),
+                                   expected, atol=1e-12)
+        # Patterns whose range includes the zeros filled in are clipped too.
+        z = z.astype(float) - 50
+        np.testing.assert_allclose(apply_affine_correction(z, correction),
+                                   affine_transformation(z, matrix, order),
+                                   atol=1e-12)
+
+    def test_correction_cached(self, matrix):
+        assert get_affine_correction(matrix, (8, 8), 1) is \
+            get_affine_correction(matrix.copy(), (8, 8), 1)
+
+    def test_apply_affine_correction_stack(self, matrix):
+        z = np.random.RandomState(0).rand(2, 3, 10, 10)
+        correction = get_affine_correction(matrix, (10, 10), 3)
+        corrected = apply_affine_correction(z, correction)
+        assert corrected.shape == z.shape
+        np.testing.assert_allclose(corrected[1, 2],
+                                   apply_affine_correction(z[1, 2],
+                                                           correction))
+
+
+class TestPolarReprojection:
+
+    @pytest.fixture
+    def z(self):
+        return np.random.RandomState(0).rand(3, 16, 18)
+
+    def test_spline_matrix(self, z):
+        rs = np.random.RandomState(1)
+        rows, cols = rs.uniform(-2, 18, 500), rs.uniform(-2, 20, 500)
+        weights = get_spline_matrix(rows, cols, z.shape[1:])
+        np.testing.assert_allclose(
+            weights.dot(spline_prefilter(z[0]).ravel()),
+            ndi.map_coordinates(z[0], [rows, cols]), atol=1e-12)
+
+    @pytest.mark.parametrize('jacobian', [False, True])
+    def test_reproject_polar_stack(self, z, jacobian):
+        polar = reproject_polar(z, jacobian=jacobian, dr=0.5)
+        assert polar.shape[-1] == 18
+        np.testing.assert_allclose(
+            polar[1], reproject_polar(z[1], jacobian=jacobian, dr=0.5))
+
+    def test_reproject_polar_origins(self, z):
+        origins = np.array([[9, 8], [9.5, 7.25], [9, 8]])
+        polar = reproject_polar(z, origin=origins)
+        np.testing.assert_allclose(polar[0], reproject_polar(z[0]))
+        correction, shape = get_polar_correction(z.shape[1:], origins[1],
+                                                 grid_origin=(9, 8))
+        np.testing.assert_allclose(
+            polar[1], apply_interpolation_matrix(spline_prefilter(z[1]),
+                                                 correction, shape))
+
+
+class TestRadialAverage:
+
+    @pytest.fixture
+    def z(self):
+        return np.random.RandomState(0).rand(2, 3, 9, 10)
+
+    @staticmethod
+    def reference(z, center):
+        y, x = np.indices(z.shape)
+        r = np.sqrt((x - center[0])**2 + (y - center[1])**2)
+        r = np.rint(r - 0.5).astype(int).ravel()
+        return np.bincount(r, z.ravel()) / np.bincount(r)
+
+    @pytest.mark.parametrize('cython', [False, True])
+    @pytest.mark.parametrize('dtype', [np.float32, np.float64, np.uint16,
+                                       np.int8])
+    def test_radial_average_stack(self, z, cython, dtype):
+        z = (z * 100).astype(dtype)
+        averaged = radial_average(z, cython=cython)
+        assert averaged.shape == (2, 3, get_radial_profile_length((9, 10)))
+        np.testing.assert_allclose(averaged[1, 2],
+                                   self.reference(z[1, 2], (4.5, 4)))
+
+    @pytest.mark.parametrize('cython', [False, True])
+    def test_radial_average_centers(self, z, cython):
+        centers = np.array([[[4.5, 4], [3.25, 5.5], [4.5, 4]],
+                            [[6, 2], [4.5, 4], [0, 0]]])
+        averaged = radial_average(z, cython=cython, center=centers)
+        assert averaged.shape[-1] == get_radial_profile_length((9, 10),
+                                                                (0, 0))
+        for i, j in np.ndindex(2, 3):
+            expected = self.reference(z[i, j], centers[i, j])
+            np.testing.assert_allclose(averaged[i, j, :len(expected)],
+                                       expected)
+            assert not averaged[i, j, len(expected):].any()
+
+
+class TestAzimuthalIntegration:
+
+    @pytest.fixture
+    def z(self):
+        return np.random.RandomState(0).rand(3, 10, 12)
+
+    def test_matches_radial_average(self, z):
+        nbins = get_radial_profile_length(z.shape[1:])
+        np.testing.assert_allclose(
+            azimuthal_integrate(z, npt_rad=nbins, radial_range=(0, nbins)),
+            radial_average(z))
+
+    @pytest.mark.parametrize('pixel_split', [1, 3])
+    @pytest.mark.parametrize('npt_azim', [None, 8])
+    def test_uniform(self, pixel_split, npt_azim):
+        z = np.full((16, 16), 2.)
+        mask = np.zeros(z.shape, dtype=bool)
+        mask[3, 4] = True
+        z[3, 4] = 1000
+        integrated = azimuthal_integrate(z, npt_rad=10, npt_azim=npt_azim,
+                                         mask=mask, pixel_split=pixel_split,
+                                         matrix=np.diag([1.1, 0.9, 1.]))
+        np.testing.assert_allclose(integrated[integrated != 0], 2.)
+
+    def test_caked(self):
+        y, x = np.indices((16, 16))
+        z = (x > 7.5).astype(float)
+        caked = azimuthal_integrate(z, npt_rad=4, npt_azim=4, pixel_split=2,
+                                    radial_range=(1, 7))
+        # chi bins [-pi, -pi/2), [-pi/2, 0), [0, pi/2), [pi/2, pi)
+        np.testing.assert_allclose(caked[[0, 3]], 0.)
+        np.testing.assert_allclose(caked[[1, 2]], 1.)
+
+    def test_solid_angle(self):
+        z = np.ones((16, 16))
+        integrated = azimuthal_integrate(z, npt_rad=8, radial_range=(0, 0.8),
+                                         calibration=0.1, wavelength=0.1)
+        two_theta = 2 * np.arcsin(0.1 * np.arange(0.5, 8) * 0.1 / 2)
+        np.testing.assert_allclose(integrated, 1 / np.cos(two_theta)**3,
+                                   rtol=1e-3)
+
+    def test_integrator_cached(self):
+        mask = np.zeros((8, 8), dtype=bool)
+        assert get_azimuthal_integrator((8, 8), mask=mask)[0] is \
+            get_azimuthal_integrator((8, 8), mask=mask.copy())[0]
+
+
+class TestFindBeamOffset:
+
+    @pytest.fixture
+    def z(self):
+        y, x = np.indices((32, 32))
+        centers = [(16, 16), (19, 14), (13.5, 17.25)]
+        return np.array([np.hypot(x - cx, y - cy) < 5
+                         for cy, cx in centers], dtype=float)
+
+    def test_offsets(self, z):
+        shifts = find_beam_offset_cross_correlation(z, 4, 7)
+        np.testing.assert_allclose(shifts, [[0, 0], [-3, 2], [2.5, -1.25]],
+                                   atol=0.25)
+
+    def test_center_of_mass(self, z):
+        np.testing.assert_allclose(find_beam_offset_center_of_mass(z),
+                                   [[0, 0], [-3, 2], [2.5, -1.25]], atol=0.1)
+        # A reflection outside the disc only shifts the unmasked estimate.
+        z[:, 2, 2] = 20
+        assert np.abs(find_beam_offset_center_of_mass(z)[0]).max() > 1
+        np.testing.assert_allclose(
+            find_beam_offset_center_of_mass(z, radius=12)[0], 0, atol=1e-12)
+
+    def test_threshold(self, z):
+        z = z * 10 + np.random.RandomState(0).rand(*z.shape)
+        np.testing.assert_allclose(find_beam_offset_threshold(z),
+                                   [[0, 0], [-3, 2], [2.5, -1.25]], atol=0.1)
+
+    def test_hybrid(self, z):
+        z[:, 2, 2] = 0.9
+        np.testing.assert_allclose(find_beam_offset_hybrid(z, radius=7),
+                                   [[0, 0], [-3, 2], [2.5, -1.25]], atol=0.1)
+
+    def test_empty(self):
+        z = np.zeros((2, 8, 8))
+        for find in (find_beam_offset_center_of_mass,
+                     find_beam_offset_threshold, find_beam_offset_hybrid):
+            np.testing.assert_array_equal(find(z), 0)
+
+    def test_stack(self, z):
+        shifts = find_beam_offset_cross_correlation(z.reshape(3, 1, 32, 32),
+                                                    4, 7)
+        assert shifts.shape == (3, 1, 2)
+        np.testing.assert_array_equal(
+            shifts[1, 0], find_beam_offset_cross_correlation(z[1], 4, 7))
+
+
+def test_merge_moments():
+    # A large offset, for which the variance from the mean square is lost.
+    z = 1e8 + np.random.RandomState(0).rand(10, 4, 5)
+    count, mean, m2 = merge_moments(
+        merge_moments(diffraction_moments(z[:3]), diffraction_moments(z[3:4])),
+        diffraction_moments(z[4:]))
+    assert count == 10
+    np.testing.assert_allclose(mean, z.mean(axis=0))
+    np.testing.assert_allclose(m2 / count, z.var(axis=0), rtol=1e-6)
+
+
+@pytest.mark.parametrize('shape', [(7,), (6, 5), (3, 4, 5)])
+def test_fit_shift_surface(shape):
+    grid = np.indices(shape).reshape(len(shape), -1).T
+    # A quadratic descan is recovered exactly from a subsample.
+    expected = np.stack([1 + grid.dot(np.arange(1, len(shape) + 1)),
+                         0.1 * grid[:, 0]**2 - grid[:, -1]], axis=-1)
+    sample = np.arange(0, len(grid), 2)
+    surface = fit_shift_surface(grid[sample], expected[sample], shape)
+    assert surface.shape == shape + (2,)
+    np.testing.assert_allclose(surface.reshape(-1, 2), expected, atol=1e-9)
+
+
+class TestShiftPatterns:
+
+    @pytest.fixture
+    def z(self):
+        return np.random.RandomState(0).rand(2, 3, 12, 14)
+
+    @pytest.fixture
+    def shifts(self):
+        return np.random.RandomState(1).uniform(-3, 3, (2, 3, 2))
+
+    def test_bilinear(self, z, shifts):
+        shifted = shift_patterns(z, shifts)
+        assert shifted.shape == z.shape
+        for index in np.ndindex(2, 3):
+            np.testing.assert_allclose(
+                shifted[index], ndi.shift(z[index], shifts[index], order=1,
+                                          cval=0), atol=1e-12)
+
+    def test_fourier(self, z, shifts):
+        shifts = np.round(shifts)
+        shifted = shift_patterns(z, shifts, interpolation='fourier')
+        for index in np.ndindex(2, 3):
+            expected = np.roll(z[index], shifts[index].astype(int), (0, 1))
+            np.testing.assert_allclose(shifted[index], expected, atol=1e-12)
+
+    def test_single(self, z):
+        np.testing.assert_allclose(shift_patterns(z[0, 0], [1.5, -0.5]),
+                                   ndi.shift(z[0, 0], [1.5, -0.5], order=1,
+                                             cval=0), atol=1e-12)
+
+    def test_affine(self, z, shifts):
+        # A rotation by 90 degrees about the centre and integer shifts only
+        # sample pixel centres, so that the fused interpolation is exact.
+        matrix = np.array([[0., -1., 0.], [1., 0., 0.], [0., 0., 1.]])
+        shifts = np.round(shifts)
+        shifted = shift_patterns(z, shifts, matrix=matrix)
+        correction = get_affine_correction(matrix, z.shape[-2:], 1)
+        for index in np.ndindex(2, 3):
+            expected = apply_affine_correction(
+                ndi.shift(z[index], shifts[index], order=0), correction)
+            np.testing.assert_allclose(shifted[index], expected, atol=1e-12)
+        np.testing.assert_allclose(
+            shift_patterns(z, shifts, matrix=np.identity(3)),
+            shift_patterns(z, shifts), atol=1e-12)
+
+    def test_invalid(self, z, shifts):
+        with pytest.raises(ValueError):
+            shift_patterns(z, shifts, interpolation='cubic')
+        with pytest.raises(ValueError):
+            shift_patterns(z, shifts, interpolation='fourier',
+                           matrix=np.identity(3))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+import dask.array as da
+
+from pyxem.signals.electron_diffraction import (ElectronDiffraction,
+                                                LazyElectronDiffraction)
+from pyxem.utils.expt_utils import (gain_normalise, remove_dead,
+                                    affine_transformation,
+                                    subtract_background_median)
+from pyxem.utils.pipeline_utils import PreprocessingPipeline
+
+
+@pytest.fixture
+def diffraction_pattern():
+    data = np.random.RandomState(0).rand(2, 3, 16, 16) + 1
+    return ElectronDiffraction(data)
+
+
+@pytest.fixture
+def references():
+    random = np.random.RandomState(1)
+    return random.rand(16, 16) * 0.1, random.rand(16, 16) + 2
+
+
+def test_pipeline(diffraction_pattern, references):
+    dark, bright = references
+    D = np.array([[1., 0.1, 0.], [0., 1., 0.], [0., 0., 1.]])
+    pipeline = PreprocessingPipeline()
+    pipeline.apply_gain_normalisation(dark, bright) \
+            .remove_deadpixels([(4, 5)]) \
+            .apply_affine_transformation(D, order=1) \
+            .remove_background('median', footprint=5)
+    processed = pipeline.apply(diffraction_pattern)
+
+    expected = np.empty_like(diffraction_pattern.data)
+    for index in np.ndindex(expected.shape[:2]):
+        z = gain_normalise(diffraction_pattern.data[index], dark, bright)
+        z = remove_dead(z, [(4, 5)])
+        z = affine_transformation(z, D, order=1)
+        expected[index] = subtract_background_median(z, footprint=5)
+    np.testing.assert_allclose(processed.data, expected, atol=1e-5)
+
+
+def test_pipeline_lazy(diffraction_pattern, references):
+    pipeline = PreprocessingPipeline()
+    pipeline.apply_gain_normalisation(*references) \
+            .remove_deadpixels([(4, 5)]) \
+            .center_direct_beam(2, 4) \
+            .remove_background('median', footprint=5)
+    lazy = LazyElectronDiffraction(
+        da.from_array(diffraction_pattern.data, chunks=(1, 2, 16, 16)))
+    np.testing.assert_allclose(
+        pipeline.apply(lazy).data.compute(),
+        pipeline.apply(diffraction_pattern).data)
+
+
+def test_process_stack(diffraction_pattern):
+    pipeline = PreprocessingPipeline().center_direct_beam(2, 4) \
+        .remove_background('median', footprint=5)
+    processed = pipeline.process(diffraction_pattern.data)
+    assert processed.shape == diffraction_pattern.data.shape
+    np.testing.assert_allclose(
+        processed[1, 2], pipeline.process(diffraction_pattern.data[1, 2]))
+
+
+def test_pipeline_unsupported_background():
+    with pytest.raises(NotImplementedError):
+        PreprocessingPipeline().remove_background('model')